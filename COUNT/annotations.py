@@ -0,0 +1,262 @@
+"""
+===================
+A N N O T A T I O N S
+===================
+Overlays saved as data instead of images, and drawn later only for the frames someone wants to look at.
+
+Saving every overlay frame (see overlay.py) draws and encodes every frame, although only a few are ever looked at.
+With params.save_annotations, nd2_mog_contours saves what the overlays show instead, as <file>_annotations.npz next to
+the results: the bounding box, object id and frames tracked of every detection, and the number of cells counted so far
+in every frame. That is a few int32 columns, megabytes for files whose overlays would take gigabytes, and tracking
+doesn't draw anything.
+
+The renderer opens the original file again and draws the annotations onto the requested frames only:
+
+    python -m COUNT.annotations results/file_annotations.npz --frames 1000:1200 --output frames/
+    python -m COUNT.annotations results/file_annotations.npz --ids 17 42 --output tracks.mp4
+
+Boxes are drawn in red instead of the contours, and ids are drawn on the objects detected in the frame.
+"""
+import argparse
+import dataclasses
+import json
+import os
+import typing
+
+import cv2 as cv
+import numpy as np
+
+from COUNT.frames import FrameConverter
+from COUNT.overlay import OverlayWriter
+from COUNT.parameters import TrackingParameters
+from COUNT.sources import open_source, split_stream, stream_path
+from COUNT.spill import RowFile, part_filename, save_columns
+
+# Columns of the detections in an annotations .npz file
+ANNOTATION_FIELDS = ['frame', 'object_id', 'x', 'y', 'w', 'h', 'frames_tracked']
+
+
+class AnnotationWriter:
+    """
+    Writes the annotations of every frame while tracking to a compact columnar .npz file.
+
+    The file holds one int32 column per detection field (frame, object_id, x, y, w, h, frames_tracked), sorted by
+    frame, the number of cells counted after each frame (total), plus image_h, total_frames, the path of the video and
+    the parameters it was tracked with (as settings.json text).
+
+    Like tracking.DetectionWriter, the rows and totals are written to spill.RowFile files as tracking goes
+    (<npz_filename>.part and <npz_filename>.total.part), and only copied into the .npz by save().
+
+    Methods
+    -------
+    append(frame_number: int, object_ids: np.ndarray, boxes: np.ndarray, frames_tracked: np.ndarray, total: int)
+        Adds the linked detections of a frame, and the number of cells counted so far. Called for every frame, in
+        order.
+
+    position() -> Tuple[Tuple[int, int], Tuple[int, int]]
+        RowFile.position() of the rows and of the totals, passing it back as resume_at continues from this point (see
+        checkpoint.py).
+
+    save() -> None
+        Writes the file.
+    """
+
+    def __init__(self, npz_filename, image_h, total_frames, source="", params: TrackingParameters = None,
+                 chunk_rows=100_000, resume_at=None):
+        self.npz_filename = npz_filename
+        self.image_h = image_h
+        self.total_frames = total_frames
+        self.source = source
+        self.params = params
+        rows_at, totals_at = resume_at if resume_at is not None else (None, None)
+        self.rows = RowFile(part_filename(npz_filename), len(ANNOTATION_FIELDS), chunk_rows=chunk_rows,
+                            resume_at=rows_at)
+        self.totals = RowFile(part_filename(npz_filename, "total"), 1, chunk_rows=chunk_rows, resume_at=totals_at)
+
+    def append(self, frame_number, object_ids, boxes, frames_tracked, total):
+        self.totals.append(total)
+        if len(boxes):
+            self.rows.append(np.column_stack([np.full(len(boxes), frame_number), object_ids, boxes, frames_tracked]))
+
+    def position(self):
+        return self.rows.position(), self.totals.position()
+
+    def save(self):
+        settings = json.dumps(self.params.to_settings()) if self.params is not None else ""
+        fields = {'total': self.totals.read()[:, 0], 'image_h': self.image_h, 'total_frames': self.total_frames,
+                  'source': self.source, 'parameters': settings}
+        save_columns(self.npz_filename, self.rows, ANNOTATION_FIELDS, fields)
+        del fields  # Release the memmap of the totals before removing its file
+        self.rows.remove()
+        self.totals.remove()
+
+
+class SavedAnnotations:
+    """
+    The contents of an annotations .npz file.
+
+    Attributes:
+    ----------
+    frame, object_id, frames_tracked : np.ndarray
+        Columns of the detections, sorted by frame.
+    boxes : np.ndarray
+        (N, 4) int32 (x, y, w, h) bounding box of each detection.
+    total : np.ndarray
+        Number of cells counted after each frame.
+    image_h, total_frames : int
+        Height and number of frames of the video.
+    source : str
+        Path of the video.
+    settings : dict
+        Parameters the video was tracked with, in the settings.json format.
+
+    Methods
+    -------
+    rows(frame_number: int) -> slice
+        The rows of the detections in a frame.
+
+    frames_with(object_ids: Iterable[int]) -> List[int]
+        Frame numbers where any of the objects was detected.
+    """
+
+    def __init__(self, npz_filename):
+        with np.load(npz_filename) as data:
+            self.frame = data["frame"]
+            self.object_id = data["object_id"]
+            self.boxes = np.stack([data["x"], data["y"], data["w"], data["h"]], axis=1)
+            self.frames_tracked = data["frames_tracked"]
+            self.total = data["total"]
+            self.image_h = int(data["image_h"])
+            self.total_frames = int(data["total_frames"])
+            self.source = str(data["source"])
+            parameters = str(data["parameters"])
+        self.settings = json.loads(parameters) if parameters else {}
+        # First and last (exclusive) row of every frame
+        self.bounds = np.searchsorted(self.frame, np.arange(self.total_frames + 1))
+
+    def __len__(self):
+        return len(self.frame)
+
+    def rows(self, frame_number):
+        return slice(self.bounds[frame_number], self.bounds[frame_number + 1])
+
+    def frames_with(self, object_ids):
+        return np.unique(self.frame[np.isin(self.object_id, list(object_ids))]).tolist()
+
+
+def draw_annotations(image, annotations: SavedAnnotations, frame_number, timeout, object_ids=None) -> None:
+    """
+    Draws the annotations of a frame onto a BGR image, like the overlays saved while tracking.
+
+    Args:
+        image (np.ndarray): BGR frame, drawn on in place.
+        annotations (SavedAnnotations): The annotations.
+        frame_number (int): Frame to draw.
+        timeout (int): Ids are drawn on objects tracked for more than timeout // 2 frames.
+        object_ids (Collection[int], optional): Only draw these objects.
+    """
+    rows = annotations.rows(frame_number)
+    boxes = annotations.boxes[rows].tolist()
+    ids = annotations.object_id[rows].tolist()
+    frames_tracked = annotations.frames_tracked[rows].tolist()
+
+    cv.putText(image, f"Frame: {frame_number} In-Frame: {len(boxes)} Total: {int(annotations.total[frame_number])}",
+               (10, 40), cv.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2, cv.LINE_AA)
+    for (x, y, w, h), object_id, tracked in zip(boxes, ids, frames_tracked):
+        if object_ids is not None and object_id not in object_ids:
+            continue
+        cv.rectangle(image, (x, y), (x + w - 1, y + h - 1), (0, 0, 255), 2)
+        if tracked > timeout // 2:
+            cv.putText(image, str(object_id), (x, y), cv.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 1, cv.LINE_AA)
+
+
+def render_annotations(npz_filename: str, frame_numbers: typing.Optional[typing.Iterable[int]] = None,
+                       object_ids: typing.Optional[typing.Collection[int]] = None,
+                       source_path: typing.Optional[str] = None) -> typing.Iterator[typing.Tuple[int, np.ndarray]]:
+    """
+    Draws saved annotations onto the frames of the original file.
+
+    Args:
+        npz_filename (str): Annotations saved by nd2_mog_contours (see AnnotationWriter).
+        frame_numbers (Iterable[int], optional): Frames to draw. Default: every frame, or with object_ids, every
+            frame where one of the objects was detected.
+        object_ids (Collection[int], optional): Only draw these objects.
+        source_path (str, optional): The original file, if it has moved since tracking. The annotations of a stream
+            of a multipoint file are drawn on the same stream of source_path.
+
+    Yields:
+        typing.Tuple[int, np.ndarray]: (frame number, BGR image) of each frame, in order.
+    """
+    annotations = SavedAnnotations(npz_filename)
+    params = TrackingParameters.from_settings(annotations.settings)
+    if object_ids is not None:
+        object_ids = set(object_ids)
+        frames_with_ids = annotations.frames_with(object_ids)
+        if frame_numbers is None:
+            frame_numbers = frames_with_ids
+        else:
+            frame_numbers = sorted(set(frame_numbers) & set(frames_with_ids))
+    elif frame_numbers is None:
+        frame_numbers = range(annotations.total_frames)
+
+    if source_path is not None and not split_stream(source_path)[1]:
+        source_path = stream_path(source_path, split_stream(annotations.source)[1])
+    with open_source(source_path or annotations.source) as source:
+        # The same 8-bit conversion as tracking
+        converter = FrameConverter(source, params)
+        for frame_number in frame_numbers:
+            frame = converter.convert(np.asarray(source[frame_number]), frame_number)
+            image = cv.cvtColor(frame, cv.COLOR_GRAY2BGR)
+            draw_annotations(image, annotations, frame_number, params.timeout, object_ids)
+            yield frame_number, image
+
+
+def parse_frames(text: str) -> range:
+    """'start:stop' (stop excluded), 'start:' or a single frame number"""
+    if ":" not in text:
+        return range(int(text), int(text) + 1)
+    start, stop = text.split(":", 1)
+    return range(int(start or 0), int(stop) if stop else 2**31 - 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Draw saved annotations onto the frames of the original file.")
+    parser.add_argument("path", help="_annotations.npz file")
+    parser.add_argument("--frames", help="frames to draw, e.g. 1000:1200 (default: all, or the frames of --ids)")
+    parser.add_argument("--ids", type=int, nargs="+", help="only draw these object ids")
+    parser.add_argument("--source", help="the original file, if it has moved since tracking")
+    parser.add_argument("--output", required=True, help=".mp4 video to save, or a folder to save .png frames in")
+    args = parser.parse_args()
+
+    annotations = SavedAnnotations(args.path)
+    frame_numbers = None
+    if args.frames:
+        frames = parse_frames(args.frames)
+        frame_numbers = range(frames.start, min(frames.stop, annotations.total_frames))
+    images = render_annotations(args.path, frame_numbers, args.ids, args.source)
+
+    count = 0
+    if args.output.lower().endswith(".mp4"):
+        # Every rendered frame goes into the video
+        params = dataclasses.replace(TrackingParameters.from_settings(annotations.settings), overlay_every=1)
+        writer = None
+        for _, image in images:
+            if writer is None:
+                writer = OverlayWriter(args.output, image.shape, params)
+            writer.write(0, image)
+            count += 1
+        if writer is not None:
+            writer.close()
+    else:
+        os.makedirs(args.output, exist_ok=True)
+        file_name = os.path.basename(args.path)
+        file_name = file_name[:-len("_annotations.npz")] if file_name.endswith("_annotations.npz") else \
+            os.path.splitext(file_name)[0]
+        for frame_number, image in images:
+            cv.imwrite(os.path.join(args.output, f"{file_name}_{frame_number:06d}.png"), image)
+            count += 1
+    print(f"{count} frames saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""
+===================
+B A C K G R O U N D
+===================
+The background models that find the moving objects (foreground) in each frame.
+
+Every engine has the same apply(frame, fgmask=None) -> mask method as OpenCV's background subtractors: it takes the
+8-bit frames in order and returns a 0/255 foreground mask, written into fgmask if given. params.background_engine
+picks one:
+
+    mog2      cv.BackgroundSubtractorMOG2, a mixture of gaussians per pixel (the original engine)
+    knn       cv.BackgroundSubtractorKNN, nearest neighbours per pixel
+    median    TemporalMedianBackground: the median of frames sampled every background_stride frames, refreshed every
+              background_refresh frames, and foreground wherever a frame differs from it by more than
+              background_threshold
+
+The channel behind the cells barely changes during a file, so a per-pixel model updated on every frame is mostly
+wasted work. The median engine only does an absdiff and a threshold per frame, plus one median every
+background_refresh frames.
+
+To compare the engines on a file (time and counts):
+
+    python -m COUNT.background path/to/file.nd2 --settings settings.json
+"""
+import argparse
+import dataclasses
+import time
+import typing
+
+import cv2 as cv
+import numpy as np
+
+from COUNT.parameters import TrackingParameters
+
+BACKGROUND_ENGINES = ("mog2", "knn", "median")
+
+
+class TemporalMedianBackground:
+    """
+    Background made of the per-pixel median of sampled frames, with a plain absdiff / threshold foreground.
+
+    Every stride-th frame is kept as a sample, up to samples frames (the oldest is replaced after that). The background
+    is the median of the samples, recomputed every refresh frames, or only once all the samples are in if refresh is 0.
+    Until then it is recomputed on every new sample. Cells that cover a pixel in less than half of the samples don't
+    show up in the median.
+
+    Args:
+        threshold (int): Difference from the background (8-bit grey levels) above which a pixel is foreground.
+        samples (int): Number of sampled frames the median is taken over.
+        stride (int): Keep one frame out of every stride as a sample.
+        refresh (int): Recompute the background every refresh frames. 0: never, once all samples are in.
+
+    Methods
+    -------
+    apply(frame: np.ndarray, fgmask: np.ndarray = None) -> np.ndarray
+        Adds the frame to the samples if it is due, and returns its 0/255 foreground mask.
+
+    getBackgroundImage() -> np.ndarray
+        The current background.
+    """
+
+    def __init__(self, threshold=25, samples=25, stride=10, refresh=250):
+        self.threshold = threshold
+        self.samples = max(1, samples)
+        self.stride = max(1, stride)
+        self.refresh = refresh
+        self.frame_count = 0
+        self.sample_count = 0
+        self.buffer = None
+        self.background = None
+        self.difference = None
+        self.last_update = None
+
+    def add_sample(self, frame):
+        if self.buffer is None or self.buffer.shape[1:] != frame.shape:
+            self.buffer = np.empty((self.samples,) + frame.shape, dtype=np.uint8)
+            self.background = np.empty(frame.shape, dtype=np.uint8)
+            self.difference = np.empty(frame.shape, dtype=np.uint8)
+            self.sample_count = 0
+        self.buffer[self.sample_count % self.samples] = frame
+        self.sample_count += 1
+
+    def update_background(self):
+        filled = self.buffer[:min(self.sample_count, self.samples)]
+        if len(filled) % 2:
+            # Odd number of samples: the median is the middle value, one partition is enough
+            np.copyto(self.background, np.partition(filled, len(filled) // 2, axis=0)[len(filled) // 2])
+        else:
+            np.copyto(self.background, np.median(filled, axis=0), casting="unsafe")
+        self.last_update = self.frame_count
+
+    def apply(self, frame, fgmask=None, learningRate=-1):
+        new_sample = self.frame_count % self.stride == 0
+        if new_sample:
+            self.add_sample(frame)
+        filling = self.sample_count <= self.samples
+        if self.last_update is None or (new_sample and filling) or \
+                (self.refresh > 0 and self.frame_count - self.last_update >= self.refresh):
+            self.update_background()
+        self.frame_count += 1
+
+        cv.absdiff(frame, self.background, self.difference)
+        _, fgmask = cv.threshold(self.difference, self.threshold, 255, cv.THRESH_BINARY, dst=fgmask)
+        return fgmask
+
+    def getBackgroundImage(self):
+        return self.background
+
+
+def create_background(params: TrackingParameters):
+    """A new background model for one file, see params.background_engine"""
+    if params.background_engine == "mog2":
+        return cv.createBackgroundSubtractorMOG2(varThreshold=16, detectShadows=False)
+    if params.background_engine == "knn":
+        return cv.createBackgroundSubtractorKNN(detectShadows=False)
+    if params.background_engine == "median":
+        return TemporalMedianBackground(params.background_threshold, params.background_samples,
+                                        params.background_stride, params.background_refresh)
+    raise ValueError(f"Unknown background engine: {params.background_engine}, expected one of "
+                     f"{', '.join(BACKGROUND_ENGINES)}")
+
+
+def benchmark_engines(nd2_file_path: str, params: TrackingParameters,
+                      engines: typing.Sequence[str] = BACKGROUND_ENGINES) -> typing.List[typing.Dict[str, typing.Any]]:
+    """
+    Tracks a file once with each background engine.
+
+    Returns:
+        List[dict]: One row per engine with 'engine', 'seconds', 'fps', 'cells_counted', 'DEP_true', 'DEP_false' and
+            'agreement' (cells counted relative to the first engine).
+    """
+    from COUNT.tracking import nd2_mog_contours  # tracking.py imports this module
+    # Time the background model, not the cache or the overlays
+    params = dataclasses.replace(params, save_overlay=False, frame_cache_dir="")
+    rows = []
+    for engine in engines:
+        frame_count = [0]
+
+        def progress(frames_in_batch, total_frames):
+            frame_count[0] += frames_in_batch
+
+        start = time.perf_counter()
+        expired_objects_dict, _ = nd2_mog_contours(nd2_file_path, dataclasses.replace(params, background_engine=engine),
+                                                   progress=progress)
+        seconds = time.perf_counter() - start
+        DEP_true = sum(1 for obj in expired_objects_dict.values() if obj.DEP_outlet is True)
+        rows.append({'engine': engine, 'seconds': round(seconds, 3), 'fps': round(frame_count[0] / seconds, 1),
+                     'cells_counted': len(expired_objects_dict), 'DEP_true': DEP_true,
+                     'DEP_false': len(expired_objects_dict) - DEP_true})
+    for row in rows:
+        reference = rows[0]['cells_counted']
+        row['agreement'] = round(row['cells_counted'] / reference, 3) if reference else 0.0
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the background engines on one file.")
+    parser.add_argument("path", help="file to track (.nd2, .tif, .avi, .npy or .raw)")
+    parser.add_argument("--settings", default="settings.json", help="settings .json file (default: settings.json)")
+    parser.add_argument("--engines", nargs="+", default=list(BACKGROUND_ENGINES), choices=BACKGROUND_ENGINES,
+                        help="engines to compare, the first one is the reference (default: all)")
+    args = parser.parse_args()
+
+    params = TrackingParameters.from_settings_file(args.settings)
+
+    rows = benchmark_engines(args.path, params, args.engines)
+    print()
+    for row in rows:
+        print(f"\t{row['engine']:>8}: {row['seconds']:8.2f} s, {row['fps']:8.1f} frames/s, "
+              f"{row['cells_counted']} cells counted (x{row['agreement']}), "
+              f"DEP True: {row['DEP_true']}, DEP False: {row['DEP_false']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""
+===================
+B A T C H
+===================
+Runs the tracking on many .nd2 files at once, one file per worker process.
+
+main.py processes the files chosen in the UI one after another. This module is for folders of files (e.g. a whole
+frequency sweep) on a machine with many cores. It can be run from the command line without the UI:
+
+    python -m COUNT.batch path/to/folder --settings settings.json --workers 16
+
+Each worker runs nd2_mog_contours and both csv exports for one file. OpenCV is limited to a few threads per worker
+so the workers don't fight over the cores. Progress from every worker is combined into one progress bar, and a file
+that fails is reported at the end without stopping the others.
+
+The positions of a multipoint .nd2 file are unrelated fields of view, so each one is tracked as a file of its own (a
+stream, see sources.list_streams), by its own worker, with its own results named e.g. movie_m2_results.csv. The counts
+of all positions of a file are added up in movie_positions.csv.
+"""
+import argparse
+import csv
+import dataclasses
+import multiprocessing
+import os
+import threading
+import traceback
+import typing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2 as cv
+from tqdm import tqdm
+
+from COUNT import sources, tracking
+from COUNT.parameters import TrackingParameters
+
+
+def process_file(nd2_file: str, params: TrackingParameters,
+                 progress: typing.Optional[typing.Callable[[int, int], None]] = None,
+                 verbose: bool = True) -> typing.Dict[str, typing.Any]:
+    """
+    Track one file and export both csv files. Errors are caught and returned rather than raised.
+
+    Args:
+        nd2_file (str): Path to the .nd2 file.
+        params (TrackingParameters): Tracking parameters. Results are saved in params.csv_save_path.
+        progress (Callable[[int, int], None], optional): Passed on to nd2_mog_contours (or count_objects if
+            params.count_only).
+        verbose (bool): Print the results of each export.
+
+    Returns:
+        dict: Summary of the file with keys 'file', 'cells_counted', 'DEP_true', 'DEP_false' and 'error'.
+            'error' is an empty string if the file was processed without problems.
+    """
+    result = {'file': nd2_file, 'cells_counted': 0, 'DEP_true': 0, 'DEP_false': 0, 'error': ''}
+    try:
+        # Get the filename without extension, plus the position of a multipoint file
+        file_name = sources.stream_name(nd2_file)
+
+        csv_filename = os.path.join(params.csv_save_path, f"{file_name}_results.csv")
+        trajectory_csv_filename = os.path.join(params.csv_save_path, f"{file_name}_trajectory_results.csv")
+        detections_filename = None
+        if params.save_detections:
+            detections_filename = os.path.join(params.csv_save_path, f"{file_name}_detections.npz")
+        annotations_filename = None
+        if params.save_annotations:
+            annotations_filename = os.path.join(params.csv_save_path, f"{file_name}_annotations.npz")
+        checkpoint_filename = None
+        if params.checkpoint_every > 0:
+            checkpoint_filename = os.path.join(params.csv_save_path, f"{file_name}_checkpoint.pkl")
+
+        if params.count_only:
+            # Screening: only the counts, one row in <file>_counts.csv
+            counts = tracking.count_objects(nd2_file, params, progress=progress,
+                                            checkpoint_filename=checkpoint_filename)
+            tracking.export_counts_to_csv(nd2_file, counts,
+                                          os.path.join(params.csv_save_path, f"{file_name}_counts.csv"),
+                                          verbose=verbose)
+            result.update(counts)
+            return result
+
+        # Track the nd2 file using MOG2 background subtraction. Trajectories are written while tracking
+        object_final_position, _ = tracking.nd2_mog_contours(nd2_file, params, progress=progress,
+                                                             trajectory_csv_filename=trajectory_csv_filename,
+                                                             detections_filename=detections_filename,
+                                                             annotations_filename=annotations_filename,
+                                                             checkpoint_filename=checkpoint_filename)
+        if verbose:
+            print(f"\n{trajectory_csv_filename} saved")
+
+        DEP_true, DEP_false = tracking.export_to_csv(object_final_position, csv_filename, verbose=verbose)
+
+        result.update(cells_counted=len(object_final_position), DEP_true=DEP_true, DEP_false=DEP_false)
+    except Exception as e:
+        result['error'] = f"{e}\n{traceback.format_exc()}"
+    return result
+
+
+def _init_worker(opencv_threads: int) -> None:
+    """Runs once in every worker process"""
+    cv.setNumThreads(opencv_threads)
+
+
+def _process_file_worker(nd2_file: str, params: TrackingParameters, progress_queue) -> typing.Dict[str, typing.Any]:
+    """Worker side of run_batch. Frame progress is sent back to the main process through progress_queue"""
+    def progress(frames_done, total_frames):
+        progress_queue.put((nd2_file, frames_done, total_frames))
+
+    return process_file(nd2_file, params, progress=progress, verbose=False)
+
+
+def _show_progress(progress_queue, progress_bar) -> None:
+    """Combines the frame progress of every worker into one progress bar. Stops when None is received"""
+    totals = {}
+    for message in iter(progress_queue.get, None):
+        nd2_file, frames_done, total_frames = message
+        if nd2_file not in totals:
+            totals[nd2_file] = total_frames
+            progress_bar.total = sum(totals.values())
+            progress_bar.refresh()
+        progress_bar.update(frames_done)
+
+
+def run_batch(files: typing.List[str], params: TrackingParameters, workers: typing.Optional[int] = None,
+              opencv_threads: int = 1) -> typing.List[typing.Dict[str, typing.Any]]:
+    """
+    Track many files at once in a process pool.
+
+    Args:
+        files (List[str]): Paths to the .nd2 files.
+        params (TrackingParameters): Tracking parameters, used for every file.
+        workers (int, optional): Number of worker processes. Defaults to the number of cores, or the number of files
+            if that is smaller.
+        opencv_threads (int): Max number of threads OpenCV may use inside each worker.
+
+    Returns:
+        List[dict]: The process_file summary of every file, in the same order as files.
+    """
+    if not files:
+        return []
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(files)))
+    os.makedirs(params.csv_save_path, exist_ok=True)
+    if params.save_overlay:
+        os.makedirs(params.overlay_path, exist_ok=True)
+
+    results = {}
+    with multiprocessing.Manager() as manager:
+        progress_queue = manager.Queue()
+        with tqdm(total=0, desc=f"{len(files)} files, {workers} workers", unit="frame") as progress_bar:
+            progress_thread = threading.Thread(target=_show_progress, args=(progress_queue, progress_bar), daemon=True)
+            progress_thread.start()
+
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(opencv_threads,)) as executor:
+                futures = {executor.submit(_process_file_worker, nd2_file, params, progress_queue): nd2_file
+                           for nd2_file in files}
+                for future in as_completed(futures):
+                    nd2_file = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:  # e.g. a worker process crashed
+                        result = {'file': nd2_file, 'cells_counted': 0, 'DEP_true': 0, 'DEP_false': 0,
+                                  'error': f"{type(e).__name__}: {e}"}
+                    results[nd2_file] = result
+                    status = "FAILED" if result['error'] else f"{result['cells_counted']} cells"
+                    progress_bar.write(f"{os.path.basename(nd2_file)}: {status}")
+
+            progress_queue.put(None)
+            progress_thread.join()
+
+    return [results[nd2_file] for nd2_file in files]
+
+
+def find_nd2_files(paths: typing.List[str]) -> typing.List[str]:
+    """Expands folders into the .nd2 files (and other files sources.open_source can read) they contain"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, f) for f in os.listdir(path) if sources.is_supported(f)))
+        else:
+            files.append(path)
+    return files
+
+
+def find_streams(files: typing.List[str], axes: str = "m") -> typing.List[str]:
+    """
+    Expands multipoint files into their streams (see sources.list_streams). A file that can't be opened is kept as it
+    is, so process_file reports the error.
+    """
+    streams = []
+    for path in files:
+        try:
+            streams.extend(sources.list_streams(path, axes))
+        except Exception as e:
+            print(f"Couldn't list the positions of {path}: {e}")
+            streams.append(path)
+    return streams
+
+
+def combine_streams(results: typing.List[typing.Dict[str, typing.Any]]) -> typing.List[typing.Dict[str, typing.Any]]:
+    """
+    Adds up the process_file summaries of the streams of each file.
+
+    Returns:
+        List[dict]: One summary per file, in the order of results, with keys 'file', 'streams', 'failed',
+            'cells_counted', 'DEP_true' and 'DEP_false'.
+    """
+    combined = {}
+    for result in results:
+        file_path, _ = sources.split_stream(result['file'])
+        total = combined.setdefault(file_path, {'file': file_path, 'streams': 0, 'failed': 0, 'cells_counted': 0,
+                                                'DEP_true': 0, 'DEP_false': 0})
+        total['streams'] += 1
+        total['failed'] += bool(result['error'])
+        for key in ('cells_counted', 'DEP_true', 'DEP_false'):
+            total[key] += result[key]
+    return list(combined.values())
+
+
+def export_position_summaries(results: typing.List[typing.Dict[str, typing.Any]], csv_save_path: str,
+                              verbose: bool = True) -> typing.List[str]:
+    """
+    Saves <file>_positions.csv for each file that was tracked as several streams: the counts of every stream, and
+    their total on the last row.
+
+    Returns:
+        List[str]: The saved .csv files.
+    """
+    csv_filenames = []
+    for total in combine_streams(results):
+        if total['streams'] < 2:
+            continue
+        file_name = os.path.splitext(os.path.basename(total['file']))[0]
+        csv_filename = os.path.join(csv_save_path, f"{file_name}_positions.csv")
+        with open(csv_filename, 'w', newline='') as csvfile:
+            fieldnames = ['stream', 'cells_counted', 'DEP_true', 'DEP_false', 'error']
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer.writeheader()
+            for result in results:
+                file_path, coordinates = sources.split_stream(result['file'])
+                if file_path == total['file']:
+                    writer.writerow({'stream': ",".join(f"{axis}={value}" for axis, value in coordinates.items()),
+                                     'cells_counted': result['cells_counted'], 'DEP_true': result['DEP_true'],
+                                     'DEP_false': result['DEP_false'],
+                                     'error': result['error'].splitlines()[0] if result['error'] else ''})
+            writer.writerow({'stream': 'total', 'cells_counted': total['cells_counted'], 'DEP_true': total['DEP_true'],
+                             'DEP_false': total['DEP_false'],
+                             'error': f"{total['failed']} failed" if total['failed'] else ''})
+        if verbose:
+            print(f"{csv_filename} saved")
+        csv_filenames.append(csv_filename)
+    return csv_filenames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Track many .nd2 files at once.")
+    parser.add_argument("paths", nargs="+", help=".nd2 files and/or folders containing .nd2 files "
+                                                 "(or .tif, .avi, .npy and .raw files)")
+    parser.add_argument("--settings", default="settings.json", help="settings .json file (default: settings.json)")
+    parser.add_argument("--output", help="folder to save the .csv results in (default: csv_save_path in settings)")
+    parser.add_argument("--workers", type=int, help="number of worker processes (default: number of cores)")
+    parser.add_argument("--opencv-threads", type=int, default=1, help="OpenCV threads per worker (default: 1)")
+    args = parser.parse_args()
+
+    params = TrackingParameters.from_settings_file(args.settings)
+    if args.output:
+        params = dataclasses.replace(params, csv_save_path=args.output)
+    params = dataclasses.replace(params, overlay_path=os.path.join(params.csv_save_path, "overlay/"))
+
+    files = find_streams(find_nd2_files(args.paths), params.stream_axes)
+    results = run_batch(files, params, workers=args.workers, opencv_threads=args.opencv_threads)
+
+    print("\nBatch Results:")
+    for result in results:
+        if result['error']:
+            print(f"\t{result['file']}: FAILED\n{result['error']}")
+        else:
+            print(f"\t{result['file']}: {result['cells_counted']} cells counted, "
+                  f"DEP True: {result['DEP_true']}, DEP False: {result['DEP_false']}")
+    for total in combine_streams(results):
+        if total['streams'] > 1:
+            print(f"\t{total['file']}: {total['streams']} positions, {total['cells_counted']} cells counted, "
+                  f"DEP True: {total['DEP_true']}, DEP False: {total['DEP_false']}")
+    export_position_summaries(results, params.csv_save_path)
+    failed = sum(1 for result in results if result['error'])
+    print(f"{len(results) - failed} of {len(results)} files processed successfully")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""
+===================
+C A C H E
+===================
+On-disk cache of decoded frames, for running the same file again and again (e.g. while tuning canny_lower,
+canny_upper and cell_radius).
+
+Every run of nd2_mog_contours decodes each frame, converts it to 8-bit and runs MOG2 on it, and none of that depends on
+the detection or tracking parameters. With params.frame_cache_dir set, the first run of a file saves the 8-bit frames
+(and, with params.cache_masks, the foreground masks) as .npy files. Later runs memory-map them and go straight to
+detection.
+
+An entry is keyed by the file (path, size and modification time) and the parameters used to make the 8-bit frames and
+the masks, so changing the file, intensity_window or background_engine makes a new entry. Entries are only saved once a
+whole file has been processed. When the cache grows past params.frame_cache_mb, the least recently used entries are
+deleted.
+
+Each entry is a folder:
+
+    <frame_cache_dir>/<key>/frames.npy      (frames, height, width) uint8
+    <frame_cache_dir>/<key>/masks.npy       (frames, height, width) uint8, if masks were cached
+    <frame_cache_dir>/<key>/entry.json      the file and parameters the entry was made from
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import typing
+
+import numpy as np
+
+from COUNT.parameters import TrackingParameters
+from COUNT.sources import split_stream
+
+# Change when the frames or masks saved for the same file and parameters would change, e.g. new MOG2 settings
+CACHE_VERSION = 1
+# Parameters that change the 8-bit frames
+FRAME_PARAMETERS = ("intensity_window", "window_samples", "window_refresh", "roi_x", "roi_y", "roi_width",
+                    "roi_height")
+# Parameters that change the foreground masks
+MASK_PARAMETERS = ("background_engine", "background_threshold", "background_samples", "background_stride",
+                   "background_refresh")
+
+
+class CachedFrames:
+    """
+    A cache entry: memory-mapped 8-bit frames, and their foreground masks if they were cached.
+
+    Attributes:
+    ----------
+    frames : np.ndarray
+        (frames, height, width) uint8 frames.
+    masks : np.ndarray or None
+        (frames, height, width) uint8 MOG2 foreground masks.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.frames = np.load(os.path.join(folder, "frames.npy"), mmap_mode="r")
+        masks_path = os.path.join(folder, "masks.npy")
+        self.masks = np.load(masks_path, mmap_mode="r") if os.path.exists(masks_path) else None
+
+    @property
+    def shape(self):
+        return self.frames.shape[1:]
+
+    def __len__(self):
+        return self.frames.shape[0]
+
+
+class CacheWriter:
+    """
+    Saves the frames of one run into a new cache entry. Frames are written as they are added, and the entry only
+    appears in the cache when commit() is called. Otherwise it is thrown away when the writer is closed.
+
+    Methods
+    -------
+    add(frame_number: int, frame: np.ndarray, mask: np.ndarray)
+        Saves an 8-bit frame and its foreground mask.
+
+    commit()
+        Adds the entry to the cache, then evicts old entries if the cache is too large.
+
+    close()
+        Throws the entry away if it wasn't committed. Also called when used as a context manager.
+    """
+
+    def __init__(self, cache, key, info, frame_count, shape, masks):
+        self.cache = cache
+        self.key = key
+        self.info = info
+        self.folder = tempfile.mkdtemp(prefix=f".{key}-", dir=cache.cache_dir)
+        self.frames = np.lib.format.open_memmap(os.path.join(self.folder, "frames.npy"), mode="w+",
+                                                dtype=np.uint8, shape=(frame_count,) + tuple(shape))
+        self.masks = None
+        if masks:
+            self.masks = np.lib.format.open_memmap(os.path.join(self.folder, "masks.npy"), mode="w+",
+                                                   dtype=np.uint8, shape=(frame_count,) + tuple(shape))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, frame_number, frame, mask):
+        self.frames[frame_number] = frame
+        if self.masks is not None:
+            self.masks[frame_number] = mask
+
+    def commit(self):
+        self.frames.flush()
+        if self.masks is not None:
+            self.masks.flush()
+        self.frames = self.masks = None
+        with open(os.path.join(self.folder, "entry.json"), "w") as file:
+            json.dump(self.info, file, indent=4)
+        entry_folder = os.path.join(self.cache.cache_dir, self.key)
+        try:
+            os.rename(self.folder, entry_folder)
+        except OSError:  # Another run saved the same entry first
+            shutil.rmtree(self.folder, ignore_errors=True)
+        self.folder = None
+        self.cache.evict()
+
+    def close(self):
+        self.frames = self.masks = None
+        if self.folder is not None:
+            shutil.rmtree(self.folder, ignore_errors=True)
+            self.folder = None
+
+
+class FrameCache:
+    """
+    The cache folder.
+
+    Args:
+        cache_dir (str): Folder the entries are saved in.
+        max_mb (int): Max size of all entries together (MB).
+
+    Methods
+    -------
+    key(path: str, params: TrackingParameters) -> str
+        Cache key of a file processed with the given parameters.
+
+    lookup(path: str, params: TrackingParameters) -> Optional[CachedFrames]
+        The cached frames of a file, or None if they aren't cached.
+
+    writer(path: str, params: TrackingParameters, frame_count: int, shape: Tuple[int, int]) -> Optional[CacheWriter]
+        A writer for a new entry, or None if the file wouldn't fit in the cache.
+
+    evict()
+        Deletes the least recently used entries until the cache fits in max_mb.
+    """
+
+    def __init__(self, cache_dir, max_mb):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb * 2**20)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def info(self, path, params: TrackingParameters) -> typing.Dict[str, typing.Any]:
+        # One entry per stream of a multipoint file, see sources.list_streams
+        stat = os.stat(split_stream(path)[0])
+        return {"version": CACHE_VERSION,
+                "path": os.path.abspath(path),
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "parameters": {name: getattr(params, name) for name in FRAME_PARAMETERS + MASK_PARAMETERS}}
+
+    def key(self, path, params: TrackingParameters) -> str:
+        info = json.dumps(self.info(path, params), sort_keys=True)
+        return hashlib.sha1(info.encode()).hexdigest()
+
+    def lookup(self, path, params: TrackingParameters) -> typing.Optional[CachedFrames]:
+        folder = os.path.join(self.cache_dir, self.key(path, params))
+        if not os.path.exists(os.path.join(folder, "entry.json")):
+            return None
+        # Mark as recently used
+        os.utime(os.path.join(folder, "entry.json"))
+        return CachedFrames(folder)
+
+    def writer(self, path, params: TrackingParameters, frame_count, shape) -> typing.Optional[CacheWriter]:
+        entry_bytes = frame_count * int(np.prod(shape)) * (2 if params.cache_masks else 1)
+        if entry_bytes > self.max_bytes:
+            return None
+        return CacheWriter(self, self.key(path, params), self.info(path, params), frame_count, shape,
+                           masks=params.cache_masks)
+
+    def entries(self) -> typing.List[typing.Tuple[str, int, float]]:
+        """(folder, size in bytes, last used) of every entry"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            folder = os.path.join(self.cache_dir, name)
+            entry_file = os.path.join(folder, "entry.json")
+            if name.startswith(".") or not os.path.exists(entry_file):
+                continue  # Not committed yet
+            size = sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder))
+            entries.append((folder, size, os.path.getmtime(entry_file)))
+        return entries
+
+    def evict(self) -> None:
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for folder, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(folder, ignore_errors=True)
+            total -= size
@@ -0,0 +1,139 @@
+"""
+===================
+C H E C K P O I N T
+===================
+Saving the progress of a long run, so it can continue after a crash or a reboot instead of starting over.
+
+With params.checkpoint_every > 0, nd2_mog_contours saves a checkpoint after every checkpoint_every frames (rounded up
+to a whole batch). Only the live state is pickled: the next frame number and the Tracker without its counted objects
+(the surviving objects, the grid, the deadline heap, the counters and next_new_id). Everything that grows with the run
+is on disk already, and the checkpoint only records how far each file got, as (rows, size in bytes): the trajectory
+.csv file, the .part files of the detections and annotations (see spill.py), and the side files of the checkpoint
+itself, <checkpoint>.counted (counted objects), <checkpoint>.history (the in-memory TrackTable) and <checkpoint>.status
+(status of each frame, with a motion gate, see gating.py). Each checkpoint only appends what is new to the side files,
+and continuing truncates every file back to the recorded size. The checkpoint and its side files are deleted when the
+file is finished.
+
+When a run starts and finds a checkpoint made from the same file with the same parameters, it continues from there.
+Everything up to the checkpoint (tracks, ids, rows of the trajectory file) is exactly what the interrupted run had.
+
+Tolerance: MOG2 has no state that can be saved, so it is warmed up again on the params.checkpoint_warmup frames before
+the checkpoint. Its foreground masks then match those of an uninterrupted run except for the first frames after the
+checkpoint (about 10 to 15 frames on test videos, with the default warm-up of 200 frames). Only objects seen in those
+frames can be detected differently, so the count can change by the few cells passing at that moment, and the ids
+given out after the checkpoint can be shifted. The results are exactly the same as an uninterrupted run when the masks
+come from the frame cache (see cache.py), or when checkpoint_warmup reaches back to the first frame. A run that
+continues from a checkpoint reads the frame cache but never fills it, only runs from the first frame do.
+
+The motion gate starts again at full rate after the checkpoint, as after the first frame, so frames an uninterrupted
+run would have skipped while idle can go through detection instead. Without frame statuses (params.count_only), the
+counts of its summary can include the few frames detection workers had already read past the checkpoint.
+"""
+import os
+import pickle
+import typing
+
+import numpy as np
+
+from COUNT.parameters import TrackingParameters
+from COUNT.sources import split_stream
+from COUNT.spill import RowFile, part_filename
+
+# Change when the contents of a checkpoint change
+CHECKPOINT_VERSION = 1
+# Side files of a checkpoint: {name: (width, dtype)}, see checkpoint_rows
+CHECKPOINT_ROWS = {'counted': (8, np.int32), 'history': (8, np.int32), 'status': (1, np.uint8)}
+
+
+def source_identity(path: str) -> typing.Tuple[str, int, int]:
+    """(absolute path, size, modification time) of a file (or stream), to check a checkpoint belongs to it"""
+    stat = os.stat(split_stream(path)[0])
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+
+def save_checkpoint(checkpoint_filename: str, nd2_file_path: str, params: TrackingParameters,
+                    state: typing.Dict[str, typing.Any]) -> None:
+    """
+    Saves the state of a run. The file is replaced in one step, so a crash while saving leaves the previous
+    checkpoint in place.
+
+    Args:
+        checkpoint_filename (str): Checkpoint file to write.
+        nd2_file_path (str): The file being tracked.
+        params (TrackingParameters): The parameters of the run.
+        state (dict): Everything needed to continue, must be picklable: 'next_frame', 'tracker' (without counted
+            objects), the positions of the files written so far, or None: 'trajectory' (TrajectoryWriter.position()),
+            'detections' (DetectionWriter.position()), 'annotations' (AnnotationWriter.position()), 'counted',
+            'history' and 'status' (RowFile.position() of the side files), and 'gate_totals' (MotionGate.totals,
+            when the gate keeps no status).
+    """
+    checkpoint = {'version': CHECKPOINT_VERSION, 'source': source_identity(nd2_file_path), 'params': params,
+                  **state}
+    temporary_filename = checkpoint_filename + ".tmp"
+    with open(temporary_filename, "wb") as file:
+        pickle.dump(checkpoint, file, protocol=pickle.HIGHEST_PROTOCOL)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_filename, checkpoint_filename)
+
+
+def load_checkpoint(checkpoint_filename: str, nd2_file_path: str, params: TrackingParameters,
+                    trajectory_csv_filename: typing.Optional[str] = None,
+                    detections_filename: typing.Optional[str] = None,
+                    annotations_filename: typing.Optional[str] = None) -> typing.Optional[typing.Dict[str, typing.Any]]:
+    """
+    The state saved by save_checkpoint, or None if there is no checkpoint, or it can't be continued with these
+    arguments: it was made from another file, with other parameters, or with other outputs.
+    """
+    if not os.path.exists(checkpoint_filename):
+        return None
+    try:
+        with open(checkpoint_filename, "rb") as file:
+            checkpoint = pickle.load(file)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError) as e:
+        print(f"\nIgnoring unreadable checkpoint {checkpoint_filename}: {e}")
+        return None
+    if checkpoint.get('version') != CHECKPOINT_VERSION or checkpoint.get('source') != source_identity(nd2_file_path):
+        print(f"\nIgnoring checkpoint {checkpoint_filename}, it was made from another file")
+        return None
+    if checkpoint.get('params') != params:
+        print(f"\nIgnoring checkpoint {checkpoint_filename}, it was made with other parameters")
+        return None
+    trajectory, detections, annotations = checkpoint['trajectory'], checkpoint['detections'], checkpoint['annotations']
+    if (trajectory is None) != (trajectory_csv_filename is None) or \
+            (detections is None) != (detections_filename is None) or \
+            (annotations is None) != (annotations_filename is None):
+        print(f"\nIgnoring checkpoint {checkpoint_filename}, it was made with other outputs")
+        return None
+
+    # Every file must still have the rows written up to the checkpoint
+    positions = [(trajectory_csv_filename, trajectory)]
+    if detections is not None:
+        positions.append((part_filename(detections_filename), detections))
+    if annotations is not None:
+        positions += [(part_filename(annotations_filename), annotations[0]),
+                      (part_filename(annotations_filename, "total"), annotations[1])]
+    positions += [(f"{checkpoint_filename}.{name}", checkpoint[name]) for name in CHECKPOINT_ROWS]
+    for filename, position in positions:
+        if position is not None and (not os.path.exists(filename) or os.path.getsize(filename) < position[1]):
+            print(f"\nIgnoring checkpoint {checkpoint_filename}, {filename} is missing rows")
+            return None
+    return checkpoint
+
+
+def checkpoint_rows(checkpoint_filename: str, name: str,
+                    checkpoint: typing.Optional[typing.Dict[str, typing.Any]] = None) -> RowFile:
+    """
+    The side file <checkpoint_filename>.<name> (see CHECKPOINT_ROWS), continued from the position saved in checkpoint,
+    or empty.
+    """
+    width, dtype = CHECKPOINT_ROWS[name]
+    resume_at = checkpoint[name] if checkpoint else None
+    return RowFile(f"{checkpoint_filename}.{name}", width, dtype, resume_at=resume_at)
+
+
+def remove_checkpoint(checkpoint_filename: str) -> None:
+    side_files = [f"{checkpoint_filename}.{name}" for name in CHECKPOINT_ROWS]
+    for filename in [checkpoint_filename, checkpoint_filename + ".tmp"] + side_files:
+        if os.path.exists(filename):
+            os.remove(filename)
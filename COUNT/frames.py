@@ -0,0 +1,254 @@
+"""
+===================
+F R A M E S
+===================
+Converting raw (usually 16-bit) frames into the 8-bit frames the tracking works on.
+
+The original conversion normalizes every frame to its own min and max (cv.NORM_MINMAX). That costs a min/max pass
+per frame, and the intensity scale jumps whenever a bright cell enters or leaves the frame, which MOG2 sees as
+background change. An IntensityWindow is a fixed (low, high) range, estimated from a few sampled frames, that every
+frame is mapped through in the same way.
+
+params.intensity_window chooses how the window is found:
+    'frame': every frame is normalized to its own min and max (original behaviour)
+    'fixed': one window for the whole file, from params.window_samples frames spread over the file
+    'rolling': a new window every params.window_refresh frames, from params.window_samples frames of the block ahead
+
+FramePrefetcher reads and converts frames on a background thread, so reading the next frames overlaps with tracking
+the current one. How far it reads ahead is set by params.prefetch_memory_mb.
+"""
+import queue
+import threading
+import typing
+
+import cv2 as cv
+import numpy as np
+
+from COUNT.parameters import TrackingParameters
+
+
+class IntensityWindow:
+    """
+    Maps intensities in [low, high] to [0, 255]. Intensities outside the window are clipped.
+
+    This is the same mapping as a lookup table with one entry per 16-bit value, clip((v - low) * 255 / (high - low)),
+    but computed with OpenCV's vectorized saturating scale. Looking up every pixel of a 2048x2048 frame in a NumPy
+    table is several times slower.
+
+    Attributes:
+    ----------
+    low : int
+        Intensity mapped to 0.
+    high : int
+        Intensity mapped to 255.
+
+    Methods
+    -------
+    from_frames(frames: Iterable[np.ndarray]) -> IntensityWindow
+        Window spanning the min and max of the given frames.
+
+    convert(frame: np.ndarray, dst: np.ndarray = None, clip_buffer: np.ndarray = None) -> np.ndarray
+        Maps a frame to 8-bit.
+    """
+
+    def __init__(self, low, high):
+        self.low = int(low)
+        self.high = int(high)
+        self.scale = 255.0 / (self.high - self.low) if self.high > self.low else 0.0
+
+    @classmethod
+    def from_frames(cls, frames):
+        low, high = None, None
+        for frame in frames:
+            frame_low, frame_high, _, _ = cv.minMaxLoc(np.asarray(frame))
+            low = frame_low if low is None else min(low, frame_low)
+            high = frame_high if high is None else max(high, frame_high)
+        if low is None:
+            raise ValueError("No frames to estimate an intensity window from")
+        return cls(low, high)
+
+    def convert(self, frame, dst=None, clip_buffer=None):
+        # Clip below low first: convertScaleAbs takes the absolute value, which would mirror values below low
+        clipped = cv.max(frame, self.low, dst=clip_buffer)
+        return cv.convertScaleAbs(clipped, dst, self.scale, -self.low * self.scale)
+
+    def __repr__(self):
+        return f"IntensityWindow(low={self.low}, high={self.high})"
+
+
+def sample_frame_numbers(start, stop, samples):
+    """Up to `samples` frame numbers spread evenly over range(start, stop)"""
+    if stop <= start:
+        return []
+    return sorted(set(np.linspace(start, stop - 1, num=min(samples, stop - start)).round().astype(int).tolist()))
+
+
+class FrameConverter:
+    """
+    Converts the raw frames of a file to 8-bit, using the window chosen by params.intensity_window.
+
+    Args:
+        frames: The raw frames. Must support len() and frames[frame_number] (e.g. an opened ND2Reader_SDK).
+        params (TrackingParameters): Uses intensity_window, window_samples and window_refresh.
+
+    Methods
+    -------
+    convert(frame: np.ndarray, frame_number: int, dst: np.ndarray = None) -> np.ndarray
+        Maps the raw frame with the given frame number to 8-bit.
+    """
+
+    def __init__(self, frames, params: TrackingParameters):
+        if params.intensity_window not in ("frame", "fixed", "rolling"):
+            raise ValueError(f"Unknown intensity window: {params.intensity_window}")
+        self.frames = frames
+        self.mode = params.intensity_window
+        self.samples = params.window_samples
+        self.refresh = params.window_refresh
+        self.window = None
+        self.window_start = None
+        self.clip_buffer = None
+        if self.mode == "fixed":
+            self.window = self.estimate(0, len(frames))
+
+    def estimate(self, start, stop) -> IntensityWindow:
+        return IntensityWindow.from_frames(self.frames[frame_number]
+                                           for frame_number in sample_frame_numbers(start, stop, self.samples))
+
+    def window_for(self, frame_number) -> typing.Optional[IntensityWindow]:
+        if self.mode == "rolling":
+            block_start = frame_number - frame_number % self.refresh
+            if block_start != self.window_start:
+                self.window = self.estimate(block_start, min(block_start + self.refresh, len(self.frames)))
+                self.window_start = block_start
+        return self.window
+
+    def convert(self, frame, frame_number, dst=None):
+        if self.mode == "frame":
+            return cv.normalize(frame, dst, 0, 255, cv.NORM_MINMAX, dtype=cv.CV_8U)
+        window = self.window_for(frame_number)
+        if self.clip_buffer is None or self.clip_buffer.shape != frame.shape or self.clip_buffer.dtype != frame.dtype:
+            self.clip_buffer = np.empty(frame.shape, dtype=frame.dtype)
+        return window.convert(frame, dst, clip_buffer=self.clip_buffer)
+
+
+def prefetch_depth(frame_shape, memory_mb) -> int:
+    """Number of converted 8-bit frames that fit in memory_mb. 0 means no budget, i.e. don't read ahead"""
+    if memory_mb <= 0:
+        return 0
+    frame_bytes = int(np.prod(frame_shape))
+    # At least two frames, or the reader and the tracker would take turns instead of overlapping
+    return max(2, int(memory_mb * 2**20) // frame_bytes)
+
+
+class FramePrefetcher:
+    """
+    Reads and converts frames on a background thread, ahead of the tracking.
+
+    Decoding a frame (disk or network reads and the ND2 SDK) doesn't need the GIL for most of its time, and neither
+    do the OpenCV calls of the tracking, so reading frame n+1 while frame n is tracked hides most of the read time.
+    Converted frames are kept in at most `depth` reusable 8-bit buffers. When they are all in use the reader waits.
+
+    Iterating yields the converted frames in order. A yielded frame stays valid until the next one is requested, then
+    its buffer is handed back to the reader. Errors raised while reading are raised again by the iteration.
+
+    With depth 0 frames are read and converted on the calling thread into a single buffer, as before.
+
+    Args:
+        frames: The raw frames. Must support frames[frame_number] (e.g. an opened ND2Reader_SDK). Only the reader
+            thread touches them while iterating.
+        converter (FrameConverter): Converts raw frames to 8-bit.
+        frame_shape (Tuple[int, int]): (height, width) of the frames.
+        depth (int): Max number of converted frames held at once, see prefetch_depth.
+        start (int): First frame number.
+        stop (int, optional): Stop before this frame number. Defaults to len(frames).
+
+    Attributes:
+    ----------
+    shape : Tuple[int, int, int]
+        (frames, height, width), like a stack of the converted frames.
+
+    Methods
+    -------
+    close()
+        Stops the reader thread. Also called when used as a context manager.
+    """
+
+    def __init__(self, frames, converter: FrameConverter, frame_shape, depth, start=0, stop=None):
+        self.frames = frames
+        self.converter = converter
+        self.frame_shape = tuple(frame_shape)
+        self.depth = depth
+        self.start = start
+        self.stop = len(frames) if stop is None else stop
+        self.free_buffers = queue.Queue()
+        self.buffers_allocated = 0
+        self.ready = queue.Queue()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    @property
+    def shape(self):
+        return (len(self),) + self.frame_shape
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        if self.depth <= 0:
+            buffer = np.empty(self.frame_shape, dtype=np.uint8)
+            for frame_number in range(self.start, self.stop):
+                yield self.converter.convert(self.frames[frame_number], frame_number, dst=buffer)
+            return
+
+        self.thread = threading.Thread(target=self.read, name="FramePrefetcher", daemon=True)
+        self.thread.start()
+        buffer = None
+        try:
+            while True:
+                item = self.ready.get()
+                if buffer is not None:
+                    self.free_buffers.put(buffer)
+                    buffer = None
+                if item is None:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                buffer = item
+                yield buffer
+        finally:
+            self.close()
+
+    def get_buffer(self):
+        """A free buffer, or None if stopping"""
+        while not self.stopping.is_set():
+            if self.free_buffers.empty() and self.buffers_allocated < self.depth:
+                self.buffers_allocated += 1
+                return np.empty(self.frame_shape, dtype=np.uint8)
+            try:
+                return self.free_buffers.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def read(self):
+        try:
+            for frame_number in range(self.start, self.stop):
+                buffer = self.get_buffer()
+                if buffer is None:
+                    return
+                self.ready.put(self.converter.convert(self.frames[frame_number], frame_number, dst=buffer))
+        except BaseException as e:
+            self.ready.put(e)
+        self.ready.put(None)
+
+    def close(self):
+        self.stopping.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
@@ -0,0 +1,125 @@
+"""
+===================
+G A T I N G
+===================
+Motion gating: skipping detection on frames where nothing moves, for params.motion_gate > 0 or params.idle_stride > 1.
+
+Most frames of an acquisition have no cell in the channel, yet detect_boxes costs the same on every frame (and on a
+frame without any foreground it even runs canny on the frame itself). The background model still sees every frame,
+then MotionGate counts the foreground pixels of its mask on a grid of one pixel out of every motion_gate_step in both
+directions (1/16 of the pixels with the default step of 4). A frame with fewer than motion_gate foreground pixels
+(estimated from the grid) has no objects, and detection doesn't run on it.
+
+Once no frame had any foreground for timeout + 1 frames, every track has expired. From then on, with idle_stride > 1,
+only one frame out of every idle_stride goes through background subtraction and the gate, the others are skipped. The
+first frame with foreground returns to full rate.
+
+Tolerance: a motion_gate below the area of a cell (about 3 * cell_radius ** 2) doesn't lose cells, but frames without
+foreground no longer get canny on the frame itself, so anything that was detected that way (still objects) is gone.
+A cell entering while idle is first seen up to idle_stride - 1 frames late, so idle_stride must stay well below the
+number of frames a cell takes to cross the channel. The background model also sees fewer frames while idle, except
+when the frame cache records the masks (every mask is needed there).
+
+The status of every frame is kept (FRAME_DETECTED, FRAME_EMPTY or FRAME_SKIPPED, only their counts with
+params.count_only), printed as a summary at the end of each file and saved with the detections (see
+tracking.DetectionWriter).
+"""
+import typing
+
+import numpy as np
+
+from COUNT.parameters import TrackingParameters
+
+# Status of each frame
+FRAME_DETECTED = 0  # detection ran
+FRAME_EMPTY = 1  # too little foreground, no detection
+FRAME_SKIPPED = 2  # skipped while idle, no background subtraction and no detection
+
+
+def gate_enabled(params: TrackingParameters) -> bool:
+    """True if the parameters ask for a MotionGate"""
+    return params.motion_gate > 0 or params.idle_stride > 1
+
+
+class MotionGate:
+    """
+    Decides, frame by frame in order, which frames are skipped and which get detection.
+
+    Args:
+        params (TrackingParameters): Uses motion_gate, motion_gate_step, idle_stride and timeout.
+        total_frames (int): Number of frames in the file.
+        start (int): First frame number.
+        keep_status (bool): Keep the status of every frame. Otherwise only the counts are kept.
+
+    Attributes:
+    ----------
+    status : np.ndarray or None
+        uint8 status of every frame so far: FRAME_DETECTED, FRAME_EMPTY or FRAME_SKIPPED. None without keep_status.
+    frame_number : int
+        The next frame.
+
+    Methods
+    -------
+    skip() -> bool
+        True if the next frame is skipped because nothing moved for a while. The frame is then counted as skipped,
+        otherwise passes() must be called with its foreground mask.
+
+    passes(mask: np.ndarray) -> bool
+        True if the next frame has enough foreground for detection.
+
+    counts() -> Dict[str, int]
+        Number of frames 'detected', 'empty' and 'skipped' so far.
+
+    restore(status: np.ndarray) -> None
+        Takes the status of the frames before start from an earlier run (see checkpoint.py).
+
+    summary() -> str
+        The counts as one line of text.
+    """
+
+    def __init__(self, params: TrackingParameters, total_frames, start=0, keep_status=True):
+        self.min_pixels = params.motion_gate
+        self.step = max(1, params.motion_gate_step)
+        self.idle_stride = max(1, params.idle_stride)
+        # Tracks expire after timeout frames without a detection
+        self.idle_after = params.timeout + 1
+        self.status = np.zeros(total_frames, dtype=np.uint8) if keep_status else None
+        self.totals = [0, 0, 0]  # Frames with each status
+        self.frame_number = start
+        # The first frames run at full rate, while the background model learns
+        self.last_motion = start
+
+    def skip(self):
+        idle = self.frame_number - self.last_motion > self.idle_after
+        if idle and self.frame_number % self.idle_stride:
+            self.record(FRAME_SKIPPED)
+            return True
+        return False
+
+    def passes(self, mask):
+        # Foreground pixels of the grid, scaled up to the whole mask
+        foreground = np.count_nonzero(mask[::self.step, ::self.step]) * self.step * self.step
+        if foreground:
+            self.last_motion = self.frame_number
+        detect = foreground >= self.min_pixels
+        self.record(FRAME_DETECTED if detect else FRAME_EMPTY)
+        return detect
+
+    def record(self, status):
+        if self.status is not None:
+            self.status[self.frame_number] = status
+        self.totals[status] += 1
+        self.frame_number += 1
+
+    def restore(self, status):
+        self.status[:len(status)] = status
+        self.totals = np.bincount(status, minlength=len(self.totals)).tolist()
+
+    def counts(self) -> typing.Dict[str, int]:
+        detected, empty, skipped = self.totals
+        return {'detected': detected, 'empty': empty, 'skipped': skipped}
+
+    def summary(self) -> str:
+        counts = self.counts()
+        return (f"detection ran on {counts['detected']} of {sum(counts.values())} frames "
+                f"({counts['empty']} without motion, {counts['skipped']} skipped while idle)")
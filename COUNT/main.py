@@ -9,11 +9,10 @@ Check the readme on gitHub for more information. https://github.com/bschelske/CO
 
 This is the file that is meant to be run.
 """
-import os
 import time
-import traceback
 
-from COUNT import ui, tracking
+from COUNT import ui, batch
+from COUNT.parameters import TrackingParameters
 
 
 def main():
@@ -25,25 +24,27 @@ def main():
         print("An error occurred in the UI:", e)
         exit(1)
 
+    # Read the tracking parameters out of the UI once. The tracking engine never touches the UI
+    params = TrackingParameters.from_ui(app)
+
     # Iterate through all input files (could be one file or many)
     for index, nd2_file in enumerate(app.files):
         print(f"Processing file {index + 1} of {len(app.files)}: {nd2_file}")
 
-        try:
-            # Get the filename without extension
-            file_name = os.path.basename(nd2_file)[:-4]
-
-            # Track the nd2 file using MOG2 background subtraction
-            object_final_position, active_id_trajectory = tracking.nd2_mog_contours(nd2_file, app)
-
-            csv_filename = os.path.join(app.csv_folder_path.get(), f"{file_name}_results.csv")
-            trajectory_csv_filename = os.path.join(app.csv_folder_path.get(), f"{file_name}_trajectory_results.csv")
-            tracking.export_to_csv(object_final_position, csv_filename)
-            tracking.export_trajectories_to_csv(active_id_trajectory, trajectory_csv_filename)
-
-        except Exception as e:
-            print(f"Error processing file {nd2_file}: {e}")
-            traceback.print_exc()
+        # The positions of a multipoint file are tracked at the same time, each on its own
+        streams = batch.find_streams([nd2_file], params.stream_axes)
+        if len(streams) > 1:
+            results = batch.run_batch(streams, params)
+            for result in results:
+                if result['error']:
+                    print(f"Error processing {result['file']}: {result['error']}")
+            batch.export_position_summaries(results, params.csv_save_path)
+            continue
+
+        # Track the nd2 file and export the results. For many files at once, see batch.py
+        result = batch.process_file(nd2_file, params)
+        if result['error']:
+            print(f"Error processing file {nd2_file}: {result['error']}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,127 @@
+"""
+===================
+O V E R L A Y
+===================
+Saving overlays as one video per file, encoded on a background thread.
+
+Overlays used to be saved as one .png per frame, with cv.imwrite inside the tracking loop. Tracking waited for every
+frame to be compressed, and files sharing the overlay folder overwrote each other's 000.png, 001.png, ...
+
+An OverlayWriter encodes the overlays of one file into <overlay_path>/<file>_overlay.mp4 on its own thread. The
+tracking loop only copies each overlay into a free buffer (downscaled by params.overlay_scale) and queues it. It only
+waits when every buffer is queued, i.e. when the encoder can't keep up.
+
+params.overlay_every keeps one frame out of every overlay_every. Together with overlay_scale this makes encoding much
+cheaper on long files. The frame number is written on every overlay, so a video can still be matched to the trajectory
+.csv file.
+"""
+import os
+import queue
+import threading
+
+import cv2 as cv
+import numpy as np
+
+from COUNT.parameters import TrackingParameters
+from COUNT.sources import stream_name
+
+OVERLAY_FOURCC = "mp4v"
+OVERLAY_EXTENSION = ".mp4"
+
+
+def overlay_filename(params: TrackingParameters, nd2_file_path: str, start: int = 0) -> str:
+    """
+    The overlay video of a file. A run continued from a checkpoint (see checkpoint.py) can't append to the video of the
+    interrupted run, so it writes a new video named after the frame it starts from.
+    """
+    file_name = stream_name(nd2_file_path)
+    suffix = f"_{start:06d}" if start else ""
+    return os.path.join(params.overlay_path, f"{file_name}_overlay{suffix}{OVERLAY_EXTENSION}")
+
+
+class OverlayWriter:
+    """
+    Encodes overlay frames into a video file on a background thread.
+
+    Args:
+        filename (str): The video file to write.
+        frame_shape (Tuple[int, int]): (height, width) of the frames.
+        params (TrackingParameters): Uses overlay_every, overlay_scale and overlay_fps.
+        queue_size (int): Number of frames that can wait to be encoded.
+
+    Methods
+    -------
+    wants(frame_number: int) -> bool
+        Whether the frame is kept, see params.overlay_every.
+
+    write(frame_number: int, image: np.ndarray) -> None
+        Queues a BGR overlay to be encoded. Frames that aren't kept are ignored. Blocks while the queue is full.
+
+    close() -> None
+        Encodes the queued frames and closes the file. Raises the error of the encoder thread, if there was one.
+    """
+
+    def __init__(self, filename, frame_shape, params: TrackingParameters, queue_size=8):
+        self.filename = filename
+        self.every = max(1, params.overlay_every)
+        height, width = frame_shape[:2]
+        self.size = (max(1, round(width * params.overlay_scale)), max(1, round(height * params.overlay_scale)))
+        self.writer = cv.VideoWriter(filename, cv.VideoWriter_fourcc(*OVERLAY_FOURCC), params.overlay_fps, self.size)
+        if not self.writer.isOpened():
+            raise IOError(f"Could not open {filename} for writing")
+        # The queue is bounded by the number of buffers: write() waits for the encoder to free one
+        self.free_buffers = queue.Queue()
+        for _ in range(max(1, queue_size)):
+            self.free_buffers.put(np.empty((self.size[1], self.size[0], 3), dtype=np.uint8))
+        self.queued = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self.encode, name="overlay-writer", daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self.close()
+        except Exception:
+            # Don't hide the error that stopped tracking
+            if exc_type is None:
+                raise
+
+    def wants(self, frame_number):
+        return frame_number % self.every == 0
+
+    def write(self, frame_number, image):
+        if not self.wants(frame_number):
+            return
+        if self.error is not None:
+            raise self.error
+        buffer = self.free_buffers.get()
+        if image.shape[1::-1] == self.size:
+            np.copyto(buffer, image)
+        else:
+            cv.resize(image, self.size, dst=buffer, interpolation=cv.INTER_AREA)
+        self.queued.put(buffer)
+
+    def encode(self):
+        while True:
+            buffer = self.queued.get()
+            if buffer is None:
+                return
+            try:
+                if self.error is None:
+                    self.writer.write(buffer)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.free_buffers.put(buffer)
+
+    def close(self):
+        if self.thread is not None:
+            self.queued.put(None)
+            self.thread.join()
+            self.thread = None
+            self.writer.release()
+        if self.error is not None:
+            raise self.error
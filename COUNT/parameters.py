@@ -0,0 +1,206 @@
+"""
+===================
+P A R A M E T E R S
+===================
+Tracking parameters, gathered in one place.
+
+The tracking engine never talks to the UI directly. The UI, a settings.json file or a command line all build a
+TrackingParameters instance, and that instance is what tracking.py reads while it works through the frames.
+
+TrackingParameters is frozen (it can't change halfway through a file) and picklable (it can be sent to worker
+processes).
+"""
+import dataclasses
+import json
+import os
+import typing
+
+
+@dataclasses.dataclass(frozen=True)
+class TrackingParameters:
+    """
+    Everything the tracking engine needs to know, as plain python values.
+
+    Attributes:
+    ----------
+    canny_upper : int
+        Upper threshold for canny edge detection.
+    canny_lower : int
+        Lower threshold for canny edge detection.
+    max_centroid_distance : int
+        Max distance (px) an object will travel between frames.
+    timeout : int
+        Number of frames before a lost object is considered gone.
+    cell_radius : int
+        Expected cell radius (px), used to merge overlapping contours and to filter out large contours.
+    roi_x, roi_y : int
+        Top left corner (px) of the region of interest, e.g. the channel. Only this part of the frames is processed,
+        and DEP outlets are split at its middle. Positions in the results are still in full frame coordinates.
+    roi_width, roi_height : int
+        Size (px) of the region of interest. 0: to the edge of the frame.
+    stream_axes : str
+        Axes of multipoint .nd2 files split into streams tracked on their own, e.g. 'm' for each position, 'mc' for
+        each position and channel, see sources.list_streams. "": the first stream only.
+    save_overlay : bool
+        Save overlay frames showing the tracked objects.
+    csv_save_path : str
+        Folder the .csv results are saved to.
+    overlay_path : str
+        Folder the overlay videos are saved to.
+    overlay_every : int
+        Only keep one overlay frame out of every overlay_every.
+    overlay_scale : float
+        Size of the overlay videos, relative to the frames.
+    overlay_fps : float
+        Frame rate of the overlay videos.
+    assignment : str
+        How objects in a frame are matched to tracked objects. 'greedy' matches the closest pairs first,
+        'hungarian' minimizes the total distance.
+    detection_engine : str
+        How edges are merged into objects. 'contours' draws a circle around each contour and finds the contours again,
+        'components' dilates the edges and labels them with connectedComponentsWithStats.
+    background_engine : str
+        Background model that finds the moving objects: 'mog2', 'knn' or 'median', see background.py.
+    background_threshold : int
+        'median' engine: difference from the background (8-bit) above which a pixel is foreground.
+    background_samples, background_stride : int
+        'median' engine: number of frames the median is taken over, sampled one every background_stride frames.
+    background_refresh : int
+        'median' engine: recompute the background every background_refresh frames. 0: only once.
+    intensity_window : str
+        How raw frames are converted to 8-bit, see frames.py. 'frame' normalizes each frame to its own min and max,
+        'fixed' uses one intensity window for the whole file, 'rolling' a new window every window_refresh frames.
+    window_samples : int
+        Number of frames sampled to estimate an intensity window.
+    window_refresh : int
+        Frames between intensity window estimates when intensity_window is 'rolling'.
+    prefetch_memory_mb : int
+        Memory (MB) for frames read ahead of the tracking on a background thread. 0 reads every frame when it is needed.
+    detection_workers : int
+        Number of worker processes detecting objects in the frames, see pipeline.py. 0 detects in the tracking process.
+    detection_strips : int
+        Number of horizontal strips each frame is split into for detection, each on its own thread, see tiling.py.
+    motion_gate : int
+        Minimum number of foreground pixels for a frame to go through detection, see gating.py. 0: every frame does.
+    motion_gate_step : int
+        The foreground pixels are counted on one pixel out of every motion_gate_step, in both directions.
+    idle_stride : int
+        While nothing moves and no object is tracked, only process one frame out of every idle_stride.
+    frame_cache_dir : str
+        Folder to cache decoded 8-bit frames in, for repeated runs on the same file, see cache.py. "" disables the
+        cache.
+    frame_cache_mb : int
+        Max size of the frame cache (MB). The least recently used files are removed first.
+    cache_masks : bool
+        Also cache the MOG2 foreground masks, so later runs skip background subtraction too.
+    save_detections : bool
+        Save the detections of every frame next to the results, so tracks can be rebuilt with relink.py.
+    save_annotations : bool
+        Save what the overlays would show as data next to the results, to draw only the frames needed later, see
+        annotations.py.
+    count_only : bool
+        Only count the objects, for screening: batch.py saves one row of counts per file and nothing else, and memory
+        doesn't grow with the length of the file, see tracking.count_objects.
+    checkpoint_every : int
+        Save a checkpoint every checkpoint_every frames, so a run that stops can continue from there. 0: never.
+    checkpoint_warmup : int
+        Number of frames before a checkpoint that MOG2 is warmed up on when continuing from it.
+
+    Methods
+    -------
+    from_settings(settings: dict) -> TrackingParameters
+        Builds parameters from a settings dictionary, e.g. the contents of settings.json.
+
+    from_json(json_path: str) -> TrackingParameters
+        Builds parameters from a settings .json file.
+
+    from_ui(ui_app) -> TrackingParameters
+        Builds parameters from the values currently entered in the UI.
+
+    to_settings() -> dict
+        Returns the parameters in the settings.json format.
+    """
+    canny_upper: int = 255
+    canny_lower: int = 85
+    max_centroid_distance: int = 70
+    timeout: int = 5
+    cell_radius: int = 6
+    roi_x: int = 0
+    roi_y: int = 0
+    roi_width: int = 0
+    roi_height: int = 0
+    stream_axes: str = "m"
+    save_overlay: bool = False
+    csv_save_path: str = "results/"
+    overlay_path: str = ""
+    overlay_every: int = 1
+    overlay_scale: float = 1.0
+    overlay_fps: float = 30.0
+    assignment: str = "greedy"
+    detection_engine: str = "contours"
+    background_engine: str = "mog2"
+    background_threshold: int = 25
+    background_samples: int = 25
+    background_stride: int = 10
+    background_refresh: int = 250
+    intensity_window: str = "frame"
+    window_samples: int = 16
+    window_refresh: int = 1000
+    prefetch_memory_mb: int = 256
+    detection_workers: int = 0
+    detection_strips: int = 1
+    motion_gate: int = 0
+    motion_gate_step: int = 4
+    idle_stride: int = 1
+    frame_cache_dir: str = ""
+    frame_cache_mb: int = 20480
+    cache_masks: bool = True
+    save_detections: bool = False
+    save_annotations: bool = False
+    count_only: bool = False
+    checkpoint_every: int = 0
+    checkpoint_warmup: int = 200
+
+    @classmethod
+    def from_settings(cls, settings: typing.Mapping[str, typing.Any]) -> "TrackingParameters":
+        # Ignore anything in the settings that isn't a tracking parameter
+        field_names = {field.name for field in dataclasses.fields(cls)}
+        return cls(**{key: value for key, value in settings.items() if key in field_names})
+
+    @classmethod
+    def from_json(cls, json_path: str) -> "TrackingParameters":
+        with open(json_path, "r") as file:
+            return cls.from_settings(json.load(file))
+
+    @classmethod
+    def from_settings_file(cls, json_path: str) -> "TrackingParameters":
+        # Used by the command line tools, which run with the defaults if there is no settings file
+        if os.path.exists(json_path):
+            return cls.from_json(json_path)
+        print(f"no {json_path} found... using defaults")
+        return cls()
+
+    @classmethod
+    def from_ui(cls, ui_app) -> "TrackingParameters":
+        # Parameters the UI doesn't show keep their values from the settings file it loaded
+        params = cls.from_settings(ui_app.settings)
+        # Read every tkinter variable once, here, instead of once per frame in the tracking loop
+        return dataclasses.replace(params,
+                                   canny_upper=ui_app.canny_upper.get(),
+                                   canny_lower=ui_app.canny_lower.get(),
+                                   max_centroid_distance=ui_app.max_centroid_distance.get(),
+                                   timeout=ui_app.timeout.get(),
+                                   cell_radius=ui_app.cell_radius.get(),
+                                   roi_x=ui_app.roi_x.get(),
+                                   roi_y=ui_app.roi_y.get(),
+                                   roi_width=ui_app.roi_width.get(),
+                                   roi_height=ui_app.roi_height.get(),
+                                   save_overlay=bool(ui_app.save_overlay.get()),
+                                   csv_save_path=ui_app.csv_folder_path.get(),
+                                   overlay_path=ui_app.overlay_path)
+
+    def to_settings(self) -> typing.Dict[str, typing.Any]:
+        # overlay_path is derived from csv_save_path when the UI is confirmed, so it isn't saved
+        settings = dataclasses.asdict(self)
+        del settings["overlay_path"]
+        return settings
@@ -0,0 +1,189 @@
+"""
+===================
+P I P E L I N E
+===================
+Detection in worker processes, for nd2_mog_contours with params.detection_workers > 0.
+
+MOG2 has to see the frames in order, but everything after it (morphology, canny, contours, merging overlapped
+objects) only needs the frame and its foreground mask. The main process reads each frame, runs the background
+subtraction and writes the frame and its mask into a ring of slots in shared memory. Detection workers read the slot,
+run detect_boxes and send back only the (N, 4) bounding boxes, which the main process links in frame order.
+
+Full size images are never pickled: a worker is only told which slot to read. When overlays are saved, the workers
+draw them into the slot's overlay image, also in shared memory.
+"""
+import collections
+import multiprocessing
+import typing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import cv2 as cv
+import numpy as np
+
+from COUNT.parameters import TrackingParameters
+from COUNT.tiling import StripTiler
+from COUNT.tracking import FrameWorkspace, detect_boxes, no_objects
+
+
+class FrameRing:
+    """
+    A fixed number of slots in shared memory, each holding an 8-bit frame, its foreground mask and optionally a color
+    overlay.
+
+    Attributes:
+    ----------
+    shape : Tuple[int, int]
+        (height, width) of the frames.
+    slots : int
+        Number of slots.
+    overlay : bool
+        Whether each slot has an overlay image.
+    name : str
+        Name of the shared memory block, used by the workers to attach.
+
+    Methods
+    -------
+    frame(slot: int) -> np.ndarray
+    mask(slot: int) -> np.ndarray
+    overlay_image(slot: int) -> np.ndarray
+        Views of the images of a slot.
+
+    close()
+        Detaches from the shared memory. The process that created the ring also frees it.
+    """
+
+    def __init__(self, shape, slots, overlay=False, name=None):
+        self.shape = tuple(shape[:2])
+        self.slots = slots
+        self.overlay = overlay
+        self.owner = name is None
+        frame_bytes = int(np.prod(self.shape))
+        # frame and mask, plus a 3 channel overlay
+        self.slot_bytes = frame_bytes * (5 if overlay else 2)
+        if self.owner:
+            self.memory = shared_memory.SharedMemory(create=True, size=self.slot_bytes * slots)
+        else:
+            # Worker processes share the resource tracker of the process that started them, so attaching doesn't
+            # make the memory theirs to free
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+        images = np.ndarray((slots, self.slot_bytes), dtype=np.uint8, buffer=self.memory.buf)
+        self.frames = images[:, :frame_bytes].reshape((slots,) + self.shape)
+        self.masks = images[:, frame_bytes:2 * frame_bytes].reshape((slots,) + self.shape)
+        self.overlays = images[:, 2 * frame_bytes:].reshape((slots,) + self.shape + (3,)) if overlay else None
+
+    def frame(self, slot):
+        return self.frames[slot]
+
+    def mask(self, slot):
+        return self.masks[slot]
+
+    def overlay_image(self, slot):
+        return self.overlays[slot]
+
+    def close(self):
+        # The views must go before the memory can be closed
+        self.frames = self.masks = self.overlays = None
+        try:
+            self.memory.close()
+        except BufferError:
+            # A view of a slot is still in use somewhere, the memory is unmapped when it is garbage collected
+            pass
+        if self.owner:
+            self.memory.unlink()
+
+
+# State of each detection worker process, set by _init_detection_worker
+_worker_ring: typing.Optional[FrameRing] = None
+_worker_params: typing.Optional[TrackingParameters] = None
+_worker_workspace: typing.Optional[FrameWorkspace] = None
+
+
+def _init_detection_worker(ring_name, shape, slots, overlay, params, opencv_threads):
+    global _worker_ring, _worker_params, _worker_workspace
+    cv.setNumThreads(opencv_threads)
+    _worker_ring = FrameRing(shape, slots, overlay=overlay, name=ring_name)
+    _worker_params = params
+    _worker_workspace = FrameWorkspace(shape)
+    if params.detection_strips > 1:
+        _worker_workspace.tiler = StripTiler(shape, params)
+
+
+def _detect_slot(slot) -> np.ndarray:
+    """Worker side of detect_frames_parallel. Returns the bounding boxes of the objects in a slot"""
+    if _worker_ring.overlay:
+        # detect_boxes draws the overlay straight into shared memory
+        _worker_workspace.overlay = _worker_ring.overlay_image(slot)
+    boxes, _ = detect_boxes(_worker_ring.frame(slot), _worker_ring.mask(slot), _worker_params,
+                            workspace=_worker_workspace)
+    return boxes
+
+
+def detect_frames_parallel(frames: typing.Iterable[np.ndarray], backSub, params: TrackingParameters,
+                           frame_shape, workers: int, opencv_threads: int = 1, masks=None,
+                           record=None, gate=None) -> typing.Iterator[
+    typing.Tuple[np.ndarray, typing.Optional[np.ndarray]]]:
+    """
+    Background subtraction in this process, detection in `workers` worker processes.
+
+    Args:
+        frames (Iterable[np.ndarray]): 8-bit frames, in order.
+        backSub: The background subtractor, applied to every frame in order.
+        params (TrackingParameters): Passed to detect_boxes.
+        frame_shape (Tuple[int, int]): (height, width) of the frames.
+        workers (int): Number of detection worker processes.
+        opencv_threads (int): Max number of threads OpenCV may use inside each worker.
+        masks (np.ndarray, optional): Foreground masks to use instead of backSub, see tracking.detect_frames.
+        record (Callable, optional): Called with (frame_number, frame, foreground mask) for each frame.
+        gate (gating.MotionGate, optional): Frames it skips or finds too little motion in aren't sent to the workers,
+            see tracking.subtract_background.
+
+    Yields:
+        typing.Tuple[np.ndarray, Optional[np.ndarray]]: In frame order, the (N, 4) bounding boxes of each frame and,
+            if params.save_overlay, its overlay image. The overlay is a view of the ring, valid until the next frame
+            is requested.
+    """
+    # Two slots per worker, so each worker has its next frame waiting while it works
+    slots = 2 * workers
+    ring = FrameRing(frame_shape, slots, overlay=params.save_overlay)
+    try:
+        # Workers are started while the prefetch and overlay threads run, forking then could copy a held lock. Spawned
+        # workers only need the name of the ring
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_detection_worker,
+                                 initargs=(ring.name, ring.shape, slots, ring.overlay, params,
+                                           opencv_threads)) as executor:
+            pending = collections.deque()
+
+            def oldest():
+                slot, future = pending.popleft()
+                # Frames without detection have no future, their overlay is already in the slot
+                boxes = future.result() if future is not None else np.empty((0, 4), dtype=np.int32)
+                return boxes, ring.overlay_image(slot) if ring.overlay else None
+
+            for frame_number, frame_data in enumerate(frames):
+                slot = frame_number % slots
+                # The slot is free once the frame that used it before has been handed on
+                if len(pending) == slots:
+                    yield oldest()
+                np.copyto(ring.frame(slot), frame_data)
+                skipped = gate is not None and gate.skip()
+                detect = not skipped
+                if not skipped or record is not None:
+                    if masks is not None:
+                        np.copyto(ring.mask(slot), masks[frame_number])
+                    else:
+                        backSub.apply(frame_data, ring.mask(slot))
+                    if record is not None:
+                        record(frame_number, frame_data, ring.mask(slot))
+                    detect = not skipped and (gate is None or gate.passes(ring.mask(slot)))
+                if detect:
+                    pending.append((slot, executor.submit(_detect_slot, slot)))
+                else:
+                    no_objects(ring.frame(slot), params, ring.overlay_image(slot) if ring.overlay else None)
+                    pending.append((slot, None))
+            while pending:
+                yield oldest()
+    finally:
+        ring.close()
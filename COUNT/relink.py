@@ -0,0 +1,153 @@
+"""
+===================
+R E L I N K
+===================
+Rebuilds tracks from saved detections, with new linking parameters, without the video.
+
+Tracking is two steps: detecting objects in every frame (slow, needs the video) and linking the detections into
+tracks (fast). With params.save_detections, batch.process_file saves every frame's detections next to the results as
+<file>_detections.npz (see tracking.DetectionWriter). Changing max_centroid_distance, timeout or assignment then only
+needs the linking step:
+
+    python -m COUNT.relink results/file_detections.npz --settings settings.json
+
+This writes <file>_results.csv and <file>_trajectory_results.csv, the same as a full run with those settings.
+"""
+import argparse
+import dataclasses
+import json
+import os
+import typing
+
+import numpy as np
+
+from COUNT.parameters import TrackingParameters
+from COUNT.tracking import DetectedObject, TrackTable, Tracker, TrajectoryWriter, export_to_csv
+
+
+class SavedDetections:
+    """
+    The contents of a detections .npz file.
+
+    Attributes:
+    ----------
+    frame : np.ndarray
+        Frame number of each detection, sorted.
+    boxes : np.ndarray
+        (N, 4) int32 (x, y, w, h) bounding box of each detection.
+    image_h, total_frames : int
+        Height (of the ROI) and number of frames of the video.
+    roi_y : int
+        Top of the ROI. 0 in files saved before ROIs existed.
+    source : str
+        Path of the video.
+    settings : dict
+        Parameters the detections were made with, in the settings.json format.
+
+    Methods
+    -------
+    frame_boxes() -> Iterator[Tuple[int, np.ndarray]]
+        (frame number, boxes) of every frame, in order, including frames without detections.
+    """
+
+    def __init__(self, npz_filename):
+        with np.load(npz_filename) as data:
+            self.frame = data["frame"]
+            self.boxes = np.stack([data["x"], data["y"], data["w"], data["h"]], axis=1)
+            self.image_h = int(data["image_h"])
+            self.roi_y = int(data["roi_y"]) if "roi_y" in data else 0
+            self.total_frames = int(data["total_frames"])
+            self.source = str(data["source"])
+            parameters = str(data["parameters"])
+        self.settings = json.loads(parameters) if parameters else {}
+
+    def __len__(self):
+        return len(self.frame)
+
+    def frame_boxes(self):
+        # First and last (exclusive) row of every frame
+        bounds = np.searchsorted(self.frame, np.arange(self.total_frames + 1))
+        for frame_number in range(self.total_frames):
+            yield frame_number, self.boxes[bounds[frame_number]:bounds[frame_number + 1]]
+
+
+def relink(npz_filename: str, params: TrackingParameters,
+           trajectory_csv_filename: typing.Optional[str] = None) -> typing.Tuple[
+    typing.Dict[int, DetectedObject], typing.Optional[TrackTable]]:
+    """
+    Same as nd2_mog_contours, but linking saved detections instead of detecting objects in a video.
+
+    Args:
+        npz_filename (str): Detections saved by nd2_mog_contours (see DetectionWriter).
+        params (TrackingParameters): Uses the linking parameters (max_centroid_distance, timeout, assignment).
+        trajectory_csv_filename (str, optional): If given, trajectories are written to this file instead of being kept
+            in memory.
+
+    Returns:
+        typing.Tuple[Dict[int, DetectedObject], Optional[TrackTable]]: Same as nd2_mog_contours.
+    """
+    detections = SavedDetections(npz_filename)
+    tracker = Tracker(params, detections.image_h, detections.roi_y)
+    history = TrajectoryWriter(trajectory_csv_filename) if trajectory_csv_filename else TrackTable()
+    try:
+        for frame_number, boxes in detections.frame_boxes():
+            tracker.expire(frame_number)
+            object_ids, frames_tracked = tracker.link(boxes, frame_number)
+            history.append(frame_number, object_ids, boxes, frames_tracked)
+    finally:
+        if trajectory_csv_filename:
+            history.close()
+
+    expired_objects_dict = tracker.finish()
+    if trajectory_csv_filename:
+        return expired_objects_dict, None
+    return expired_objects_dict, history
+
+
+def relink_file(npz_filename: str, params: TrackingParameters, verbose: bool = True) -> typing.Dict[str, typing.Any]:
+    """
+    Relinks saved detections and exports both csv files to params.csv_save_path, named after the original video.
+
+    Returns:
+        dict: Summary of the file with keys 'file', 'cells_counted', 'DEP_true' and 'DEP_false'.
+    """
+    file_name = os.path.basename(npz_filename)
+    file_name = file_name[:-len("_detections.npz")] if file_name.endswith("_detections.npz") else \
+        os.path.splitext(file_name)[0]
+    csv_filename = os.path.join(params.csv_save_path, f"{file_name}_results.csv")
+    trajectory_csv_filename = os.path.join(params.csv_save_path, f"{file_name}_trajectory_results.csv")
+
+    object_final_position, _ = relink(npz_filename, params, trajectory_csv_filename=trajectory_csv_filename)
+    if verbose:
+        print(f"\n{trajectory_csv_filename} saved")
+    DEP_true, DEP_false = export_to_csv(object_final_position, csv_filename, verbose=verbose)
+    return {'file': npz_filename, 'cells_counted': len(object_final_position), 'DEP_true': DEP_true,
+            'DEP_false': DEP_false}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild tracks from saved detections with new linking parameters.")
+    parser.add_argument("paths", nargs="+", help="_detections.npz files and/or folders containing them")
+    parser.add_argument("--settings", default="settings.json", help="settings .json file (default: settings.json)")
+    parser.add_argument("--output", help="folder to save the .csv results in (default: csv_save_path in settings)")
+    args = parser.parse_args()
+
+    params = TrackingParameters.from_settings_file(args.settings)
+    if args.output:
+        params = dataclasses.replace(params, csv_save_path=args.output)
+    os.makedirs(params.csv_save_path, exist_ok=True)
+
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith("_detections.npz")))
+        else:
+            files.append(path)
+    for npz_filename in files:
+        result = relink_file(npz_filename, params, verbose=False)
+        print(f"\t{result['file']}: {result['cells_counted']} cells counted, "
+              f"DEP True: {result['DEP_true']}, DEP False: {result['DEP_false']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,378 @@
+"""
+===================
+S O U R C E S
+===================
+The files frames are read from.
+
+Tracking used to read .nd2 files only, through pims.ND2Reader_SDK (which needs the Nikon SDK). A FrameSource is
+anything with a length, a height and width, and frames that can be read by number. open_source picks one from the
+file extension:
+
+    .nd2            ND2Source, the Nikon SDK through pims
+    .tif, .tiff     TiffSource, multipage and OME tiff through tifffile
+    .avi            VideoSource, through OpenCV
+    .npy, .raw      MemmapSource, frames memory-mapped straight from the file
+
+A multipoint .nd2 file holds several streams of frames, one per position (m axis), and so does a (positions, frames,
+height, width) .npy stack. Each stream is tracked on its own, as if it were a file, and is named by the path of the file
+plus its coordinates:
+
+    movie.nd2#m=2           position 2
+    movie.nd2#m=2,c=1       position 2, channel 1
+
+list_streams gives the streams of a file (only the file itself if it has one), open_source opens any of them.
+
+CroppedSource reads a region of interest (ROI) of another source, e.g. the channel the cells flow through. Its frames
+are views of the full frames, so nothing is copied before the 8-bit conversion.
+
+.npy files read at disk speed, without decoding. convert_to_npy converts any source once, for files that are
+tracked over and over. A .raw file is a headerless stack of frames, described by a sidecar file with the same name
+plus .json, e.g. movie.raw.json:
+
+    {"shape": [frames, height, width], "dtype": "uint16", "offset": 0}
+"""
+import itertools
+import json
+import os
+import re
+import typing
+
+import cv2 as cv
+import numpy as np
+
+STREAM_SEPARATOR = "#"
+# Coordinates of a stream after the separator, e.g. m=2,c=1
+STREAM_PATTERN = re.compile(r"[a-z]=\d+(,[a-z]=\d+)*")
+
+
+class FrameSource:
+    """
+    The frames of one file.
+
+    Attributes:
+    ----------
+    path : str
+        Path to the file.
+    height, width : int
+        Size of the frames (px).
+
+    Methods
+    -------
+    __len__() -> int
+        Number of frames.
+
+    __getitem__(frame_number: int) -> np.ndarray
+        The (height, width) grayscale frame with the given number.
+
+    stream_coordinates(axes: str = "m") -> List[Dict[str, int]]
+        Coordinates of every stream along the given axes, see list_streams. [{}] if the file is one stream.
+
+    close()
+        Closes the file. Also called when used as a context manager.
+    """
+    path = ""
+    height = 0
+    width = 0
+
+    def stream_coordinates(self, axes="m"):
+        return [{}]
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __getitem__(self, frame_number):
+        raise NotImplementedError
+
+    def __iter__(self):
+        for frame_number in range(len(self)):
+            yield self[frame_number]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        pass
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.path!r}, frames={len(self)}, height={self.height}, width={self.width})"
+
+
+class ND2Source(FrameSource):
+    """
+    Nikon .nd2 files, read with pims.ND2Reader_SDK.
+
+    Frames are along the t axis. The other axes (positions m, channels c, ...) are fixed by coordinates, e.g. {'m': 2}
+    for position 2. Axes that aren't given are at 0.
+
+    Files with positions but a single time point have their frames along m instead, one stream.
+    """
+
+    def __init__(self, path, coordinates=None):
+        # Only needed for .nd2 files, and it needs the Nikon SDK
+        from pims import ND2Reader_SDK
+        self.path = path
+        self.reader = ND2Reader_SDK(path)
+        sizes = self.reader.sizes
+        # new nikon weirdness
+        self.frame_axis = 'm' if 'm' in sizes and sizes.get('t', 1) <= 1 else 't'
+        self.coordinates = dict(coordinates or {})
+        for axis, value in self.coordinates.items():
+            if axis in ('x', 'y', self.frame_axis) or not 0 <= value < sizes.get(axis, 1):
+                self.reader.close()
+                raise ValueError(f"{path} has no stream {axis}={value}, its axes are {dict(sizes)}")
+            self.reader.default_coords[axis] = value
+        if self.frame_axis in sizes:
+            self.reader.iter_axes = self.frame_axis
+        self.height = self.reader.metadata['height']
+        self.width = self.reader.metadata['width']
+
+    def stream_coordinates(self, axes="m"):
+        sizes = self.reader.sizes
+        axes = [axis for axis in axes if axis != self.frame_axis and sizes.get(axis, 1) > 1]
+        return [dict(zip(axes, values)) for values in itertools.product(*(range(sizes[axis]) for axis in axes))]
+
+    def __len__(self):
+        return len(self.reader)
+
+    def __getitem__(self, frame_number):
+        return self.reader[frame_number]
+
+    def close(self):
+        self.reader.close()
+
+
+class TiffSource(FrameSource):
+    """Multipage and OME tiff files, read with tifffile. Memory-mapped when the frames are stored uncompressed"""
+
+    def __init__(self, path):
+        try:
+            import tifffile
+        except ImportError as e:
+            raise ImportError(f"reading {path} needs the tifffile package (pip install tifffile)") from e
+        self.path = path
+        self.tiff = tifffile.TiffFile(path)
+        series = self.tiff.series[0]
+        self.height, self.width = series.shape[-2:]
+        self.pages = series.pages
+        dtype = np.dtype(self.tiff.byteorder + series.dtype.char)
+        if series.dataoffset is not None and dtype.isnative:
+            # All frames are stored uncompressed, one after the other, in a byte order OpenCV can use
+            self.frames = np.memmap(path, dtype=dtype, mode="r", offset=series.dataoffset,
+                                    shape=series.shape).reshape(-1, self.height, self.width)
+        else:
+            self.frames = None
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __getitem__(self, frame_number):
+        if self.frames is not None:
+            return self.frames[frame_number]
+        return self.pages[frame_number].asarray()
+
+    def close(self):
+        self.frames = None
+        self.tiff.close()
+
+
+class VideoSource(FrameSource):
+    """Video files (e.g. .avi), read with OpenCV. Reading frames in order is much faster than jumping around"""
+
+    def __init__(self, path):
+        self.path = path
+        self.capture = cv.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise IOError(f"Could not open video {path}")
+        self.height = int(self.capture.get(cv.CAP_PROP_FRAME_HEIGHT))
+        self.width = int(self.capture.get(cv.CAP_PROP_FRAME_WIDTH))
+        self.frame_count = int(self.capture.get(cv.CAP_PROP_FRAME_COUNT))
+        self.next_frame = 0
+
+    def __len__(self):
+        return self.frame_count
+
+    def __getitem__(self, frame_number):
+        if frame_number < 0:
+            frame_number += self.frame_count
+        if frame_number != self.next_frame:
+            self.capture.set(cv.CAP_PROP_POS_FRAMES, frame_number)
+        ok, frame = self.capture.read()
+        if not ok:
+            raise IndexError(f"Could not read frame {frame_number} of {self.path}")
+        self.next_frame = frame_number + 1
+        if frame.ndim == 3:
+            frame = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+        return frame
+
+    def close(self):
+        self.capture.release()
+
+
+class MemmapSource(FrameSource):
+    """
+    (frames, height, width) stacks memory-mapped from a .npy file, or from a .raw file described by a .json sidecar.
+    Frames are read-only views of the file, nothing is copied until they are used.
+
+    (positions, frames, height, width) stacks hold one stream per position, chosen with coordinates {'m': position}.
+    """
+
+    def __init__(self, path, shape=None, dtype=None, offset=0, coordinates=None):
+        self.path = path
+        self.positions = None
+        if path.lower().endswith(".npy"):
+            self.frames = np.load(path, mmap_mode="r")
+        else:
+            if shape is None:
+                with open(path + ".json", "r") as file:
+                    layout = json.load(file)
+                shape, dtype, offset = layout["shape"], layout["dtype"], layout.get("offset", 0)
+            self.frames = np.memmap(path, dtype=np.dtype(dtype), mode="r", offset=offset, shape=tuple(shape))
+        coordinates = dict(coordinates or {})
+        if self.frames.ndim == 4:
+            self.positions = self.frames
+            position = coordinates.pop('m', 0)
+            if not 0 <= position < len(self.positions):
+                raise ValueError(f"{path} has no stream m={position}, it has {len(self.positions)} positions")
+            self.frames = self.positions[position]
+        if coordinates:
+            raise ValueError(f"{path} has no stream {coordinates}")
+        if self.frames.ndim != 3:
+            raise ValueError(f"Expected a (frames, height, width) stack in {path}, got shape {self.frames.shape}")
+        self.height, self.width = self.frames.shape[1:]
+
+    def __len__(self):
+        return self.frames.shape[0]
+
+    def __getitem__(self, frame_number):
+        return self.frames[frame_number]
+
+    def stream_coordinates(self, axes="m"):
+        if 'm' in axes and self.positions is not None and len(self.positions) > 1:
+            return [{'m': position} for position in range(len(self.positions))]
+        return [{}]
+
+    def close(self):
+        self.frames = self.positions = None
+
+
+class CroppedSource(FrameSource):
+    """
+    A region of interest of another source. Frames are views of the full frames.
+
+    Args:
+        source (FrameSource): The full frames.
+        x, y (int): Top left corner of the ROI (px).
+        width, height (int): Size of the ROI (px). 0, or more than what is left of the frame: to the edge of the frame.
+    """
+
+    def __init__(self, source: FrameSource, x=0, y=0, width=0, height=0):
+        if not (0 <= x < source.width and 0 <= y < source.height):
+            raise ValueError(f"ROI corner ({x}, {y}) is outside the {source.width}x{source.height} frames of "
+                             f"{source.path}")
+        self.source = source
+        self.path = source.path
+        self.x, self.y = x, y
+        self.width = min(width, source.width - x) if width > 0 else source.width - x
+        self.height = min(height, source.height - y) if height > 0 else source.height - y
+
+    def __len__(self):
+        return len(self.source)
+
+    def __getitem__(self, frame_number):
+        return self.source[frame_number][self.y:self.y + self.height, self.x:self.x + self.width]
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.source!r}, x={self.x}, y={self.y}, width={self.width}, " \
+               f"height={self.height})"
+
+
+def crop(source: FrameSource, x=0, y=0, width=0, height=0) -> FrameSource:
+    """The ROI of a source, see CroppedSource. The source itself if the ROI is the whole frame"""
+    if x == 0 and y == 0 and (width <= 0 or width >= source.width) and (height <= 0 or height >= source.height):
+        return source
+    return CroppedSource(source, x, y, width, height)
+
+
+SOURCES = {
+    ".nd2": ND2Source,
+    ".tif": TiffSource,
+    ".tiff": TiffSource,
+    ".avi": VideoSource,
+    ".npy": MemmapSource,
+    ".raw": MemmapSource,
+}
+
+
+def open_source(path: str) -> FrameSource:
+    """Opens the file (or one stream of it, see list_streams) with the FrameSource for its extension"""
+    file_path, coordinates = split_stream(path)
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension not in SOURCES:
+        raise ValueError(f"Unsupported file type {extension!r}, expected one of {', '.join(SOURCES)}")
+    if not coordinates:
+        return SOURCES[extension](file_path)
+    if SOURCES[extension] not in (ND2Source, MemmapSource):
+        raise ValueError(f"{file_path} has a single stream, it can't be opened as {path}")
+    return SOURCES[extension](file_path, coordinates=coordinates)
+
+
+def is_supported(path: str) -> bool:
+    return os.path.splitext(split_stream(path)[0])[1].lower() in SOURCES
+
+
+def stream_path(path: str, coordinates: typing.Mapping[str, int]) -> str:
+    """The name of one stream of a file, e.g. movie.nd2#m=2. The file itself if there are no coordinates"""
+    if not coordinates:
+        return path
+    return path + STREAM_SEPARATOR + ",".join(f"{axis}={value}" for axis, value in coordinates.items())
+
+
+def split_stream(path: str) -> typing.Tuple[str, typing.Dict[str, int]]:
+    """(file path, coordinates) of a stream_path. Coordinates are {} for a plain file path"""
+    file_path, separator, stream = path.rpartition(STREAM_SEPARATOR)
+    if not separator or not STREAM_PATTERN.fullmatch(stream):
+        return path, {}
+    return file_path, {axis: int(value) for axis, value in (coordinate.split("=") for coordinate in stream.split(","))}
+
+
+def stream_name(path: str) -> str:
+    """File name without extension, plus the coordinates of the stream, to name output files, e.g. movie_m2"""
+    file_path, coordinates = split_stream(path)
+    file_name = os.path.splitext(os.path.basename(file_path))[0]
+    return file_name + "".join(f"_{axis}{value}" for axis, value in coordinates.items())
+
+
+def list_streams(path: str, axes: str = "m") -> typing.List[str]:
+    """
+    Every stream of a file along the given axes (e.g. 'm' for each position, 'mc' for each position and channel), as
+    stream paths. Only the path itself for files with one stream, or for a path that already is a stream.
+    """
+    if split_stream(path)[1]:
+        return [path]
+    with open_source(path) as source:
+        return [stream_path(path, coordinates) for coordinates in source.stream_coordinates(axes)]
+
+
+def convert_to_npy(path: str, npy_path: str,
+                   progress: typing.Optional[typing.Callable[[int, int], None]] = None) -> None:
+    """
+    Copies every frame of a file into a .npy file, which MemmapSource reads without decoding.
+
+    Args:
+        path (str): Any file open_source can read.
+        npy_path (str): The .npy file to write.
+        progress (Callable[[int, int], None], optional): Called with (frames done, total frames) after each frame.
+    """
+    with open_source(path) as source:
+        first_frame = np.asarray(source[0])
+        frames = np.lib.format.open_memmap(npy_path, mode="w+", dtype=first_frame.dtype,
+                                           shape=(len(source), source.height, source.width))
+        for frame_number in range(len(source)):
+            frames[frame_number] = source[frame_number]
+            if progress is not None:
+                progress(frame_number + 1, len(source))
+        frames.flush()
+        del frames
@@ -0,0 +1,126 @@
+"""
+===================
+S P I L L
+===================
+Writing outputs that grow with the length of a run to disk as they are made, instead of keeping them in memory.
+
+A RowFile is a raw binary file of fixed width rows, appended every chunk_rows rows. The detections and annotations
+.npz files are written through one (<file>.npz.part) and converted to .npz by save_columns at the end of the run, one
+chunk at a time, so memory is set by the chunk size instead of the length of the file. Checkpoints (see checkpoint.py)
+only record how far each RowFile got, and continue it from there.
+"""
+import os
+import typing
+import zipfile
+
+import numpy as np
+
+
+def part_filename(filename: str, name: str = "") -> str:
+    """The RowFile an output is written to before it is saved: <filename>.part, or <filename>.<name>.part"""
+    return f"{filename}.{name}.part" if name else f"{filename}.part"
+
+
+class RowFile:
+    """
+    Rows of width values each, appended to a raw binary file every chunk_rows rows.
+
+    The file isn't kept open, so a RowFile can be pickled.
+
+    Methods
+    -------
+    append(rows: np.ndarray) -> None
+        Adds (N, width) rows.
+
+    flush() -> None
+        Writes the buffered rows to the file.
+
+    position() -> Tuple[int, int]
+        Flushes, then returns (rows written, size of the file in bytes). Passing it back as resume_at continues the
+        file from this point.
+
+    read() -> np.ndarray
+        Flushes, then returns every row written as a read-only (rows, width) memmap.
+
+    remove() -> None
+        Deletes the file.
+    """
+
+    def __init__(self, filename, width, dtype=np.int32, chunk_rows=100_000, resume_at=None):
+        self.filename = filename
+        self.width = width
+        self.dtype = np.dtype(dtype)
+        self.chunk_rows = max(1, chunk_rows)
+        self.buffer = np.empty((min(self.chunk_rows, 4096), width), dtype=self.dtype)
+        self.buffered = 0
+        self.rows_written = 0
+        if resume_at is None:
+            open(filename, "wb").close()
+        else:
+            # Drop the rows written after resume_at was taken
+            self.rows_written, size = resume_at
+            with open(filename, "r+b") as file:
+                file.truncate(size)
+
+    def append(self, rows):
+        rows = np.asarray(rows).reshape(-1, self.width)
+        while len(rows):
+            if self.buffered == len(self.buffer):
+                if len(self.buffer) < self.chunk_rows:
+                    buffer = np.empty((min(2 * len(self.buffer), self.chunk_rows), self.width), dtype=self.dtype)
+                    buffer[:self.buffered] = self.buffer
+                    self.buffer = buffer
+                else:
+                    self.flush()
+            count = min(len(rows), len(self.buffer) - self.buffered)
+            self.buffer[self.buffered:self.buffered + count] = rows[:count]
+            self.buffered += count
+            rows = rows[count:]
+
+    def flush(self):
+        if self.buffered:
+            with open(self.filename, "ab") as file:
+                self.buffer[:self.buffered].tofile(file)
+            self.rows_written += self.buffered
+            self.buffered = 0
+
+    def position(self):
+        self.flush()
+        return self.rows_written, os.path.getsize(self.filename)
+
+    def read(self):
+        self.flush()
+        if not self.rows_written:
+            return np.empty((0, self.width), dtype=self.dtype)
+        return np.memmap(self.filename, dtype=self.dtype, mode="r", shape=(self.rows_written, self.width))
+
+    def remove(self):
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+def save_columns(npz_filename: str, row_file: RowFile, names: typing.Sequence[str],
+                 fields: typing.Dict[str, typing.Any]) -> None:
+    """
+    Writes the columns of a RowFile, and other fields, as a compressed .npz file.
+
+    The file is the same as np.savez_compressed(npz_filename, **columns, **fields) would write, but each column is
+    copied from the RowFile one chunk at a time.
+
+    Args:
+        npz_filename (str): The .npz file to write.
+        row_file (RowFile): Its columns are saved under names, in order.
+        names (Sequence[str]): Name of each column.
+        fields (Dict[str, Any]): Other arrays (or scalars and strings) to save.
+    """
+    table = row_file.read()
+    with zipfile.ZipFile(npz_filename, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as npz:
+        for index, name in enumerate(names):
+            with npz.open(name + ".npy", "w", force_zip64=True) as member:
+                np.lib.format.write_array_header_1_0(member, {'descr': np.lib.format.dtype_to_descr(table.dtype),
+                                                              'fortran_order': False, 'shape': (len(table),)})
+                for chunk_start in range(0, len(table), row_file.chunk_rows):
+                    member.write(np.ascontiguousarray(table[chunk_start:chunk_start + row_file.chunk_rows, index]))
+        for name, value in fields.items():
+            with npz.open(name + ".npy", "w", force_zip64=True) as member:
+                np.lib.format.write_array(member, np.asanyarray(value), allow_pickle=False)
@@ -0,0 +1,164 @@
+"""
+===================
+S W E E P
+===================
+Tries many combinations of parameters on one file in a single pass, to choose the parameters.
+
+Running main.py once per combination decodes the file and runs MOG2 again every time, although neither depends on the
+parameters being tried. A sweep decodes and background-subtracts each frame once, detects objects once for each
+distinct combination of detection parameters (canny thresholds, cell radius), and links the detections once for each
+combination of linking parameters (max centroid distance, timeout). The result is one table of cell counts with a row
+for every combination:
+
+    python -m COUNT.sweep path/to/file.nd2 --grid grid.json --output sweep.csv
+
+grid.json lists the values to try for each parameter, e.g.
+
+    {"canny_lower": [50, 85, 120], "cell_radius": [4, 6, 8], "max_centroid_distance": [40, 70], "timeout": [3, 5]}
+
+Parameters that aren't in the grid come from the settings file. A motion gate (see gating.py) decides once per frame
+whether detection runs, for every combination, waiting for the longest timeout of the grid before striding while idle.
+"""
+import argparse
+import contextlib
+import csv
+import dataclasses
+import itertools
+import json
+import os
+import typing
+
+import numpy as np
+from tqdm import tqdm
+
+from COUNT.background import create_background
+from COUNT.gating import MotionGate, gate_enabled
+from COUNT.parameters import TrackingParameters
+from COUNT.sources import stream_name
+from COUNT.tracking import FrameWorkspace, Tracker, detect_boxes, open_frames, subtract_background
+
+# Parameters that change what is detected in each frame
+DETECTION_PARAMETERS = ("canny_lower", "canny_upper", "cell_radius", "detection_engine")
+# Parameters that only change how detections are linked into tracks
+LINKING_PARAMETERS = ("max_centroid_distance", "timeout", "assignment")
+NO_BOXES = np.empty((0, 4), dtype=np.int32)  # Frames the motion gate leaves out
+
+
+def parameter_sets(grid: typing.Mapping[str, typing.Sequence], names) -> typing.List[typing.Dict[str, typing.Any]]:
+    """Every combination of the values in the grid for the given parameter names"""
+    names = [name for name in names if name in grid]
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def sweep(nd2_file_path: str, grid: typing.Mapping[str, typing.Sequence], params: TrackingParameters,
+          progress: typing.Optional[typing.Callable[[int, int], None]] = None) -> typing.List[
+    typing.Dict[str, typing.Any]]:
+    """
+    Track one file with every combination of parameters in the grid, in one pass over the frames.
+
+    Args:
+        nd2_file_path (str): Path to the file, see sources.open_source.
+        grid (Mapping[str, Sequence]): Values to try for each parameter. Only detection and linking parameters (see
+            DETECTION_PARAMETERS and LINKING_PARAMETERS) can be swept.
+        params (TrackingParameters): Values of the parameters that aren't in the grid.
+        progress (Callable[[int, int], None], optional): Called after each frame with (frames done, total frames).
+            If not given, a tqdm progress bar is shown instead.
+
+    Returns:
+        List[dict]: One row per combination, with the swept parameters, 'cells_counted', 'DEP_true' and 'DEP_false'.
+    """
+    unknown = set(grid) - set(DETECTION_PARAMETERS) - set(LINKING_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Can't sweep {', '.join(sorted(unknown))} in one pass, only "
+                         f"{', '.join(DETECTION_PARAMETERS + LINKING_PARAMETERS)}")
+    detection_sets = parameter_sets(grid, DETECTION_PARAMETERS)
+    linking_sets = parameter_sets(grid, LINKING_PARAMETERS)
+    # Overlays would be saved once per combination
+    params = dataclasses.replace(params, save_overlay=False)
+
+    backSub = create_background(params)
+    with contextlib.ExitStack() as exit_stack:
+        frames, masks, cache_writer = open_frames(nd2_file_path, params, exit_stack)
+        total_frames, image_h = frames.shape[:2]
+        workspace = FrameWorkspace(frames.shape[1:])
+
+        # One tracker per combination, grouped by the detections they link
+        detectors = []
+        for detection_set in detection_sets:
+            detection_params = dataclasses.replace(params, **detection_set)
+            # Only the counts of each combination are needed
+            trackers = [(linking_set, Tracker(dataclasses.replace(detection_params, count_only=True, **linking_set),
+                                              image_h))
+                        for linking_set in linking_sets]
+            detectors.append((detection_set, detection_params, trackers))
+
+        # Frames without motion skip detection for every combination, see gating.py. Tracks of every combination have
+        # expired before the gate strides through idle frames
+        gate = None
+        if gate_enabled(params):
+            timeout = max(linking_set.get('timeout', params.timeout) for linking_set in linking_sets)
+            gate = MotionGate(dataclasses.replace(params, timeout=timeout), total_frames, keep_status=False)
+        foreground = subtract_background(frames, backSub, workspace, masks,
+                                         record=cache_writer.add if cache_writer is not None else None, gate=gate)
+        if progress is None:
+            foreground = tqdm(foreground, "Sweep", total=total_frames)
+        for frame_number, (frame_data, backSub_mask) in enumerate(foreground):
+            for detection_set, detection_params, trackers in detectors:
+                if backSub_mask is None:
+                    boxes = NO_BOXES
+                else:
+                    boxes, _ = detect_boxes(frame_data, backSub_mask, detection_params, workspace=workspace)
+                for _, tracker in trackers:
+                    tracker.expire(frame_number)
+                    tracker.link(boxes, frame_number)
+            if progress is not None:
+                progress(frame_number + 1, total_frames)
+
+        if cache_writer is not None:
+            cache_writer.commit()
+        if gate is not None:
+            print(f"\n{nd2_file_path}: {gate.summary()}")
+
+    rows = []
+    for detection_set, _, trackers in detectors:
+        for linking_set, tracker in trackers:
+            tracker.finish()
+            rows.append({**detection_set, **linking_set, 'cells_counted': tracker.cells_counted,
+                         'DEP_true': tracker.DEP_true, 'DEP_false': tracker.DEP_false})
+    return rows
+
+
+def export_sweep_to_csv(rows: typing.List[typing.Dict[str, typing.Any]], csv_filename: str) -> None:
+    with open(csv_filename, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=list(rows[0]) if rows else ['cells_counted', 'DEP_true',
+                                                                              'DEP_false'])
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Try many combinations of tracking parameters on one file.")
+    parser.add_argument("path", help="file to track (.nd2, .tif, .avi, .npy or .raw)")
+    parser.add_argument("--grid", required=True, help=".json file with the values to try for each parameter")
+    parser.add_argument("--settings", default="settings.json",
+                        help="settings .json file for the parameters that aren't swept (default: settings.json)")
+    parser.add_argument("--output", help="summary .csv file (default: <file>_sweep.csv in csv_save_path)")
+    args = parser.parse_args()
+
+    params = TrackingParameters.from_settings_file(args.settings)
+    with open(args.grid, "r") as file:
+        grid = json.load(file)
+
+    rows = sweep(args.path, grid, params)
+
+    csv_filename = args.output
+    if not csv_filename:
+        os.makedirs(params.csv_save_path, exist_ok=True)
+        file_name = stream_name(args.path)
+        csv_filename = os.path.join(params.csv_save_path, f"{file_name}_sweep.csv")
+    export_sweep_to_csv(rows, csv_filename)
+    print(f"\n{len(rows)} combinations tried, {csv_filename} saved")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from COUNT.annotations import SavedAnnotations, parse_frames, render_annotations
+from COUNT.parameters import TrackingParameters
+from COUNT.tests.test_sweep import crossing_cells
+from COUNT.tracking import nd2_mog_contours
+
+
+class TestAnnotations(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "cells.npy")
+        np.save(self.path, crossing_cells())
+        self.params = TrackingParameters(cell_radius=5)
+        self.annotations_filename = os.path.join(self.tmp.name, "cells_annotations.npz")
+        self.expired, self.history = nd2_mog_contours(self.path, self.params, progress=lambda *_: None,
+                                                      annotations_filename=self.annotations_filename)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_annotations_match_trajectories(self):
+        annotations = SavedAnnotations(self.annotations_filename)
+        self.assertEqual((annotations.total_frames, annotations.image_h, annotations.source), (50, 64, self.path))
+        self.assertEqual(len(annotations), len(self.history))
+        np.testing.assert_array_equal(annotations.frame, self.history.column("frame"))
+        np.testing.assert_array_equal(annotations.object_id, self.history.column("object_id"))
+        np.testing.assert_array_equal(annotations.boxes[:, 0], self.history.column("x"))
+        np.testing.assert_array_equal(annotations.frames_tracked, self.history.column("frames_tracked"))
+        # Cells still in the channel at the end are only counted by Tracker.finish
+        self.assertTrue(0 < annotations.total[-1] <= len(self.expired))
+        self.assertTrue(np.all(np.diff(annotations.total) >= 0))
+
+    def test_render_frame_range(self):
+        rendered = list(render_annotations(self.annotations_filename, range(10, 15)))
+        self.assertEqual([frame_number for frame_number, _ in rendered], [10, 11, 12, 13, 14])
+        frame_number, image = rendered[-1]
+        self.assertEqual(image.shape, (64, 160, 3))
+        # Red boxes around the cells
+        self.assertTrue(np.any((image[:, :, 2] == 255) & (image[:, :, 0] == 0)))
+
+    def test_render_track(self):
+        annotations = SavedAnnotations(self.annotations_filename)
+        object_id = int(annotations.object_id[len(annotations) // 2])
+        frames = annotations.frame[annotations.object_id == object_id].tolist()
+        rendered = [frame_number for frame_number, _ in render_annotations(self.annotations_filename,
+                                                                            object_ids=[object_id])]
+        self.assertEqual(rendered, frames)
+
+    def test_parse_frames(self):
+        self.assertEqual(parse_frames("10:20"), range(10, 20))
+        self.assertEqual(parse_frames("7"), range(7, 8))
+        self.assertEqual(parse_frames(":5"), range(0, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import dataclasses
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from COUNT.background import TemporalMedianBackground, benchmark_engines, create_background
+from COUNT.parameters import TrackingParameters
+from COUNT.tests.test_sweep import crossing_cells
+from COUNT.tracking import nd2_mog_contours
+
+
+class TestTemporalMedianBackground(unittest.TestCase):
+    def setUp(self):
+        self.background = np.tile(np.arange(0, 200, 10, dtype=np.uint8), (16, 1))
+
+    def moving_square(self, frame_number):
+        frame = self.background.copy()
+        x = frame_number % 20
+        frame[4:8, x:x + 4] = 255
+        return frame
+
+    def test_foreground_is_the_moving_object(self):
+        engine = TemporalMedianBackground(threshold=25, samples=5, stride=3, refresh=0)
+        for frame_number in range(30):
+            mask = engine.apply(self.moving_square(frame_number))
+        np.testing.assert_array_equal(engine.getBackgroundImage(), self.background)
+        expected = np.zeros_like(mask)
+        expected[4:8, 9:13] = 255
+        np.testing.assert_array_equal(mask, expected)
+
+    def test_mask_written_into_fgmask(self):
+        engine = TemporalMedianBackground()
+        fgmask = np.empty_like(self.background)
+        self.assertIs(engine.apply(self.background, fgmask), fgmask)
+        self.assertFalse(fgmask.any())
+
+    def test_static_and_refreshed_background(self):
+        static = TemporalMedianBackground(samples=3, stride=1, refresh=0)
+        refreshed = TemporalMedianBackground(samples=3, stride=1, refresh=5)
+        for frame_number in range(10):
+            frame = self.background if frame_number < 3 else self.background + 20
+            static.apply(frame)
+            refreshed.apply(frame)
+        np.testing.assert_array_equal(static.getBackgroundImage(), self.background)
+        np.testing.assert_array_equal(refreshed.getBackgroundImage(), self.background + 20)
+
+    def test_create_background(self):
+        self.assertIsInstance(create_background(TrackingParameters(background_engine="median")),
+                              TemporalMedianBackground)
+        self.assertIsNotNone(create_background(TrackingParameters(background_engine="knn")))
+        with self.assertRaises(ValueError):
+            create_background(TrackingParameters(background_engine="average"))
+
+
+class TestEngines(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "cells.npy")
+        np.save(self.path, crossing_cells(n_frames=150))
+        self.params = TrackingParameters(cell_radius=5)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_engines_agree(self):
+        rows = benchmark_engines(self.path, self.params)
+        self.assertEqual([row['engine'] for row in rows], ["mog2", "knn", "median"])
+        self.assertGreater(rows[0]['cells_counted'], 0)
+        for row in rows:
+            self.assertAlmostEqual(row['agreement'], 1.0, delta=0.05)
+            self.assertGreater(row['fps'], 0)
+
+    def test_median_engine_with_detection_workers(self):
+        params = dataclasses.replace(self.params, background_engine="median")
+        expected, _ = nd2_mog_contours(self.path, params, progress=lambda *_: None)
+        expired, _ = nd2_mog_contours(self.path, dataclasses.replace(params, detection_workers=1),
+                                      progress=lambda *_: None)
+        self.assertEqual(sorted((obj.object_id, obj.position) for obj in expired.values()),
+                         sorted((obj.object_id, obj.position) for obj in expected.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import csv
+import os
+import tempfile
+import unittest
+
+import cv2 as cv
+import numpy as np
+
+from COUNT.batch import (combine_streams, export_position_summaries, find_nd2_files, find_streams, process_file,
+                         run_batch)
+from COUNT.parameters import TrackingParameters
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.params = TrackingParameters(csv_save_path=self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_find_nd2_files(self):
+        for name in ["b.nd2", "a.nd2", "notes.txt"]:
+            open(os.path.join(self.tmp.name, name), "w").close()
+        files = find_nd2_files([self.tmp.name, "other.nd2"])
+        self.assertEqual(files, [os.path.join(self.tmp.name, "a.nd2"), os.path.join(self.tmp.name, "b.nd2"),
+                                 "other.nd2"])
+
+    def test_process_npy_file(self):
+        # Cells crossing a dark channel from left to right, one every 10 frames
+        frames = np.full((60, 48, 160), 100, dtype=np.uint16)
+        for frame_number in range(len(frames)):
+            for start in range(0, frame_number + 1, 10):
+                cv.circle(frames[frame_number], (8 * (frame_number - start), 24), 5, 4000, -1)
+        npy_file = os.path.join(self.tmp.name, "cells.npy")
+        np.save(npy_file, frames)
+        result = process_file(npy_file, self.params, verbose=False)
+        self.assertEqual(result['error'], '')
+        self.assertGreater(result['cells_counted'], 0)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, "cells_results.csv")))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, "cells_trajectory_results.csv")))
+
+    def test_multipoint_positions(self):
+        # Three positions with different cells: each is tracked on its own, as if it were a file
+        positions = np.full((3, 60, 48, 160), 100, dtype=np.uint16)
+        for position, every in enumerate((10, 15, 30)):
+            for frame_number in range(60):
+                for start in range(0, frame_number + 1, every):
+                    cv.circle(positions[position, frame_number], (8 * (frame_number - start), 24), 5, 4000, -1)
+            np.save(os.path.join(self.tmp.name, f"single_{position}.npy"), positions[position])
+        npy_file = os.path.join(self.tmp.name, "multipoint.npy")
+        np.save(npy_file, positions)
+
+        streams = find_streams([npy_file])
+        self.assertEqual(len(streams), 3)
+        results = run_batch(streams, self.params, workers=3)
+        self.assertEqual([result['error'] for result in results], [''] * 3)
+        for position, result in enumerate(results):
+            single = process_file(os.path.join(self.tmp.name, f"single_{position}.npy"), self.params, verbose=False)
+            self.assertEqual(result['cells_counted'], single['cells_counted'])
+            self.assertTrue(os.path.exists(os.path.join(self.tmp.name, f"multipoint_m{position}_results.csv")))
+
+        total, = combine_streams(results)
+        self.assertEqual((total['file'], total['streams']), (npy_file, 3))
+        self.assertEqual(total['cells_counted'], sum(result['cells_counted'] for result in results))
+        csv_filename, = export_position_summaries(results, self.tmp.name, verbose=False)
+        with open(csv_filename) as file:
+            rows = list(csv.DictReader(file))
+        self.assertEqual([row['stream'] for row in rows], ['m=0', 'm=1', 'm=2', 'total'])
+        self.assertEqual(int(rows[-1]['cells_counted']), total['cells_counted'])
+
+    def test_process_file_error(self):
+        # A file that can't be read is reported, not raised
+        result = process_file(os.path.join(self.tmp.name, "missing.nd2"), self.params, verbose=False)
+        self.assertTrue(result['error'])
+        self.assertEqual(result['cells_counted'], 0)
+
+    def test_run_batch_failures_are_independent(self):
+        files = [os.path.join(self.tmp.name, f"missing_{i}.nd2") for i in range(3)]
+        results = run_batch(files, self.params, workers=2)
+        self.assertEqual([result['file'] for result in results], files)
+        self.assertTrue(all(result['error'] for result in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
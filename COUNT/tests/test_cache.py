@@ -0,0 +1,105 @@
+import dataclasses
+import os
+import tempfile
+import unittest
+
+import cv2 as cv
+import numpy as np
+
+from COUNT.cache import FrameCache
+from COUNT.parameters import TrackingParameters
+from COUNT.tracking import nd2_mog_contours
+
+
+class TestFrameCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp.name, "cache")
+        self.params = TrackingParameters(frame_cache_dir=self.cache_dir)
+        self.frames = np.random.default_rng(0).integers(0, 256, size=(5, 16, 20), dtype=np.uint8)
+        self.files = []
+        for name in ["a.npy", "b.npy", "c.npy"]:
+            path = os.path.join(self.tmp.name, name)
+            np.save(path, self.frames)
+            self.files.append(path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def save(self, cache, path, params):
+        with cache.writer(path, params, len(self.frames), self.frames.shape[1:]) as writer:
+            for frame_number, frame in enumerate(self.frames):
+                writer.add(frame_number, frame, 255 - frame)
+            writer.commit()
+
+    def test_round_trip(self):
+        cache = FrameCache(self.cache_dir, max_mb=1)
+        self.assertIsNone(cache.lookup(self.files[0], self.params))
+        self.save(cache, self.files[0], self.params)
+        cached = cache.lookup(self.files[0], self.params)
+        self.assertEqual(len(cached), len(self.frames))
+        self.assertEqual(cached.shape, self.frames.shape[1:])
+        np.testing.assert_array_equal(cached.frames, self.frames)
+        np.testing.assert_array_equal(cached.masks, 255 - self.frames)
+
+    def test_key(self):
+        cache = FrameCache(self.cache_dir, max_mb=1)
+        key = cache.key(self.files[0], self.params)
+        # Detection and tracking parameters don't change the frames
+        self.assertEqual(key, cache.key(self.files[0], dataclasses.replace(self.params, canny_lower=20, timeout=9)))
+        self.assertNotEqual(key, cache.key(self.files[0], dataclasses.replace(self.params, intensity_window="fixed")))
+        self.assertNotEqual(key, cache.key(self.files[0], dataclasses.replace(self.params, background_engine="knn")))
+        self.assertNotEqual(key, cache.key(self.files[1], self.params))
+        # A changed file is a new entry
+        np.save(self.files[0], self.frames[:3])
+        self.assertNotEqual(key, cache.key(self.files[0], self.params))
+
+    def test_uncommitted_entry_is_thrown_away(self):
+        cache = FrameCache(self.cache_dir, max_mb=1)
+        with cache.writer(self.files[0], self.params, len(self.frames), self.frames.shape[1:]) as writer:
+            writer.add(0, self.frames[0], self.frames[0])
+        self.assertIsNone(cache.lookup(self.files[0], self.params))
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_eviction(self):
+        entry_bytes = 2 * self.frames.nbytes
+        # Room for two entries
+        cache = FrameCache(self.cache_dir, max_mb=(2 * entry_bytes + 2000) / 2**20)
+        self.save(cache, self.files[0], self.params)
+        self.save(cache, self.files[1], self.params)
+        # Use a, so b is the least recently used
+        os.utime(os.path.join(self.cache_dir, cache.key(self.files[1], self.params), "entry.json"), (0, 0))
+        self.assertIsNotNone(cache.lookup(self.files[0], self.params))
+        self.save(cache, self.files[2], self.params)
+        self.assertIsNotNone(cache.lookup(self.files[0], self.params))
+        self.assertIsNone(cache.lookup(self.files[1], self.params))
+        self.assertIsNotNone(cache.lookup(self.files[2], self.params))
+
+    def test_too_large(self):
+        cache = FrameCache(self.cache_dir, max_mb=self.frames.nbytes / 2**20)
+        self.assertIsNone(cache.writer(self.files[0], self.params, len(self.frames), self.frames.shape[1:]))
+        params = dataclasses.replace(self.params, cache_masks=False)
+        writer = cache.writer(self.files[0], params, len(self.frames), self.frames.shape[1:])
+        self.assertIsNotNone(writer)
+        writer.close()
+
+    def test_tracking_with_cache(self):
+        frames = np.full((40, 48, 160), 100, dtype=np.uint16)
+        for frame_number in range(len(frames)):
+            for start in range(0, frame_number + 1, 10):
+                cv.circle(frames[frame_number], (8 * (frame_number - start), 24), 5, 4000, -1)
+        path = os.path.join(self.tmp.name, "cells.npy")
+        np.save(path, frames)
+
+        def positions(params):
+            expired, history = nd2_mog_contours(path, params, progress=lambda *_: None)
+            return sorted((obj.object_id, obj.position) for obj in expired.values()), history.column("x").tolist()
+
+        expected = positions(TrackingParameters())
+        for params in [self.params, self.params, dataclasses.replace(self.params, cache_masks=False)]:
+            self.assertEqual(positions(params), expected)
+        self.assertIsNotNone(FrameCache(self.cache_dir, self.params.frame_cache_mb).lookup(path, self.params))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,211 @@
+import dataclasses
+import filecmp
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from COUNT.checkpoint import load_checkpoint
+from COUNT.gating import FRAME_EMPTY
+from COUNT.parameters import TrackingParameters
+from COUNT.tests.test_gating import cells_with_pauses
+from COUNT.tests.test_sweep import crossing_cells
+from COUNT.tracking import TrajectoryWriter, nd2_mog_contours
+
+
+class Crash(Exception):
+    pass
+
+
+def crash_after(frames):
+    """A progress callback that stops the run once the given number of frames is done"""
+    done = [0]
+
+    def progress(frames_in_batch, total_frames):
+        done[0] += frames_in_batch
+        if done[0] >= frames:
+            raise Crash
+
+    return progress
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "cells.npy")
+        np.save(self.path, crossing_cells(n_frames=350))
+        self.params = TrackingParameters(cell_radius=5, checkpoint_every=100, checkpoint_warmup=100)
+        self.checkpoint_filename = os.path.join(self.tmp.name, "cells_checkpoint.pkl")
+        self.trajectory_csv_filename = os.path.join(self.tmp.name, "trajectory.csv")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_tracking(self, params, progress=lambda *_: None, trajectory_csv_filename=None):
+        return nd2_mog_contours(self.path, params, progress=progress, trajectory_csv_filename=trajectory_csv_filename,
+                                checkpoint_filename=self.checkpoint_filename)
+
+    def assert_resumes_like_uninterrupted_run(self, params, exact):
+        expected_csv = os.path.join(self.tmp.name, "expected.csv")
+        expected, _ = nd2_mog_contours(self.path, params, progress=lambda *_: None,
+                                       trajectory_csv_filename=expected_csv)
+
+        with self.assertRaises(Crash):
+            self.run_tracking(params, crash_after(250), self.trajectory_csv_filename)
+        checkpoint = load_checkpoint(self.checkpoint_filename, self.path, params, self.trajectory_csv_filename)
+        self.assertEqual(checkpoint['next_frame'], 200)
+
+        expired, history = self.run_tracking(params, trajectory_csv_filename=self.trajectory_csv_filename)
+        self.assertIsNone(history)
+        self.assertFalse(os.path.exists(self.checkpoint_filename))
+        self.assertGreater(len(expired), 0)
+        if exact:
+            self.assertEqual(sorted((obj.object_id, obj.position, obj.DEP_outlet) for obj in expired.values()),
+                             sorted((obj.object_id, obj.position, obj.DEP_outlet) for obj in expected.values()))
+            self.assertTrue(filecmp.cmp(self.trajectory_csv_filename, expected_csv, shallow=False))
+        else:
+            # The same cells are counted, but ids can differ after the checkpoint
+            self.assertEqual(sorted((obj.position, obj.DEP_outlet) for obj in expired.values()),
+                             sorted((obj.position, obj.DEP_outlet) for obj in expected.values()))
+            with open(self.trajectory_csv_filename) as file, open(expected_csv) as expected_file:
+                rows = [row for row in file.read().split() if row[0].isdigit() and int(row.split(",")[0]) < 200]
+                expected_rows = [row for row in expected_file.read().split()
+                                 if row[0].isdigit() and int(row.split(",")[0]) < 200]
+            self.assertEqual(rows, expected_rows)
+
+    def test_resume_with_mog2_warmup(self):
+        self.assert_resumes_like_uninterrupted_run(self.params, exact=False)
+
+    def test_resume_with_cached_masks(self):
+        params = dataclasses.replace(self.params, frame_cache_dir=os.path.join(self.tmp.name, "cache"),
+                                     checkpoint_warmup=0)
+        nd2_mog_contours(self.path, params, progress=lambda *_: None)
+        self.assert_resumes_like_uninterrupted_run(params, exact=True)
+
+    def test_resume_with_cold_frame_cache(self):
+        # The warm-up reaches back to the first frame, and nothing is cached yet: the resumed run must not cache the
+        # frames from the checkpoint on as if they were the first ones
+        params = dataclasses.replace(self.params, frame_cache_dir=os.path.join(self.tmp.name, "cache"),
+                                     checkpoint_warmup=300)
+        expected, _ = nd2_mog_contours(self.path, dataclasses.replace(params, frame_cache_dir=""),
+                                       progress=lambda *_: None)
+        with self.assertRaises(Crash):
+            self.run_tracking(params, crash_after(250))
+        resumed, _ = self.run_tracking(params)
+        self.assertEqual(len(resumed), len(expected))
+
+        # Runs with the cache count the same cells as without it
+        for _ in range(2):
+            cached, _ = nd2_mog_contours(self.path, params, progress=lambda *_: None)
+            self.assertEqual(sorted((obj.object_id, obj.position, obj.DEP_outlet) for obj in cached.values()),
+                             sorted((obj.object_id, obj.position, obj.DEP_outlet) for obj in expected.values()))
+
+    def test_resume_in_memory_history(self):
+        expected, expected_history = nd2_mog_contours(self.path, self.params, progress=lambda *_: None)
+        with self.assertRaises(Crash):
+            self.run_tracking(self.params, crash_after(150))
+        expired, history = self.run_tracking(self.params)
+        self.assertEqual(len(expired), len(expected))
+        for name in ["frame", "object_id", "x", "frames_tracked"]:
+            np.testing.assert_array_equal(history.column(name), expected_history.column(name))
+
+    def test_resume_detections(self):
+        # With cached masks the resumed run saves the same detections as an uninterrupted run
+        params = dataclasses.replace(self.params, frame_cache_dir=os.path.join(self.tmp.name, "cache"),
+                                     checkpoint_warmup=0)
+        expected_filename = os.path.join(self.tmp.name, "expected_detections.npz")
+        nd2_mog_contours(self.path, params, progress=lambda *_: None, detections_filename=expected_filename)
+
+        detections_filename = os.path.join(self.tmp.name, "cells_detections.npz")
+        with self.assertRaises(Crash):
+            nd2_mog_contours(self.path, params, progress=crash_after(250), detections_filename=detections_filename,
+                             checkpoint_filename=self.checkpoint_filename)
+        self.assertIsNotNone(load_checkpoint(self.checkpoint_filename, self.path, params,
+                                             detections_filename=detections_filename))
+        nd2_mog_contours(self.path, params, progress=lambda *_: None, detections_filename=detections_filename,
+                         checkpoint_filename=self.checkpoint_filename)
+        with np.load(detections_filename) as saved, np.load(expected_filename) as expected:
+            self.assertGreater(len(expected['frame']), 0)
+            for name in ["frame", "x", "y", "w", "h"]:
+                np.testing.assert_array_equal(saved[name], expected[name])
+
+    def test_only_live_state_is_pickled(self):
+        with self.assertRaises(Crash):
+            self.run_tracking(self.params, crash_after(250))
+        checkpoint = load_checkpoint(self.checkpoint_filename, self.path, self.params)
+        tracker = checkpoint['tracker']
+        self.assertGreater(tracker.cells_counted, 0)
+        self.assertEqual(tracker.expired_objects_dict, {})
+        # Counted objects and trajectory rows are in the side files, the checkpoint only has their positions
+        self.assertEqual(checkpoint['counted'][0], tracker.cells_counted)
+        self.assertGreater(checkpoint['history'][0], 0)
+        for name in ['counted', 'history']:
+            self.assertEqual(os.path.getsize(f"{self.checkpoint_filename}.{name}"), checkpoint[name][1])
+        self.assertLess(os.path.getsize(self.checkpoint_filename), 10_000)
+
+        # Side files are removed with the checkpoint
+        self.run_tracking(self.params)
+        self.assertEqual([name for name in os.listdir(self.tmp.name) if name.startswith("cells_checkpoint")], [])
+
+    def test_missing_side_file_rows(self):
+        with self.assertRaises(Crash):
+            self.run_tracking(self.params, crash_after(250))
+        with open(f"{self.checkpoint_filename}.counted", "r+b") as file:
+            file.truncate(4)
+        self.assertIsNone(load_checkpoint(self.checkpoint_filename, self.path, self.params))
+
+    def test_resume_annotations_and_gate(self):
+        # With cached masks every output of the resumed run is the same as an uninterrupted run, even though the
+        # detection worker has read past the checkpoint
+        np.save(self.path, cells_with_pauses(n_frames=350))
+        params = dataclasses.replace(self.params, frame_cache_dir=os.path.join(self.tmp.name, "cache"),
+                                     checkpoint_warmup=0, motion_gate=40, detection_workers=1)
+
+        def outputs(name):
+            return {'detections_filename': os.path.join(self.tmp.name, f"{name}_detections.npz"),
+                    'annotations_filename': os.path.join(self.tmp.name, f"{name}_annotations.npz")}
+
+        nd2_mog_contours(self.path, params, progress=lambda *_: None, **outputs("expected"))
+        with self.assertRaises(Crash):
+            nd2_mog_contours(self.path, params, progress=crash_after(250), checkpoint_filename=self.checkpoint_filename,
+                             **outputs("cells"))
+        nd2_mog_contours(self.path, params, progress=lambda *_: None, checkpoint_filename=self.checkpoint_filename,
+                         **outputs("cells"))
+
+        for key, filename in outputs("cells").items():
+            with np.load(filename) as saved, np.load(outputs("expected")[key]) as expected:
+                self.assertEqual(sorted(saved.files), sorted(expected.files))
+                for name in expected.files:
+                    np.testing.assert_array_equal(saved[name], expected[name], err_msg=name)
+        with np.load(outputs("cells")['detections_filename']) as saved:
+            self.assertEqual(len(saved['frame_status']), 350)
+            # Some frames before the checkpoint had no motion
+            self.assertTrue((saved['frame_status'][:200] == FRAME_EMPTY).any())
+
+    def test_checkpoint_needs_same_parameters(self):
+        with self.assertRaises(Crash):
+            self.run_tracking(self.params, crash_after(250))
+        self.assertIsNotNone(load_checkpoint(self.checkpoint_filename, self.path, self.params))
+        self.assertIsNone(load_checkpoint(self.checkpoint_filename, self.path,
+                                          dataclasses.replace(self.params, timeout=3)))
+        # Made without a trajectory file
+        self.assertIsNone(load_checkpoint(self.checkpoint_filename, self.path, self.params,
+                                          self.trajectory_csv_filename))
+
+    def test_trajectory_writer_resume(self):
+        boxes = np.array([[1, 2, 3, 4]])
+        with TrajectoryWriter(self.trajectory_csv_filename) as writer:
+            writer.append(0, [1], boxes, [0])
+            position = writer.position()
+            writer.append(1, [1], boxes, [1])
+        with TrajectoryWriter(self.trajectory_csv_filename, resume_at=position) as writer:
+            self.assertEqual(writer.rows_written, 1)
+            writer.append(2, [1], boxes, [1])
+        with open(self.trajectory_csv_filename) as file:
+            self.assertEqual(file.read().split(), ["frame,object_id,x_pos,y_pos,x_size,y_size", "0,1,1,2,3,4",
+                                                   "2,1,1,2,3,4"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import csv
+import dataclasses
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from COUNT.batch import process_file
+from COUNT.parameters import TrackingParameters
+from COUNT.tests.test_sweep import crossing_cells
+from COUNT.tracking import Tracker, count_objects, export_to_csv, nd2_mog_contours
+
+
+class TestCountOnly(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "cells.npy")
+        np.save(self.path, crossing_cells(n_frames=120))
+        self.params = TrackingParameters(cell_radius=5, csv_save_path=self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def expected_counts(self, params):
+        expired, _ = nd2_mog_contours(self.path, params, progress=lambda *_: None)
+        DEP_true, DEP_false = export_to_csv(expired, os.path.join(self.tmp.name, "expected.csv"), verbose=False)
+        return {'cells_counted': len(expired), 'DEP_true': DEP_true, 'DEP_false': DEP_false}
+
+    def test_same_counts(self):
+        for changes in ({}, {'timeout': 2}, {'detection_workers': 1}, {'motion_gate': 40}):
+            params = dataclasses.replace(self.params, **changes)
+            expected = self.expected_counts(params)
+            self.assertGreater(expected['DEP_true'], 0)
+            self.assertGreater(expected['DEP_false'], 0)
+            self.assertEqual(count_objects(self.path, params, progress=lambda *_: None), expected)
+
+    def test_tracker_keeps_no_counted_objects(self):
+        tracker = Tracker(dataclasses.replace(self.params, count_only=True, timeout=2), image_h=64)
+        for frame_number in range(4):
+            tracker.expire(frame_number)
+            tracker.link(np.array([[10 + frame_number * 5, 10, 9, 9]]), frame_number)
+        tracker.expire(10)
+        self.assertEqual((tracker.cells_counted, tracker.DEP_true, tracker.DEP_false), (1, 1, 0))
+        self.assertEqual(tracker.expired_objects_dict, {})
+        self.assertEqual(tracker.surviving_objects_dict, {})
+
+    def test_process_file_saves_one_row(self):
+        expected = self.expected_counts(self.params)
+        result = process_file(self.path, dataclasses.replace(self.params, count_only=True, save_overlay=True),
+                              verbose=False)
+        self.assertEqual(result['error'], '')
+        with open(os.path.join(self.tmp.name, "cells_counts.csv")) as file:
+            rows = list(csv.DictReader(file))
+        self.assertEqual(rows, [{'file': self.path, **{key: str(value) for key, value in expected.items()}}])
+        self.assertEqual(result['cells_counted'], expected['cells_counted'])
+        # Nothing else is saved
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, "cells_trajectory_results.csv")))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, "cells_results.csv")))
+
+
+if __name__ == '__main__':
+    unittest.main()
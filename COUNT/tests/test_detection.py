@@ -0,0 +1,74 @@
+import dataclasses
+import unittest
+
+import cv2 as cv
+import numpy as np
+
+from COUNT.parameters import TrackingParameters
+from COUNT.tracking import FrameWorkspace, detect_boxes, merge_components
+
+
+def reference_frames(n_frames=20, shape=(320, 384), n_cells=12, cell_radius=5, seed=0):
+    """Foreground masks with separate round cells, a pair of touching cells and one large object away from the cells"""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(n_frames):
+        frame = np.zeros(shape, dtype=np.uint8)
+        mask = np.zeros(shape, dtype=np.uint8)
+        columns = rng.permutation(np.arange(30, shape[1] - 30, 30))[:n_cells]
+        for column in columns:
+            row = int(rng.integers(60, 200))
+            radius = int(rng.integers(cell_radius - 1, cell_radius + 2))
+            cv.circle(mask, (int(column), row), radius, 255, -1)
+        # Two touching cells are one object
+        cv.circle(mask, (40, 30), cell_radius, 255, -1)
+        cv.circle(mask, (40 + 2 * cell_radius, 30), cell_radius, 255, -1)
+        # Too large to be a cell
+        cv.rectangle(mask, (150, 290), (150 + cell_radius * 12, 300), 255, -1)
+        frames.append((frame, mask))
+    return frames
+
+
+class TestDetectionEngines(unittest.TestCase):
+    def setUp(self):
+        self.params = TrackingParameters(cell_radius=5)
+
+    def test_engines_match_on_reference_data(self):
+        components_params = dataclasses.replace(self.params, detection_engine="components")
+        for frame, mask in reference_frames():
+            contour_boxes, _ = detect_boxes(frame, mask, self.params)
+            component_boxes, _ = detect_boxes(frame, mask, components_params)
+            self.assertEqual(len(contour_boxes), len(component_boxes))
+
+            # Same objects, about the same boxes
+            contour_centers = np.sort(contour_boxes[:, 0] + contour_boxes[:, 2] // 2)
+            component_centers = np.sort(component_boxes[:, 0] + component_boxes[:, 2] // 2)
+            np.testing.assert_allclose(contour_centers, component_centers, atol=2)
+
+    def test_workspace_reuse(self):
+        # Reusing one workspace for every frame gives the same boxes as allocating new buffers
+        workspace = FrameWorkspace((320, 384))
+        for engine in ["contours", "components"]:
+            params = dataclasses.replace(self.params, detection_engine=engine, save_overlay=True)
+            for frame, mask in reference_frames(n_frames=5):
+                boxes, overlay = detect_boxes(frame, mask, params)
+                reused_boxes, reused_overlay = detect_boxes(frame, mask, params, workspace=workspace)
+                np.testing.assert_array_equal(boxes, reused_boxes)
+                np.testing.assert_array_equal(overlay, reused_overlay)
+                self.assertIs(reused_overlay, workspace.overlay)
+
+    def test_merge_components_size_filter(self):
+        edges = np.zeros((100, 100), dtype=np.uint8)
+        edges[10, 10:20] = 255  # Small object
+        edges[60, 0:90] = 255  # Long object, larger than cell_radius * 10
+        boxes = merge_components(edges, cell_radius=3)
+        self.assertEqual(boxes.tolist(), [[7, 7, 16, 7]])
+
+    def test_unknown_engine(self):
+        frame, mask = reference_frames(n_frames=1)[0]
+        with self.assertRaises(ValueError):
+            detect_boxes(frame, mask, dataclasses.replace(self.params, detection_engine="magic"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import dataclasses
+import unittest
+
+import cv2 as cv
+import numpy as np
+
+from COUNT.frames import FrameConverter, FramePrefetcher, IntensityWindow, prefetch_depth, sample_frame_numbers
+from COUNT.parameters import TrackingParameters
+
+
+def raw_frames(n_frames=30, shape=(64, 80), seed=0):
+    """16-bit frames with a slowly rising background"""
+    rng = np.random.default_rng(seed)
+    return [rng.integers(1000 + 10 * i, 3000 + 10 * i, size=shape, dtype=np.uint16) for i in range(n_frames)]
+
+
+class TestIntensityWindow(unittest.TestCase):
+    def test_convert(self):
+        window = IntensityWindow(1000, 2020)
+        frame = np.arange(0, 4096, dtype=np.uint16).reshape(64, 64)
+        expected = np.clip(np.round((frame.astype(np.float64) - 1000) * 255 / 1020), 0, 255)
+        converted = window.convert(frame)
+        self.assertEqual(converted.dtype, np.uint8)
+        # Values outside the window are clipped, not wrapped or mirrored
+        self.assertTrue((converted[frame < 1000] == 0).all())
+        self.assertTrue((converted[frame > 2020] == 255).all())
+        self.assertLessEqual(np.abs(converted - expected).max(), 1)
+
+    def test_from_frames(self):
+        window = IntensityWindow.from_frames(raw_frames()[:5])
+        self.assertEqual((window.low, window.high), (1000, 3039))
+        with self.assertRaises(ValueError):
+            IntensityWindow.from_frames([])
+
+    def test_flat_window(self):
+        frame = np.full((8, 8), 500, dtype=np.uint16)
+        self.assertTrue((IntensityWindow(500, 500).convert(frame) == 0).all())
+
+
+class TestFrameConverter(unittest.TestCase):
+    def setUp(self):
+        self.frames = raw_frames()
+        self.params = TrackingParameters(window_samples=4, window_refresh=10)
+
+    def test_sample_frame_numbers(self):
+        self.assertEqual(sample_frame_numbers(0, 10, 3), [0, 4, 9])
+        self.assertEqual(sample_frame_numbers(0, 2, 16), [0, 1])
+        self.assertEqual(sample_frame_numbers(5, 5, 4), [])
+
+    def test_frame_mode_matches_normalize(self):
+        converter = FrameConverter(self.frames, self.params)
+        dst = np.empty(self.frames[0].shape, dtype=np.uint8)
+        for frame_number, frame in enumerate(self.frames):
+            expected = cv.normalize(frame, None, 0, 255, cv.NORM_MINMAX, dtype=cv.CV_8U)
+            converted = converter.convert(frame, frame_number, dst=dst)
+            self.assertIs(converted, dst)
+            np.testing.assert_array_equal(converted, expected)
+
+    def test_fixed_window(self):
+        converter = FrameConverter(self.frames, dataclasses.replace(self.params, intensity_window="fixed"))
+        self.assertEqual((converter.window.low, converter.window.high), (1000, 3289))
+        # The same raw value maps to the same 8-bit value in every frame
+        first = converter.convert(self.frames[0], 0)
+        last = converter.convert(self.frames[-1], len(self.frames) - 1)
+        self.assertEqual(first[self.frames[0] == 1500].max(), last[self.frames[-1] == 1500].min())
+
+    def test_rolling_window(self):
+        converter = FrameConverter(self.frames, dataclasses.replace(self.params, intensity_window="rolling"))
+        converter.convert(self.frames[3], 3)
+        self.assertEqual(converter.window_start, 0)
+        self.assertEqual(converter.window.high, IntensityWindow.from_frames(self.frames[i] for i in (0, 3, 6, 9)).high)
+        converter.convert(self.frames[25], 25)
+        self.assertEqual(converter.window_start, 20)
+        self.assertGreaterEqual(converter.window.low, 1200)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            FrameConverter(self.frames, dataclasses.replace(self.params, intensity_window="histogram"))
+
+
+class FailingFrames(list):
+    def __getitem__(self, frame_number):
+        if frame_number == 7:
+            raise IOError("Frame 7 could not be read")
+        return super().__getitem__(frame_number)
+
+
+class TestFramePrefetcher(unittest.TestCase):
+    def setUp(self):
+        self.frames = raw_frames()
+        self.converter = FrameConverter(self.frames, TrackingParameters())
+        self.shape = self.frames[0].shape
+
+    def test_prefetch_depth(self):
+        self.assertEqual(prefetch_depth((1024, 1024), 0), 0)
+        self.assertEqual(prefetch_depth((1024, 1024), 64), 64)
+        self.assertEqual(prefetch_depth((4096, 4096), 1), 2)
+
+    def test_same_frames_as_reading_directly(self):
+        expected = [cv.normalize(frame, None, 0, 255, cv.NORM_MINMAX, dtype=cv.CV_8U) for frame in self.frames]
+        for depth in (0, 2, 5):
+            with FramePrefetcher(self.frames, self.converter, self.shape, depth) as prefetcher:
+                converted = [frame.copy() for frame in prefetcher]
+            self.assertEqual(len(converted), len(expected))
+            for frame, expected_frame in zip(converted, expected):
+                np.testing.assert_array_equal(frame, expected_frame)
+
+    def test_buffers_are_reused(self):
+        with FramePrefetcher(self.frames, self.converter, self.shape, 3, start=5, stop=25) as prefetcher:
+            buffers = {id(frame) for frame in prefetcher}
+            self.assertLessEqual(prefetcher.buffers_allocated, 3)
+        self.assertLessEqual(len(buffers), 3)
+
+    def test_read_error_is_raised(self):
+        prefetcher = FramePrefetcher(FailingFrames(self.frames), self.converter, self.shape, 2)
+        frames_read = 0
+        with self.assertRaises(IOError):
+            for _ in prefetcher:
+                frames_read += 1
+        self.assertEqual(frames_read, 7)
+
+    def test_close_early(self):
+        with FramePrefetcher(self.frames, self.converter, self.shape, 2) as prefetcher:
+            frames = iter(prefetcher)
+            next(frames)
+            thread = prefetcher.thread
+        self.assertFalse(thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
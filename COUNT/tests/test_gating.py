@@ -0,0 +1,116 @@
+import dataclasses
+import os
+import tempfile
+import unittest
+
+import cv2 as cv
+import numpy as np
+
+from COUNT.gating import FRAME_DETECTED, FRAME_EMPTY, FRAME_SKIPPED, MotionGate
+from COUNT.parameters import TrackingParameters
+from COUNT.sweep import sweep
+from COUNT.tests.test_sweep import crossing_cells
+from COUNT.tracking import count_objects, nd2_mog_contours
+
+
+def cells_with_pauses(n_frames=240, shape=(64, 160), speed=9):
+    """Two waves of crossing cells, with an empty channel before, between and after them"""
+    frames = np.full((n_frames,) + shape, 100, dtype=np.uint16)
+    wave = crossing_cells(n_frames=40, shape=shape, speed=speed)
+    frames[30:70] = wave
+    frames[150:190] = wave
+    return frames
+
+
+class TestMotionGate(unittest.TestCase):
+    def test_gate_on_foreground_pixels(self):
+        gate = MotionGate(TrackingParameters(motion_gate=50, motion_gate_step=2), total_frames=3)
+        mask = np.zeros((40, 40), dtype=np.uint8)
+        self.assertFalse(gate.passes(mask))
+        mask[10:16, 10:16] = 255  # 9 of the sampled pixels, about 36 pixels
+        self.assertFalse(gate.passes(mask))
+        mask[10:20, 10:20] = 255  # about 100 pixels
+        self.assertTrue(gate.passes(mask))
+        np.testing.assert_array_equal(gate.status, [FRAME_EMPTY, FRAME_EMPTY, FRAME_DETECTED])
+
+    def test_idle_stride(self):
+        params = TrackingParameters(idle_stride=4, timeout=2)
+        gate = MotionGate(params, total_frames=20)
+        empty = np.zeros((8, 8), dtype=np.uint8)
+        moving = np.full((8, 8), 255, dtype=np.uint8)
+        for _ in range(12):
+            if not gate.skip():
+                gate.passes(empty)
+        # Full rate until more than timeout + 1 frames without motion, then one frame in 4
+        np.testing.assert_array_equal(gate.status[:12] == FRAME_SKIPPED,
+                                      [False] * 5 + [True] * 3 + [False] + [True] * 3)
+        # Frame 12 has motion, back to full rate
+        gate.passes(moving)
+        self.assertFalse(any(gate.skip() for _ in range(3)))
+        # Without a motion_gate every frame that isn't skipped goes through detection
+        self.assertEqual(gate.counts(), {'detected': 7, 'empty': 0, 'skipped': 6})
+
+
+class TestGatedTracking(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "pauses.npy")
+        np.save(self.path, cells_with_pauses())
+        self.params = TrackingParameters(cell_radius=5, intensity_window="fixed")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def track(self, **changes):
+        expired, history = nd2_mog_contours(self.path, dataclasses.replace(self.params, **changes),
+                                            progress=lambda *_: None)
+        return sorted((obj.position, obj.DEP_outlet) for obj in expired.values())
+
+    def test_same_cells_with_gate(self):
+        expected = self.track()
+        self.assertGreater(len(expected), 0)
+        self.assertEqual(self.track(motion_gate=40), expected)
+        self.assertEqual(self.track(motion_gate=40, detection_workers=1), expected)
+
+    def test_idle_stride(self):
+        expected = self.track()
+        self.assertEqual(len(self.track(motion_gate=40, idle_stride=3)), len(expected))
+        self.assertEqual(self.track(motion_gate=40, idle_stride=3, detection_workers=1),
+                         self.track(motion_gate=40, idle_stride=3))
+
+    def test_sweep_with_gate(self):
+        # A cell that doesn't move is only detected on frames without foreground (canny on the frame itself), which
+        # the gate leaves out
+        frames = cells_with_pauses()
+        for frame in frames:
+            cv.circle(frame, (140, 10), 5, 4000, -1)
+        np.save(self.path, frames)
+        self.assertNotEqual(count_objects(self.path, self.params, progress=lambda *_: None),
+                            count_objects(self.path, dataclasses.replace(self.params, motion_gate=40),
+                                          progress=lambda *_: None))
+
+        # Each row of a gated sweep has the counts of a gated run with its parameters
+        for changes, grid in [({'motion_gate': 40}, {'cell_radius': [4, 5], 'timeout': [2, 5]}),
+                              ({'motion_gate': 40, 'idle_stride': 3}, {'max_centroid_distance': [40, 70]})]:
+            params = dataclasses.replace(self.params, **changes)
+            rows = sweep(self.path, grid, params, progress=lambda *_: None)
+            for row in rows:
+                counts = count_objects(self.path, dataclasses.replace(params, **{name: row[name] for name in grid}),
+                                       progress=lambda *_: None)
+                self.assertEqual({name: row[name] for name in counts}, counts, row)
+
+    def test_frame_status_saved(self):
+        detections_filename = os.path.join(self.tmp.name, "pauses_detections.npz")
+        nd2_mog_contours(self.path, dataclasses.replace(self.params, motion_gate=40, idle_stride=3),
+                         progress=lambda *_: None, detections_filename=detections_filename)
+        with np.load(detections_filename) as saved:
+            status = saved['frame_status']
+            frames = saved['frame']
+        self.assertEqual(len(status), 240)
+        self.assertTrue((status == FRAME_SKIPPED).any())
+        # Every detection is on a frame that went through detection
+        self.assertTrue((status[frames] == FRAME_DETECTED).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
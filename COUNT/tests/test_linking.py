@@ -0,0 +1,173 @@
+import copy
+import unittest
+
+import numpy as np
+
+from COUNT.parameters import TrackingParameters
+from COUNT.tracking import DetectedObject, SpatialGrid, Tracker, assign_boxes, match_frame_objects
+
+
+class TestAssignment(unittest.TestCase):
+    def setUp(self):
+        self.params = TrackingParameters(cell_radius=3)
+
+    def test_match_frame_objects(self):
+        # Two objects in the frame compete for one tracked object, only the closest one matches
+        for assignment in ["greedy", "hungarian"]:
+            tracked = DetectedObject(object_id=1, position=(10, 100), size=(9, 9), most_recent_frame=4)
+            close_obj = DetectedObject(object_id=None, position=(20, 100), size=(9, 9), most_recent_frame=5)
+            far_obj = DetectedObject(object_id=None, position=(30, 100), size=(9, 9), most_recent_frame=5)
+            params = TrackingParameters(cell_radius=3, assignment=assignment)
+            unmatched, result_dict = match_frame_objects(surviving_objects_dict={1: tracked},
+                                                         objects_in_frame_list=[far_obj, close_obj],
+                                                         frame_number=5, params=params)
+            self.assertEqual(unmatched, [far_obj])
+            self.assertIs(result_dict[1], close_obj)
+            self.assertEqual((close_obj.object_id, close_obj.most_recent_frame), (1, 5))
+            self.assertEqual(close_obj.frames_tracked, tracked.frames_tracked + 1)
+            self.assertIsNone(far_obj.object_id)
+
+        # Nothing being tracked, nothing matches
+        unmatched, result_dict = match_frame_objects(surviving_objects_dict={}, objects_in_frame_list=[far_obj],
+                                                     frame_number=5, params=self.params)
+        self.assertEqual(unmatched, [far_obj])
+        self.assertEqual(result_dict, {})
+
+    def test_one_to_one(self):
+        # Three objects in the frame right behind one tracked object: it is only claimed once
+        tracked = {1: DetectedObject(object_id=1, position=(10, 50), size=(9, 9), most_recent_frame=0)}
+        in_frame = [DetectedObject(object_id=None, position=(x, 50), size=(9, 9), most_recent_frame=1)
+                    for x in (25, 15, 35)]
+        unmatched, result_dict = match_frame_objects(tracked, in_frame, frame_number=1, params=self.params)
+        self.assertEqual(unmatched, [in_frame[0], in_frame[2]])
+        self.assertIs(result_dict[1], in_frame[1])
+
+    def test_assign_boxes(self):
+        # Greedy takes the closest pair first, hungarian finds the assignment that matches both
+        frame_boxes = np.array([[20, 0, 0, 0], [30, 0, 0, 0]])
+        tracked_boxes = np.array([[15, 0, 0, 0], [5, 0, 0, 0]])
+        frame_indices, tracked_indices = assign_boxes(frame_boxes, tracked_boxes, 20, "greedy")
+        self.assertEqual(list(zip(frame_indices, tracked_indices)), [(0, 0)])
+        frame_indices, tracked_indices = assign_boxes(frame_boxes, tracked_boxes, 20, "hungarian")
+        self.assertEqual(list(zip(frame_indices, tracked_indices)), [(0, 1), (1, 0)])
+
+    def test_assign_boxes_rules(self):
+        # Only boxes to the right of a tracked box, and closer than max_centroid_distance, can match
+        tracked_boxes = np.array([[50, 50, 10, 10]])
+        for frame_box, expected in [([40, 50, 10, 10], []), ([60, 50, 10, 10], [(0, 0)]),
+                                    ([200, 50, 10, 10], [])]:
+            for assignment in ["greedy", "hungarian"]:
+                frame_indices, tracked_indices = assign_boxes(np.array([frame_box]), tracked_boxes, 70, assignment)
+                self.assertEqual(list(zip(frame_indices, tracked_indices)), expected, (frame_box, assignment))
+        # Nothing to assign
+        frame_indices, tracked_indices = assign_boxes(np.empty((0, 4)), tracked_boxes, 70)
+        self.assertEqual((len(frame_indices), len(tracked_indices)), (0, 0))
+
+
+def random_boxes(rng, n_boxes, shape=(512, 512), cell_radius=3):
+    """(N, 4) array of random (x, y, w, h) boxes of about the size of a cell"""
+    size = rng.integers(2 * cell_radius - 1, 2 * cell_radius + 2, size=(n_boxes, 2))
+    corner = rng.integers(0, np.array(shape[::-1]) - size, size=(n_boxes, 2))
+    return np.hstack([corner, size])
+
+
+class TestSpatialGrid(unittest.TestCase):
+    def test_spatial_grid(self):
+        grid = SpatialGrid(cell_size=10)
+        grid.insert(1, (5, 5))
+        grid.insert(2, (25, 5))
+        self.assertEqual(sorted(grid.neighbours((12, 5))), [1, 2])
+        self.assertEqual(grid.neighbours((35, 5)), [2])
+
+        # Moving and removing objects
+        grid.insert(1, (45, 5))
+        self.assertEqual(sorted(grid.neighbours((35, 5))), [1, 2])
+        grid.remove(2)
+        self.assertEqual(grid.neighbours((35, 5)), [1])
+        self.assertEqual(grid.neighbours((5, 5)), [])
+
+    def test_same_links_as_full_matrix(self):
+        # Linking through the grid matches the same objects as match_frame_objects over every tracked object
+        rng = np.random.default_rng(0)
+        for assignment in ["greedy", "hungarian"]:
+            params = TrackingParameters(cell_radius=3, assignment=assignment)
+            for _ in range(20):
+                tracker = Tracker(params, image_h=512)
+                tracker.link(random_boxes(rng, 60), 0)
+                surviving_objects_dict = {object_id: copy.copy(obj)
+                                          for object_id, obj in tracker.surviving_objects_dict.items()}
+
+                # Most objects move a little to the right, some new ones come in
+                boxes = random_boxes(rng, 70)
+                boxes[:50, :2] = [obj.position for obj in list(surviving_objects_dict.values())[:50]]
+                boxes[:50, 0] += rng.integers(0, 40, size=50)
+                boxes = boxes[rng.permutation(len(boxes))]
+
+                objects_in_frame_list = [DetectedObject(object_id=None, position=(x, y), size=(w, h),
+                                                        most_recent_frame=1) for x, y, w, h in boxes.tolist()]
+                match_frame_objects(surviving_objects_dict, objects_in_frame_list, frame_number=1, params=params)
+                expected = [obj.object_id or 0 for obj in objects_in_frame_list]
+
+                object_ids, _ = tracker.link(boxes, 1)
+                # Boxes that didn't match get new ids, after the 60 objects from the first frame
+                object_ids[object_ids > 60] = 0
+                self.assertEqual(object_ids.tolist(), expected, assignment)
+                self.assertGreater(np.count_nonzero(expected), 20)
+
+
+class TestTracker(unittest.TestCase):
+    def setUp(self):
+        self.params = TrackingParameters(cell_radius=3)
+        self.image_h = 512
+
+    def test_tracker(self):
+        # One object moves right for timeout + 1 frames, then disappears
+        tracker = Tracker(self.params, self.image_h)
+        for frame_number in range(self.params.timeout + 1):
+            tracker.expire(frame_number)
+            object_ids, frames_tracked = tracker.link(np.array([[10 + frame_number * 5, 10, 9, 9]]), frame_number)
+            self.assertEqual(list(object_ids), [1])
+            self.assertEqual(list(frames_tracked), [frame_number])
+        self.assertEqual(list(tracker.surviving_objects_dict), [1])
+        self.assertEqual(tracker.surviving_objects_dict[1].frames_tracked, self.params.timeout)
+
+        # It is counted once it expires
+        tracker.expire(2 * self.params.timeout + 1)
+        self.assertEqual(tracker.surviving_objects_dict, {})
+        self.assertEqual(list(tracker.expired_objects_dict), [1])
+        self.assertIs(tracker.expired_objects_dict[1].DEP_outlet, True)
+        self.assertEqual(tracker.grid.cells, {})
+
+    def test_tracker_deadlines(self):
+        tracker = Tracker(self.params, self.image_h)
+        tracker.link(np.array([[10, 10, 9, 9]]), 0)
+        tracker.link(np.array([[15, 10, 9, 9]]), 3)
+
+        # The deadline from frame 0 is out of date, the object was seen again in frame 3
+        tracker.expire(self.params.timeout + 1)
+        self.assertEqual(list(tracker.surviving_objects_dict), [1])
+
+        # The deadline from frame 3 has passed
+        tracker.expire(self.params.timeout + 4)
+        self.assertEqual(tracker.surviving_objects_dict, {})
+        self.assertEqual(tracker.deadlines, [])
+
+    def test_same_frame_expiry_in_id_order(self):
+        # Three objects in separate lanes, object 1 is seen for one more frame than 2 and 3
+        tracker = Tracker(self.params, self.image_h)
+        lanes = [400, 200, 10]
+        for frame_number in range(self.params.timeout + 2):
+            lanes_seen = lanes if frame_number <= self.params.timeout else lanes[:1]
+            tracker.link(np.array([[10 + frame_number * 5, y, 9, 9] for y in lanes_seen]), frame_number)
+        self.assertEqual([obj.most_recent_frame for obj in tracker.surviving_objects_dict.values()],
+                         [self.params.timeout + 1, self.params.timeout, self.params.timeout])
+
+        # The heap pops 2 and 3 first (earliest deadline), all three expire in the same frame in id order
+        tracker.expire(2 * self.params.timeout + 2)
+        self.assertEqual(list(tracker.expired_objects_dict), [1, 2, 3])
+        self.assertEqual(tracker.surviving_objects_dict, {})
+        self.assertEqual(tracker.deadlines, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
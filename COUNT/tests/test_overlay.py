@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+
+import cv2 as cv
+import numpy as np
+
+from COUNT.overlay import OverlayWriter, overlay_filename
+from COUNT.parameters import TrackingParameters
+from COUNT.tests.test_sweep import crossing_cells
+from COUNT.tracking import nd2_mog_contours
+
+
+def video_info(filename):
+    capture = cv.VideoCapture(filename)
+    try:
+        return (int(capture.get(cv.CAP_PROP_FRAME_COUNT)), int(capture.get(cv.CAP_PROP_FRAME_WIDTH)),
+                int(capture.get(cv.CAP_PROP_FRAME_HEIGHT)))
+    finally:
+        capture.release()
+
+
+class TestOverlayWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp.name, "overlay.mp4")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_every_frame(self):
+        with OverlayWriter(self.filename, (64, 96), TrackingParameters(), queue_size=2) as writer:
+            for frame_number in range(20):
+                writer.write(frame_number, np.full((64, 96, 3), frame_number * 10, dtype=np.uint8))
+        self.assertEqual(video_info(self.filename), (20, 96, 64))
+
+    def test_decimation_and_scale(self):
+        params = TrackingParameters(overlay_every=3, overlay_scale=0.5)
+        with OverlayWriter(self.filename, (64, 96), params) as writer:
+            self.assertEqual([writer.wants(frame_number) for frame_number in range(4)], [True, False, False, True])
+            for frame_number in range(20):
+                writer.write(frame_number, np.zeros((64, 96, 3), dtype=np.uint8))
+        self.assertEqual(video_info(self.filename), (7, 48, 32))
+
+    def test_overlay_filename(self):
+        params = TrackingParameters(overlay_path="results/overlay/")
+        self.assertEqual(overlay_filename(params, "data/cells.nd2"),
+                         os.path.join("results/overlay", "cells_overlay.mp4"))
+        self.assertEqual(overlay_filename(params, "data/cells.nd2", start=1200),
+                         os.path.join("results/overlay", "cells_overlay_001200.mp4"))
+
+    def test_tracking_saves_one_video_per_file(self):
+        for name in ["a.npy", "b.npy"]:
+            np.save(os.path.join(self.tmp.name, name), crossing_cells(n_frames=30))
+        params = TrackingParameters(cell_radius=5, save_overlay=True, overlay_path=self.tmp.name, overlay_every=2)
+        expected, _ = nd2_mog_contours(os.path.join(self.tmp.name, "a.npy"), TrackingParameters(cell_radius=5),
+                                       progress=lambda *_: None)
+        for name in ["a", "b"]:
+            expired, _ = nd2_mog_contours(os.path.join(self.tmp.name, f"{name}.npy"), params, progress=lambda *_: None)
+            self.assertEqual(len(expired), len(expected))
+            self.assertEqual(video_info(os.path.join(self.tmp.name, f"{name}_overlay.mp4")), (15, 160, 64))
+
+
+if __name__ == '__main__':
+    unittest.main()
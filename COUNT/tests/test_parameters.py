@@ -0,0 +1,75 @@
+import dataclasses
+import json
+import os
+import pickle
+import tempfile
+import types
+import unittest
+
+from COUNT.parameters import TrackingParameters
+
+
+class Variable:
+    """Stands in for a tkinter variable"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+class TestTrackingParameters(unittest.TestCase):
+    def test_from_settings(self):
+        settings = {"canny_upper": 200, "canny_lower": 50, "timeout": 20, "not_a_parameter": 1}
+        params = TrackingParameters.from_settings(settings)
+        self.assertEqual(params.canny_upper, 200)
+        self.assertEqual(params.canny_lower, 50)
+        self.assertEqual(params.timeout, 20)
+        # Missing values fall back to the defaults
+        self.assertEqual(params.cell_radius, TrackingParameters().cell_radius)
+
+    def test_from_json(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path = os.path.join(tmp, "settings.json")
+            with open(json_path, "w") as file:
+                json.dump(TrackingParameters(cell_radius=3).to_settings(), file)
+            self.assertEqual(TrackingParameters.from_json(json_path), TrackingParameters(cell_radius=3))
+
+    def test_from_settings_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path = os.path.join(tmp, "settings.json")
+            # Without a settings file, the defaults are used
+            self.assertEqual(TrackingParameters.from_settings_file(json_path), TrackingParameters())
+            with open(json_path, "w") as file:
+                json.dump(TrackingParameters(timeout=12).to_settings(), file)
+            self.assertEqual(TrackingParameters.from_settings_file(json_path), TrackingParameters(timeout=12))
+
+    def test_from_ui_keeps_other_settings(self):
+        # The UI only shows some of the parameters, the rest come from the settings file it loaded
+        settings = TrackingParameters(assignment="hungarian", detection_workers=3, checkpoint_every=500,
+                                      timeout=8).to_settings()
+        ui_values = {"canny_upper": 150, "canny_lower": 50, "max_centroid_distance": 40, "timeout": 4,
+                     "cell_radius": 6, "roi_x": 0, "roi_y": 10, "roi_width": 0, "roi_height": 100,
+                     "save_overlay": False}
+        ui_app = types.SimpleNamespace(settings=settings, csv_folder_path=Variable("results/"), overlay_path="",
+                                       **{name: Variable(value) for name, value in ui_values.items()})
+
+        saved = TrackingParameters.from_ui(ui_app).to_settings()
+        self.assertEqual((saved["assignment"], saved["detection_workers"], saved["checkpoint_every"]),
+                         ("hungarian", 3, 500))
+        # Values shown in the UI win over the settings file
+        self.assertEqual((saved["timeout"], saved["cell_radius"], saved["csv_save_path"]), (4, 6, "results/"))
+
+    def test_frozen(self):
+        params = TrackingParameters()
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            params.timeout = 10
+
+    def test_pickle(self):
+        params = TrackingParameters(max_centroid_distance=30, overlay_path="results/overlay/")
+        self.assertEqual(pickle.loads(pickle.dumps(params)), params)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import dataclasses
+import unittest
+
+import cv2 as cv
+import numpy as np
+
+from COUNT.parameters import TrackingParameters
+from COUNT.pipeline import FrameRing, detect_frames_parallel
+from COUNT.tests.test_detection import reference_frames
+from COUNT.tracking import FrameWorkspace, detect_frames
+
+
+def background_subtractor():
+    return cv.createBackgroundSubtractorMOG2(varThreshold=16, detectShadows=False)
+
+
+class TestFrameRing(unittest.TestCase):
+    def test_slots(self):
+        ring = FrameRing((16, 24), 3, overlay=True)
+        attached = FrameRing((16, 24), 3, overlay=True, name=ring.name)
+        try:
+            ring.frame(1)[:] = 1
+            ring.mask(1)[:] = 2
+            ring.overlay_image(2)[:] = 3
+            self.assertTrue((attached.frame(1) == 1).all())
+            self.assertTrue((attached.mask(1) == 2).all())
+            self.assertTrue((attached.overlay_image(2) == 3).all())
+            self.assertTrue((attached.frame(0) == 0).all())
+            self.assertEqual(attached.overlay_image(0).shape, (16, 24, 3))
+        finally:
+            attached.close()
+            ring.close()
+
+
+class TestDetectFramesParallel(unittest.TestCase):
+    def setUp(self):
+        # Cells in new places in every frame, which MOG2 sees as foreground
+        self.frames = [mask for _, mask in reference_frames(n_frames=12)]
+        self.shape = self.frames[0].shape
+        self.params = TrackingParameters(cell_radius=5)
+
+    def test_same_boxes_as_in_process(self):
+        expected = [boxes for boxes, _ in detect_frames(self.frames, background_subtractor(), self.params,
+                                                         FrameWorkspace(self.shape))]
+        self.assertTrue(any(len(boxes) for boxes in expected))
+        for workers in (1, 3):
+            detections = list(detect_frames_parallel(self.frames, background_subtractor(), self.params, self.shape,
+                                                     workers))
+            self.assertEqual(len(detections), len(expected))
+            for (boxes, overlay), expected_boxes in zip(detections, expected):
+                self.assertIsNone(overlay)
+                np.testing.assert_array_equal(boxes, expected_boxes)
+
+    def test_overlay(self):
+        params = dataclasses.replace(self.params, save_overlay=True)
+        expected = [overlay.copy() for _, overlay in detect_frames(self.frames, background_subtractor(), params,
+                                                                   FrameWorkspace(self.shape))]
+        overlays = [overlay.copy() for _, overlay in detect_frames_parallel(self.frames, background_subtractor(),
+                                                                            params, self.shape, 2)]
+        for overlay, expected_overlay in zip(overlays, expected):
+            np.testing.assert_array_equal(overlay, expected_overlay)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import dataclasses
+import filecmp
+import os
+import tempfile
+import tracemalloc
+import unittest
+
+import numpy as np
+
+from COUNT.batch import process_file
+from COUNT.parameters import TrackingParameters
+from COUNT.relink import SavedDetections, relink, relink_file
+from COUNT.tests.test_sweep import crossing_cells
+from COUNT.tracking import DetectionWriter, nd2_mog_contours
+
+
+class TestRelink(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "cells.npy")
+        np.save(self.path, crossing_cells())
+        self.params = TrackingParameters(cell_radius=5, csv_save_path=self.tmp.name, save_detections=True)
+        self.detections_filename = os.path.join(self.tmp.name, "cells_detections.npz")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_saved_detections(self):
+        writer = DetectionWriter(self.detections_filename, image_h=64, total_frames=4, source="cells.npy",
+                                 params=self.params)
+        writer.append(0, np.array([[1, 2, 3, 4]], dtype=np.int32))
+        writer.append(2, np.array([[5, 6, 7, 8], [9, 10, 11, 12]], dtype=np.int32))
+        writer.append(3, np.empty((0, 4), dtype=np.int32))
+        writer.save()
+
+        detections = SavedDetections(self.detections_filename)
+        self.assertEqual((len(detections), detections.image_h, detections.total_frames), (3, 64, 4))
+        self.assertEqual(detections.source, "cells.npy")
+        self.assertEqual(TrackingParameters.from_settings(detections.settings),
+                         dataclasses.replace(self.params, overlay_path=""))
+        frame_boxes = list(detections.frame_boxes())
+        self.assertEqual([frame_number for frame_number, _ in frame_boxes], [0, 1, 2, 3])
+        self.assertEqual([boxes.tolist() for _, boxes in frame_boxes],
+                         [[[1, 2, 3, 4]], [], [[5, 6, 7, 8], [9, 10, 11, 12]], []])
+
+    def test_same_files_as_full_run(self):
+        process_file(self.path, self.params, verbose=False)
+        relinked = os.path.join(self.tmp.name, "relinked")
+        os.makedirs(relinked)
+        result = relink_file(self.detections_filename, dataclasses.replace(self.params, csv_save_path=relinked),
+                             verbose=False)
+        self.assertGreater(result['cells_counted'], 0)
+        for name in ["cells_results.csv", "cells_trajectory_results.csv"]:
+            self.assertTrue(filecmp.cmp(os.path.join(self.tmp.name, name), os.path.join(relinked, name),
+                                        shallow=False))
+
+    def test_new_linking_parameters(self):
+        nd2_mog_contours(self.path, self.params, progress=lambda *_: None,
+                         detections_filename=self.detections_filename)
+        for linking in [dict(max_centroid_distance=5), dict(timeout=2), dict(assignment="hungarian")]:
+            params = dataclasses.replace(self.params, **linking)
+            expected, expected_history = nd2_mog_contours(self.path, params, progress=lambda *_: None)
+            expired, history = relink(self.detections_filename, params)
+            self.assertEqual(sorted((obj.object_id, obj.position, obj.DEP_outlet) for obj in expired.values()),
+                             sorted((obj.object_id, obj.position, obj.DEP_outlet) for obj in expected.values()))
+            for name in ["frame", "object_id", "x", "frames_tracked"]:
+                np.testing.assert_array_equal(history.column(name), expected_history.column(name))
+
+
+class TestDetectionWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.detections_filename = os.path.join(self.tmp.name, "cells_detections.npz")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def frame_boxes(self, frame_number, n_boxes=3):
+        return np.arange(4 * n_boxes, dtype=np.int32).reshape(n_boxes, 4) + frame_number
+
+    def test_chunks(self):
+        # Written a few rows at a time, the file holds every detection
+        writer = DetectionWriter(self.detections_filename, image_h=64, total_frames=10, chunk_rows=4)
+        for frame_number in range(10):
+            writer.append(frame_number, self.frame_boxes(frame_number, n_boxes=frame_number % 3))
+        writer.save(frame_status=np.arange(10, dtype=np.uint8))
+        self.assertFalse(os.path.exists(self.detections_filename + ".part"))
+
+        detections = SavedDetections(self.detections_filename)
+        self.assertEqual(len(detections), 9)
+        for frame_number, boxes in detections.frame_boxes():
+            np.testing.assert_array_equal(boxes, self.frame_boxes(frame_number, n_boxes=frame_number % 3))
+        with np.load(self.detections_filename) as saved:
+            self.assertEqual(saved['frame'].dtype, np.int32)
+            np.testing.assert_array_equal(saved['frame_status'], np.arange(10))
+
+    def test_bounded_memory(self):
+        # Memory doesn't grow with the number of detections (the rows themselves take 20 bytes each)
+        n_frames, n_boxes = 20_000, 10
+        boxes = self.frame_boxes(0, n_boxes=n_boxes)
+        tracemalloc.start()
+        try:
+            writer = DetectionWriter(self.detections_filename, image_h=64, total_frames=n_frames, chunk_rows=1000)
+            for frame_number in range(n_frames):
+                writer.append(frame_number, boxes)
+            writer.save()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, n_frames * n_boxes * 20 // 8)
+        self.assertEqual(len(SavedDetections(self.detections_filename)), n_frames * n_boxes)
+
+    def test_resume(self):
+        writer = DetectionWriter(self.detections_filename, image_h=64, total_frames=4)
+        writer.append(0, self.frame_boxes(0))
+        position = writer.position()
+        writer.append(1, self.frame_boxes(9))
+        writer.position()
+
+        # Rows written after the position are dropped
+        writer = DetectionWriter(self.detections_filename, image_h=64, total_frames=4, resume_at=position)
+        writer.append(2, self.frame_boxes(2))
+        writer.save()
+        detections = SavedDetections(self.detections_filename)
+        self.assertEqual([boxes.tolist() for _, boxes in detections.frame_boxes()],
+                         [self.frame_boxes(0).tolist(), [], self.frame_boxes(2).tolist(), []])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import dataclasses
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from COUNT.parameters import TrackingParameters
+from COUNT.relink import relink
+from COUNT.tests.test_sweep import crossing_cells
+from COUNT.tracking import DetectedObject, nd2_mog_contours
+
+
+class TestROI(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.channel = crossing_cells()
+        self.channel_path = os.path.join(self.tmp.name, "channel.npy")
+        np.save(self.channel_path, self.channel)
+        # The channel in the middle of a larger sensor
+        frames = np.full((len(self.channel), 200, 240), 100, dtype=np.uint16)
+        frames[:, 90:154, 30:190] = self.channel
+        self.path = os.path.join(self.tmp.name, "sensor.npy")
+        np.save(self.path, frames)
+        self.params = TrackingParameters(cell_radius=5)
+        self.roi_params = dataclasses.replace(self.params, roi_x=30, roi_y=90, roi_width=160, roi_height=64)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_outlet_assignment(self):
+        obj = DetectedObject(object_id=1, position=(0, 130), size=(10, 10), most_recent_frame=0)
+        obj.outlet_assignment(400)
+        self.assertIs(obj.DEP_outlet, True)
+        obj.outlet_assignment(64, roi_y=90)
+        self.assertIs(obj.DEP_outlet, False)
+
+    def test_results_in_full_frame_coordinates(self):
+        expected, expected_history = nd2_mog_contours(self.channel_path, self.params, progress=lambda *_: None)
+        detections_filename = os.path.join(self.tmp.name, "sensor_detections.npz")
+        expired, history = nd2_mog_contours(self.path, self.roi_params, progress=lambda *_: None,
+                                            detections_filename=detections_filename)
+        self.assertGreater(len(expired), 0)
+        self.assertEqual(sorted((obj.object_id, obj.position, obj.DEP_outlet) for obj in expired.values()),
+                         sorted((obj.object_id, (obj.position[0] + 30, obj.position[1] + 90), obj.DEP_outlet)
+                                for obj in expected.values()))
+        np.testing.assert_array_equal(history.column("x"), expected_history.column("x") + 30)
+        np.testing.assert_array_equal(history.column("y"), expected_history.column("y") + 90)
+
+        # Relinking splits the outlets at the middle of the ROI too
+        relinked, _ = relink(detections_filename, self.roi_params)
+        self.assertEqual(sorted((obj.object_id, obj.DEP_outlet) for obj in relinked.values()),
+                         sorted((obj.object_id, obj.DEP_outlet) for obj in expired.values()))
+
+    def test_roi_with_detection_workers_and_overlays(self):
+        expected, _ = nd2_mog_contours(self.path, self.roi_params, progress=lambda *_: None)
+        params = dataclasses.replace(self.roi_params, detection_workers=1, save_overlay=True,
+                                     overlay_path=self.tmp.name)
+        expired, _ = nd2_mog_contours(self.path, params, progress=lambda *_: None)
+        self.assertEqual(sorted((obj.object_id, obj.position) for obj in expired.values()),
+                         sorted((obj.object_id, obj.position) for obj in expected.values()))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, "sensor_overlay.mp4")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import json
+import os
+import tempfile
+import unittest
+
+import cv2 as cv
+import numpy as np
+import tifffile
+
+from COUNT.sources import (CroppedSource, MemmapSource, TiffSource, VideoSource, convert_to_npy, crop, is_supported,
+                           list_streams, open_source, split_stream, stream_name, stream_path)
+
+
+class TestSources(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        self.frames = rng.integers(0, 4096, size=(6, 24, 32), dtype=np.uint16)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def assert_frames(self, source, frames):
+        self.assertEqual((len(source), source.height, source.width), frames.shape)
+        for frame_number in range(len(frames)):
+            np.testing.assert_array_equal(source[frame_number], frames[frame_number])
+
+    def test_tiff(self):
+        tifffile.imwrite(self.path("stack.tif"), self.frames)
+        tifffile.imwrite(self.path("compressed.tif"), self.frames, compression="zlib")
+        tifffile.imwrite(self.path("stack.ome.tif"), self.frames, ome=True)
+        for name, memory_mapped in [("stack.tif", True), ("compressed.tif", False), ("stack.ome.tif", True)]:
+            with open_source(self.path(name)) as source:
+                self.assertIsInstance(source, TiffSource)
+                self.assertEqual(source.frames is not None, memory_mapped)
+                self.assert_frames(source, self.frames)
+
+    def test_video(self):
+        writer = cv.VideoWriter(self.path("movie.avi"), cv.VideoWriter_fourcc(*"MJPG"), 10, (32, 24))
+        for frame_number in range(5):
+            writer.write(np.full((24, 32, 3), frame_number * 50, dtype=np.uint8))
+        writer.release()
+        with open_source(self.path("movie.avi")) as source:
+            self.assertIsInstance(source, VideoSource)
+            self.assertEqual((len(source), source.height, source.width), (5, 24, 32))
+            # In order, and jumping around
+            for frame_number in [0, 1, 4, 2, 3]:
+                frame = source[frame_number]
+                self.assertEqual(frame.shape, (24, 32))
+                self.assertAlmostEqual(frame.mean(), frame_number * 50, delta=2)
+
+    def test_npy(self):
+        np.save(self.path("stack.npy"), self.frames)
+        with open_source(self.path("stack.npy")) as source:
+            self.assertIsInstance(source, MemmapSource)
+            self.assertIsInstance(source.frames, np.memmap)
+            self.assert_frames(source, self.frames)
+
+    def test_raw(self):
+        offset = 16
+        with open(self.path("stack.raw"), "wb") as file:
+            file.write(b"\0" * offset)
+            file.write(self.frames.tobytes())
+        with open(self.path("stack.raw.json"), "w") as file:
+            json.dump({"shape": list(self.frames.shape), "dtype": "uint16", "offset": offset}, file)
+        with open_source(self.path("stack.raw")) as source:
+            self.assert_frames(source, self.frames)
+
+    def test_crop(self):
+        np.save(self.path("stack.npy"), self.frames)
+        with open_source(self.path("stack.npy")) as source:
+            self.assertIs(crop(source), source)
+            self.assertIs(crop(source, width=32, height=100), source)
+            roi = crop(source, x=4, y=10, width=20)
+            self.assertIsInstance(roi, CroppedSource)
+            self.assert_frames(roi, self.frames[:, 10:, 4:24])
+            # A view of the memory-mapped file
+            self.assertTrue(np.shares_memory(roi[2], source.frames))
+            with self.assertRaises(ValueError):
+                CroppedSource(source, x=32)
+
+    def test_streams(self):
+        positions = np.stack([self.frames, self.frames[::-1], self.frames // 2])
+        np.save(self.path("positions.npy"), positions)
+        streams = list_streams(self.path("positions.npy"))
+        self.assertEqual(streams, [self.path("positions.npy") + f"#m={m}" for m in range(3)])
+        for m, stream in enumerate(streams):
+            with open_source(stream) as source:
+                self.assert_frames(source, positions[m])
+        self.assertEqual(list_streams(self.path("positions.npy"), axes=""), [self.path("positions.npy")])
+        with self.assertRaises(ValueError):
+            open_source(self.path("positions.npy") + "#m=3")
+
+        np.save(self.path("stack.npy"), self.frames)
+        self.assertEqual(list_streams(self.path("stack.npy")), [self.path("stack.npy")])
+        with self.assertRaises(ValueError):
+            open_source(self.path("stack.npy") + "#m=0")
+
+    def test_stream_names(self):
+        self.assertEqual(stream_path("a/movie.nd2", {'m': 2, 'c': 1}), "a/movie.nd2#m=2,c=1")
+        self.assertEqual(split_stream("a/movie.nd2#m=2,c=1"), ("a/movie.nd2", {'m': 2, 'c': 1}))
+        self.assertEqual(stream_name("a/movie.nd2#m=2,c=1"), "movie_m2_c1")
+        self.assertTrue(is_supported("a/movie.nd2#m=2"))
+        # A # that isn't followed by coordinates is part of the file name
+        self.assertEqual(split_stream("a/run#3.nd2"), ("a/run#3.nd2", {}))
+        self.assertEqual(stream_name("a/run#3.nd2"), "run#3")
+
+    def test_convert_to_npy(self):
+        tifffile.imwrite(self.path("compressed.tif"), self.frames, compression="zlib")
+        convert_to_npy(self.path("compressed.tif"), self.path("converted.npy"))
+        np.testing.assert_array_equal(np.load(self.path("converted.npy")), self.frames)
+
+    def test_unsupported(self):
+        self.assertTrue(is_supported("a/b.ND2"))
+        self.assertFalse(is_supported("notes.txt"))
+        with self.assertRaises(ValueError):
+            open_source(self.path("notes.txt"))
+
+
+if __name__ == '__main__':
+    unittest.main()
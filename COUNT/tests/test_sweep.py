@@ -0,0 +1,68 @@
+import dataclasses
+import os
+import tempfile
+import unittest
+
+import cv2 as cv
+import numpy as np
+
+from COUNT.parameters import TrackingParameters
+from COUNT.sweep import export_sweep_to_csv, parameter_sets, sweep
+from COUNT.tracking import nd2_mog_contours
+
+
+def crossing_cells(n_frames=50, shape=(64, 160), every=7, speed=9):
+    """Cells crossing a dark channel from left to right, alternately at the top (DEP) and the bottom"""
+    frames = np.full((n_frames,) + shape, 100, dtype=np.uint16)
+    for frame_number in range(n_frames):
+        for start in range(0, frame_number + 1, every):
+            row = shape[0] // 4 if start % 2 else shape[0] * 3 // 4
+            cv.circle(frames[frame_number], (speed * (frame_number - start), row), 5, 4000, -1)
+    return frames
+
+
+class TestSweep(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "cells.npy")
+        np.save(self.path, crossing_cells())
+        self.params = TrackingParameters(cell_radius=5)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_parameter_sets(self):
+        grid = {"timeout": [3, 5], "canny_lower": [50], "max_centroid_distance": [40, 70]}
+        self.assertEqual(parameter_sets(grid, ("max_centroid_distance", "timeout")),
+                         [{"max_centroid_distance": 40, "timeout": 3}, {"max_centroid_distance": 40, "timeout": 5},
+                          {"max_centroid_distance": 70, "timeout": 3}, {"max_centroid_distance": 70, "timeout": 5}])
+        self.assertEqual(parameter_sets(grid, ("cell_radius",)), [{}])
+
+    def test_same_counts_as_separate_runs(self):
+        grid = {"cell_radius": [3, 5], "max_centroid_distance": [5, 40], "timeout": [2, 5]}
+        rows = sweep(self.path, grid, self.params, progress=lambda *_: None)
+        self.assertEqual(len(rows), 8)
+        self.assertTrue(any(row['cells_counted'] for row in rows))
+        for row in rows:
+            params = dataclasses.replace(self.params, **{name: row[name] for name in grid})
+            expired, _ = nd2_mog_contours(self.path, params, progress=lambda *_: None)
+            DEP_true = sum(1 for obj in expired.values() if obj.DEP_outlet is True)
+            self.assertEqual((row['cells_counted'], row['DEP_true'], row['DEP_false']),
+                             (len(expired), DEP_true, len(expired) - DEP_true))
+
+    def test_unsweepable_parameter(self):
+        with self.assertRaises(ValueError):
+            sweep(self.path, {"intensity_window": ["frame", "fixed"]}, self.params)
+
+    def test_export(self):
+        rows = sweep(self.path, {"timeout": [3, 5]}, self.params, progress=lambda *_: None)
+        csv_filename = os.path.join(self.tmp.name, "sweep.csv")
+        export_sweep_to_csv(rows, csv_filename)
+        with open(csv_filename) as file:
+            lines = file.read().splitlines()
+        self.assertEqual(lines[0], "timeout,cells_counted,DEP_true,DEP_false")
+        self.assertEqual(len(lines), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import dataclasses
+import os
+import tempfile
+import unittest
+
+import cv2 as cv
+import numpy as np
+
+from COUNT.parameters import TrackingParameters
+from COUNT.tests.test_detection import reference_frames
+from COUNT.tests.test_sweep import crossing_cells
+from COUNT.tiling import StripTiler, tiles_match_full_frame
+from COUNT.tracking import FrameWorkspace, detect_boxes, nd2_mog_contours
+
+
+def random_mask(rng, shape=(240, 200)):
+    """Cells, noise and a few large objects, anywhere (so also across the seams between strips)"""
+    mask = np.zeros(shape, dtype=np.uint8)
+    for _ in range(40):
+        center = (int(rng.integers(0, shape[1])), int(rng.integers(0, shape[0])))
+        cv.circle(mask, center, int(rng.integers(1, 9)), 255, -1)
+    for _ in range(2):
+        x, y = int(rng.integers(0, shape[1])), int(rng.integers(0, shape[0]))
+        cv.rectangle(mask, (x, y), (x + int(rng.integers(1, 150)), y + int(rng.integers(1, 150))), 255,
+                     int(rng.choice([-1, 2])))
+    mask[rng.random(shape) < 0.01] = 255
+    return mask
+
+
+class TestStripTiler(unittest.TestCase):
+    def setUp(self):
+        self.params = TrackingParameters(cell_radius=5)
+
+    def assert_same_as_full_frame(self, frame, mask, params):
+        expected_boxes, expected_overlay = detect_boxes(frame, mask, params, FrameWorkspace(mask.shape))
+        workspace = FrameWorkspace(mask.shape)
+        with StripTiler(mask.shape, params) as workspace.tiler:
+            boxes, overlay = detect_boxes(frame, mask, params, workspace)
+        np.testing.assert_array_equal(boxes, expected_boxes)
+        np.testing.assert_array_equal(overlay, expected_overlay)
+
+    def test_reference_frames(self):
+        for strips in (2, 3, 7):
+            params = dataclasses.replace(self.params, detection_strips=strips)
+            for frame, mask in reference_frames(n_frames=5):
+                self.assert_same_as_full_frame(frame, mask, params)
+
+    def test_objects_on_seams(self):
+        rng = np.random.default_rng(0)
+        for _ in range(20):
+            mask = random_mask(rng)
+            frame = rng.integers(0, 256, size=mask.shape, dtype=np.uint8)
+            params = dataclasses.replace(self.params, detection_strips=int(rng.integers(2, 9)),
+                                         detection_engine=str(rng.choice(["contours", "components"])),
+                                         save_overlay=bool(rng.integers(2)))
+            self.assert_same_as_full_frame(frame, mask, params)
+
+    def test_contour_past_halo(self):
+        # Taller than the halo and across a seam, so the contours have to come from the full edge image
+        mask = np.zeros((200, 100), dtype=np.uint8)
+        cv.rectangle(mask, (20, 10), (40, 190), 255, 2)
+        cv.circle(mask, (30, 100), 4, 255, -1)
+        params = dataclasses.replace(self.params, cell_radius=2, detection_strips=4)
+        with StripTiler(mask.shape, params) as tiler:
+            self.assertIsNone(tiler.detect(mask, np.empty_like(mask)))
+        self.assert_same_as_full_frame(np.zeros_like(mask), mask, params)
+
+    def test_tiles_match_full_frame(self):
+        self.assertTrue(tiles_match_full_frame(TrackingParameters()))
+        # Weak edges on the mask, which canny may keep depending on edges anywhere in the frame
+        self.assertFalse(tiles_match_full_frame(TrackingParameters(canny_lower=100, canny_upper=600)))
+
+
+class TestTiledTracking(unittest.TestCase):
+    def test_same_tracks_in_process_and_in_workers(self):
+        # Strips are detected by the tiler of this process, or by those of the detection workers
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cells.npy")
+            np.save(path, crossing_cells())
+            params = TrackingParameters(cell_radius=5)
+            expected, _ = nd2_mog_contours(path, params, progress=lambda *_: None)
+            self.assertGreater(len(expected), 0)
+            for workers in (0, 2):
+                expired, _ = nd2_mog_contours(path, dataclasses.replace(params, detection_strips=3,
+                                                                        detection_workers=workers),
+                                              progress=lambda *_: None)
+                self.assertEqual(sorted((obj.object_id, obj.position) for obj in expired.values()),
+                                 sorted((obj.object_id, obj.position) for obj in expected.values()), workers)
+
+
+if __name__ == '__main__':
+    unittest.main()
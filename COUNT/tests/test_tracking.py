@@ -3,6 +3,7 @@ import unittest
 import time
 
 from COUNT.tracking import *
+from COUNT.parameters import TrackingParameters
 from COUNT.ui import ROISelectionApp
 
 
@@ -20,6 +21,7 @@ class TestTracking(unittest.TestCase):
         self.my_ui.roi_height = tk.IntVar(value=512)
         self.my_ui.roi_width = tk.IntVar(value=512)
         self.my_ui.roi_x = tk.IntVar(value=0)
+        self.params = TrackingParameters.from_ui(self.my_ui)
         # self.my_ui.save_overlay = tk.BooleanVar(value=True)
 
         self.image_h = 512
@@ -32,7 +34,7 @@ class TestTracking(unittest.TestCase):
         """Measure the time taken to process 100 frames."""
         start_time = time.time()
         for frame in range(600):
-            detect_objects(frame_data=self.nd2_file[frame], frame_index=frame, backSub=self.backSub, ui_app=self.my_ui)
+            detect_objects(frame_data=self.nd2_file[frame], frame_index=frame, backSub=self.backSub, params=self.params)
         duration = time.time() - start_time
         print(f"detect_objects processed 600 frames in {duration:.2f} seconds")
         self.assertLess(duration, 1, "Detection took too long!")  # Adjust the threshold as needed
@@ -46,7 +48,7 @@ class TestTracking(unittest.TestCase):
 
         start_time = time.time()
         match_tracked_objects(surviving_objects_dict=test_dict, object_in_frame=obj, frame_number=frame_number,
-                              ui_app=self.my_ui)
+                              params=self.params)
         duration = time.time() - start_time
         print(f"match_tracked_objects executed in {duration:.5f} seconds")
         self.assertLess(duration, 0.1, "Object matching took too long!")  # Adjust as needed
@@ -96,7 +98,7 @@ class TestTracking(unittest.TestCase):
         actuals = [1, 2, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 5, 4, 4, 4, 4, 4, 4, 4, 4, 4, 1, 1, 1, 2, 2, 2, 3]
         for frame in range(30):
             result, _ = detect_objects(frame_data=self.nd2_file[frame], frame_index=frame, backSub_mask=self.backSub,
-                                       ui_app=self.my_ui)
+                                       params=self.params)
             results.append(len(result))
         self.assertEqual(results, actuals)
 
@@ -202,7 +204,7 @@ class TestTracking(unittest.TestCase):
         obj = self.obj2
         frame_number = 5
         result_bool, result_dict = match_tracked_objects(surviving_objects_dict=test_dict, object_in_frame=obj,
-                                                         frame_number=frame_number, ui_app=self.my_ui)
+                                                         frame_number=frame_number, params=self.params)
         self.assertFalse(result_bool)
 
         # No match, previous object is to the right
@@ -210,7 +212,7 @@ class TestTracking(unittest.TestCase):
         obj = self.obj1
         frame_number = 5
         result_bool, result_dict = match_tracked_objects(surviving_objects_dict=test_dict, object_in_frame=obj,
-                                                         frame_number=frame_number, ui_app=self.my_ui)
+                                                         frame_number=frame_number, params=self.params)
         self.assertTrue(result_bool)
 
         # Object is too far away
@@ -219,7 +221,7 @@ class TestTracking(unittest.TestCase):
         obj = self.obj2
         frame_number = 5
         result_bool, result_dict = match_tracked_objects(surviving_objects_dict=test_dict, object_in_frame=obj,
-                                                         frame_number=frame_number, ui_app=self.my_ui)
+                                                         frame_number=frame_number, params=self.params)
         self.assertTrue(result_bool)
 
         # Object is too far away, and to the left
@@ -228,7 +230,7 @@ class TestTracking(unittest.TestCase):
         obj = self.obj2
         frame_number = 5
         result_bool, result_dict = match_tracked_objects(surviving_objects_dict=test_dict, object_in_frame=obj,
-                                                         frame_number=frame_number, ui_app=self.my_ui)
+                                                         frame_number=frame_number, params=self.params)
         self.assertTrue(result_bool)
 
     def test_match_tracked_objects_edge_case(self):
@@ -254,7 +256,7 @@ class TestTracking(unittest.TestCase):
 
         for obj_id, obj in dict_256.items():
             result_bool, result_dict = match_tracked_objects(surviving_objects_dict=dict_255, object_in_frame=obj,
-                                                             frame_number=frame_number, ui_app=self.my_ui)
+                                                             frame_number=frame_number, params=self.params)
             if obj_id == 45 or obj_id == 100:
                 self.assertTrue(result_bool, (obj_id, result_bool))
             else:
@@ -277,7 +279,7 @@ class TestTracking(unittest.TestCase):
         test_expire_dict = {}
         result_dict, result_list = expire_objects(surviving_objects_dict=test_dict,
                                                   expired_objects_dict=test_expire_dict,
-                                                  frame_number=frame_number, image_h=self.image_h, ui_app=self.my_ui)
+                                                  frame_number=frame_number, image_h=self.image_h, params=self.params)
 
         intended_dict = {}
         intended_expire_dict = {self.obj1.object_id: self.obj1}
@@ -291,7 +293,7 @@ class TestTracking(unittest.TestCase):
         test_expire_dict = {}
         result_dict, result_list = expire_objects(surviving_objects_dict=test_dict,
                                                   expired_objects_dict=test_expire_dict,
-                                                  frame_number=frame_number, image_h=self.image_h, ui_app=self.my_ui)
+                                                  frame_number=frame_number, image_h=self.image_h, params=self.params)
 
         intended_dict = {1: self.obj1}
         intended_expire_dict = {}
@@ -306,7 +308,7 @@ class TestTracking(unittest.TestCase):
         test_expire_dict = {}
         result_dict, result_list = expire_objects(surviving_objects_dict=test_dict,
                                                   expired_objects_dict=test_expire_dict,
-                                                  frame_number=frame_number, image_h=self.image_h, ui_app=self.my_ui)
+                                                  frame_number=frame_number, image_h=self.image_h, params=self.params)
 
         intended_dict = {}
         intended_expire_dict = {}
@@ -315,7 +317,7 @@ class TestTracking(unittest.TestCase):
         self.assertEqual(result_list, intended_expire_dict)
 
     def test_nd2_mog_contours(self):
-        self.mog_results_dict, results_history_list = nd2_mog_contours(self.my_ui.file_path, self.my_ui)
+        self.mog_results_dict, results_history_list = nd2_mog_contours(self.my_ui.file_path, self.params)
         # print(results_dict)
         self.assertEqual(len(self.mog_results_dict), 100)
 
@@ -0,0 +1,87 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from COUNT.tracking import TrackTable, TrajectoryWriter, export_trajectories_to_csv
+
+
+class TestTrackTable(unittest.TestCase):
+    def test_track_table(self):
+        table = TrackTable(capacity=2)
+        table.append(1, [1, 2], np.array([[0, 1, 2, 3], [4, 5, 6, 7]]), [0, 0])
+        table.append(2, [1], np.array([[8, 9, 10, 11]]), [1])
+        self.assertEqual(len(table), 3)
+        self.assertEqual(list(table.column('frame')), [1, 1, 2])
+        self.assertEqual(list(table.column('object_id')), [1, 2, 1])
+
+        # Rows can still be read as DetectedObject instances
+        obj = table[2]
+        self.assertEqual((obj.object_id, obj.position, obj.size, obj.most_recent_frame, obj.frames_tracked),
+                         (1, (8, 9), (10, 11), 2, 1))
+        self.assertEqual(obj.position_history, {2: (8, 9)})
+        self.assertEqual([obj.object_id for obj in table], [1, 2, 1])
+
+        table.clear()
+        self.assertEqual(len(table), 0)
+
+    def test_growth(self):
+        # The table grows past its capacity without losing rows
+        table = TrackTable(capacity=1)
+        for frame_number in range(100):
+            table.append(frame_number, [frame_number + 1], np.array([[frame_number, 0, 9, 9]]), [0])
+        self.assertEqual(len(table), 100)
+        self.assertEqual(list(table.column('x')), list(range(100)))
+        self.assertEqual(list(table.column('object_id')), list(range(1, 101)))
+
+
+def frame_boxes(frame_number):
+    return np.array([[frame_number, 1, 2, 3], [frame_number, 4, 5, 6]])
+
+
+class TestTrajectoryWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.stream_csv = os.path.join(self.tmp.name, 'stream.csv')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def expected_csv(self, n_frames):
+        table = TrackTable()
+        for frame_number in range(n_frames):
+            table.append(frame_number, [1, 2], frame_boxes(frame_number), [frame_number, frame_number])
+        full_csv = os.path.join(self.tmp.name, 'full.csv')
+        export_trajectories_to_csv(table, full_csv, verbose=False)
+        with open(full_csv) as full_file:
+            return full_file.read()
+
+    def test_trajectory_writer(self):
+        # Same file, byte for byte, as export_trajectories_to_csv
+        with TrajectoryWriter(self.stream_csv, chunk_rows=2) as writer:
+            for frame_number in range(5):
+                writer.append(frame_number, [1, 2], frame_boxes(frame_number), [frame_number, frame_number])
+                # Chunks are readable while the writer is still open
+                with open(self.stream_csv) as csvfile:
+                    self.assertEqual(len(csvfile.readlines()), 1 + 2 * (frame_number + 1))
+        with open(self.stream_csv) as stream_file:
+            self.assertEqual(stream_file.read(), self.expected_csv(5))
+
+    def test_resume(self):
+        # Rows written after the position was taken are dropped, and the file continues from there
+        with TrajectoryWriter(self.stream_csv, chunk_rows=3) as writer:
+            for frame_number in range(3):
+                writer.append(frame_number, [1, 2], frame_boxes(frame_number), [frame_number, frame_number])
+            resume_at = writer.position()
+            writer.append(3, [7, 8], frame_boxes(9), [0, 0])
+        self.assertEqual(resume_at[0], 6)
+        with TrajectoryWriter(self.stream_csv, resume_at=resume_at) as writer:
+            for frame_number in range(3, 5):
+                writer.append(frame_number, [1, 2], frame_boxes(frame_number), [frame_number, frame_number])
+        with open(self.stream_csv) as stream_file:
+            self.assertEqual(stream_file.read(), self.expected_csv(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""
+===================
+T I L I N G
+===================
+Detection split into horizontal strips, processed by a pool of threads, for params.detection_strips > 1.
+
+OpenCV releases the GIL, so threads working on different strips of one frame run at the same time. Each strip is
+processed together with a halo of rows above and below it, so the results are exactly those of the whole frame:
+
+    - The morphological opening and canny only look a few pixels around each pixel. Each strip writes the edges of
+      its own rows into the full edge image.
+    - Contours are found in the strip plus a halo of cell_radius * 10 rows (the size of the largest object that is
+      counted as a cell). A strip keeps the contours whose top row is in the strip. A contour that runs past the
+      halo could be cut, so if one shows up the contours of that frame are found in the full edge image instead.
+
+Canny is only local when every gradient on the foreground mask is either a strong edge or no edge at all (see
+tiles_match_full_frame). Otherwise, and for frames without foreground, detect_boxes uses the whole frame as before.
+"""
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2 as cv
+import numpy as np
+
+from COUNT.parameters import TrackingParameters
+from COUNT.tracking import OPEN_KERNEL
+
+# Rows around a strip that the opening (2) and canny (2) need to give the same edges as the whole frame
+EDGE_HALO = 4
+# L1 gradient magnitudes canny can see on a 0/255 mask with its 3x3 sobel kernels
+MASK_GRADIENTS = (510, 1020, 1530)
+
+
+def tiles_match_full_frame(params: TrackingParameters) -> bool:
+    """
+    True if canny on strips of a foreground mask gives the same edges as canny on the whole mask.
+
+    Canny keeps weak edges (between the thresholds) only if they connect to a strong edge, which can be any distance
+    away. On a 0/255 mask there are only a few possible gradients, so with the default thresholds there are no weak
+    edges at all.
+    """
+    return not any(params.canny_lower - 1 <= gradient <= params.canny_upper + 1 for gradient in MASK_GRADIENTS)
+
+
+class StripTiler:
+    """
+    Splits frames into horizontal strips and detects edges and contours in each strip on its own thread.
+
+    Args:
+        shape (Tuple[int, int]): (height, width) of the frames.
+        params (TrackingParameters): Uses detection_strips, cell_radius, canny_lower, canny_upper and
+            detection_engine.
+
+    Attributes:
+    ----------
+    exact : bool
+        Whether the strips give the same results as the whole frame for these parameters, see tiles_match_full_frame.
+    strips : List[Tuple[int, int]]
+        First and last (exclusive) row of each strip.
+    halo : int
+        Extra rows around each strip searched for contours.
+
+    Methods
+    -------
+    detect(foreground: np.ndarray, edges: np.ndarray) -> Optional[Tuple]
+        Writes the canny edges of the foreground into edges, and returns the contours found in them, or None if they
+        have to be found in the full edge image.
+
+    close()
+        Stops the threads. Also called when used as a context manager.
+    """
+
+    def __init__(self, shape, params: TrackingParameters):
+        self.shape = tuple(shape[:2])
+        self.params = params
+        self.exact = tiles_match_full_frame(params)
+        height = self.shape[0]
+        bounds = np.linspace(0, height, num=min(params.detection_strips, height) + 1).round().astype(int).tolist()
+        self.strips = list(zip(bounds[:-1], bounds[1:]))
+        self.halo = params.cell_radius * 10
+        self.executor = ThreadPoolExecutor(max_workers=len(self.strips), thread_name_prefix="StripTiler")
+        # Strips and their halos overlap, so each strip has its own buffers
+        self.buffers = []
+        for start, stop in self.strips:
+            rows = min(height, stop + self.halo + EDGE_HALO) - max(0, start - self.halo - EDGE_HALO)
+            self.buffers.append((np.empty((rows, self.shape[1]), dtype=np.uint8),
+                                 np.empty((rows, self.shape[1]), dtype=np.uint8)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+
+    def detect(self, foreground, edges) -> typing.Optional[typing.Tuple]:
+        find_contours = self.params.detection_engine == "contours"
+        futures = [self.executor.submit(self.detect_strip, index, foreground, edges, find_contours)
+                   for index in range(len(self.strips))]
+        strip_contours = [future.result() for future in futures]
+        if not find_contours or any(contours is None for contours in strip_contours):
+            return None
+        return tuple(contour for contours in strip_contours for contour in contours)
+
+    def detect_strip(self, index, foreground, edges, find_contours):
+        params = self.params
+        height = self.shape[0]
+        start, stop = self.strips[index]
+        # Rows searched for contours, and the rows needed to get their edges right
+        search_start, search_stop = max(0, start - self.halo), min(height, stop + self.halo)
+        input_start, input_stop = max(0, search_start - EDGE_HALO), min(height, search_stop + EDGE_HALO)
+        cleaned, strip_edges = self.buffers[index]
+        rows = input_stop - input_start
+        cv.morphologyEx(foreground[input_start:input_stop], cv.MORPH_OPEN, OPEN_KERNEL, dst=cleaned[:rows])
+        cv.Canny(cleaned[:rows], params.canny_lower, params.canny_upper, strip_edges[:rows])
+        # The edges of the strip's own rows are exact
+        edges[start:stop] = strip_edges[start - input_start:stop - input_start]
+        if not find_contours:
+            return None
+
+        contours, _ = cv.findContours(strip_edges[search_start - input_start:search_stop - input_start],
+                                      mode=cv.RETR_EXTERNAL, method=cv.CHAIN_APPROX_SIMPLE, offset=(0, search_start))
+        kept = []
+        for contour in contours:
+            x, y, w, h = cv.boundingRect(contour)
+            cut = (search_start > 0 and y == search_start) or (search_stop < height and y + h == search_stop)
+            if cut and y < stop and y + h > start:
+                # Part of this contour could be outside the halo, and it could hide contours in the strip
+                return None
+            if start <= y < stop:
+                kept.append(contour)
+        return kept
@@ -18,19 +18,41 @@ Specific tracking nuance:
         Objects have good contrast on background
         files are high frame rate
             (High FPS = More data... try decreasing camera ROI to make files smaller at high FPS)
-    If you decide to save overlays, you'll get a bunch of .png files in a folder.
-        hint: ffmpeg
+    If you decide to save overlays, you'll get an .mp4 video of each file in the overlay folder.
+        hint: overlay_every and overlay_scale make them smaller
 
 Read more:
 https://github.com/bschelske/COUNT
 """
+import contextlib
+import copy
 import csv
+import dataclasses
+import functools
+import heapq
+import itertools
+import json
 import typing
 
 import cv2 as cv
 import numpy as np
+from scipy.optimize import linear_sum_assignment
 from tqdm import tqdm
-from pims import ND2Reader_SDK
+
+from COUNT.annotations import AnnotationWriter
+from COUNT.background import create_background
+from COUNT.cache import FrameCache
+from COUNT.checkpoint import checkpoint_rows, load_checkpoint, remove_checkpoint, save_checkpoint
+from COUNT.frames import FrameConverter, FramePrefetcher, prefetch_depth
+from COUNT.gating import MotionGate, gate_enabled
+from COUNT.overlay import OverlayWriter, overlay_filename
+from COUNT.parameters import TrackingParameters
+from COUNT.sources import crop, open_source
+from COUNT.spill import RowFile, part_filename, save_columns
+
+TRAJECTORY_FIELDNAMES = ['frame', 'object_id', 'x_pos', 'y_pos', 'x_size', 'y_size']
+DETECTION_FIELDS = ['frame', 'x', 'y', 'w', 'h']  # Columns of the detections .npz file
+OPEN_KERNEL = cv.getStructuringElement(cv.MORPH_ELLIPSE, (3, 3))  # Morphological opening to reduce noise
 
 
 class DetectedObject:
@@ -54,8 +76,8 @@ class DetectedObject:
 
     Methods
     -------
-    update_frames_tracked() -> None
-        Increments the frame tracking counter.
+    position_history -> Dict[int, Tuple[float, float]]
+        {most_recent_frame: position}, kept for code that reads trajectories from DetectedObject instances.
 
     center() -> Tuple[float, float]
         Calculates and returns the center position of the object.
@@ -63,6 +85,9 @@ class DetectedObject:
     outlet_assignment(roi_h: float, roi_y: float) -> None
         Assigns the DEP outlet status based on the object's position within the ROI.
     """
+    # No __dict__ per instance. Only the objects currently being tracked (and the counted ones) are kept as
+    # DetectedObject instances, every detection is stored as a row of a TrackTable
+    __slots__ = ('object_id', 'position', 'size', 'most_recent_frame', 'DEP_outlet', 'frames_tracked')
 
     def __init__(self, object_id, position, size, most_recent_frame):
         self.object_id = object_id
@@ -71,175 +96,1004 @@ class DetectedObject:
         self.most_recent_frame = most_recent_frame
         self.DEP_outlet = ''
         self.frames_tracked = 0
-        self.position_history = {self.most_recent_frame: self.position}
-        self.displacement_history = []
-
-    # Deprecated?
-    # def update(self, most_recent_frame, new_position):
-    #     self.frames_tracked += 1
-    #     self.most_recent_frame = most_recent_frame
-    #
-    #     self.displacement_history.append(new_position[0] - self.position[0])
-    #
-    #     self.position = new_position
-    #     self.position_history[self.most_recent_frame] = self.position
-    #
-    # def update_frames_tracked(self):
-    #     self.frames_tracked += 1
+
+    @property
+    def position_history(self):
+        return {self.most_recent_frame: self.position}
 
     def center(self):
         return self.position[0] + self.size[0] // 2, self.position[1] + self.size[1] // 2
 
-    def outlet_assignment(self, image_h):
-        if int(self.position[1]) < (image_h // 2):
+    def outlet_assignment(self, roi_h, roi_y=0):
+        if int(self.position[1]) < roi_y + (roi_h // 2):
             self.DEP_outlet = True  # DEP Responsive
         else:
             self.DEP_outlet = False  # Not DEP Responsive
 
 
-def nd2_mog_contours(nd2_file_path: str, ui_app) -> typing.Tuple[
-    typing.List[DetectedObject], typing.List[DetectedObject]]:
+class TrackTable:
+    """
+    Columnar store of detections, one row per object per frame, backed by growable NumPy arrays.
+
+    Columns: frame, object_id, x, y, w, h, frames_tracked and DEP (1: DEP responsive, 0: not, -1: not assigned).
+    Storing rows instead of one DetectedObject per detection keeps memory small for long acquisitions.
+
+    Methods
+    -------
+    append(frame_number: int, object_ids: np.ndarray, boxes: np.ndarray, frames_tracked: np.ndarray) -> None
+        Adds one row per box, all in the same frame.
+
+    clear() -> None
+        Removes every row, keeping the allocated memory.
+
+    rows(start: int) -> np.ndarray
+        (N, 8) int32 array of the rows from start on, one column per entry of COLUMNS.
+
+    extend(rows: np.ndarray) -> None
+        Adds rows made by rows().
+
+    __getitem__(index: int) -> DetectedObject
+        A DetectedObject built from one row.
+    """
+    COLUMNS = (('frame', np.int32), ('object_id', np.int32), ('x', np.int32), ('y', np.int32), ('w', np.int32),
+               ('h', np.int32), ('frames_tracked', np.int32), ('DEP', np.int8))
+
+    def __init__(self, capacity=4096):
+        self.length = 0
+        self.capacity = capacity
+        for name, dtype in self.COLUMNS:
+            setattr(self, name, np.empty(capacity, dtype=dtype))
+
+    def __len__(self):
+        return self.length
+
+    def grow(self, min_capacity):
+        capacity = self.capacity
+        while capacity < min_capacity:
+            capacity *= 2
+        for name, dtype in self.COLUMNS:
+            column = np.empty(capacity, dtype=dtype)
+            column[:self.length] = getattr(self, name)[:self.length]
+            setattr(self, name, column)
+        self.capacity = capacity
+
+    def append(self, frame_number, object_ids, boxes, frames_tracked, DEP=-1):
+        count = len(boxes)
+        if count == 0:
+            return
+        if self.length + count > self.capacity:
+            self.grow(self.length + count)
+        rows = slice(self.length, self.length + count)
+        boxes = np.asarray(boxes)
+        self.frame[rows] = frame_number
+        self.object_id[rows] = object_ids
+        self.x[rows] = boxes[:, 0]
+        self.y[rows] = boxes[:, 1]
+        self.w[rows] = boxes[:, 2]
+        self.h[rows] = boxes[:, 3]
+        self.frames_tracked[rows] = frames_tracked
+        self.DEP[rows] = DEP
+        self.length += count
+
+    def clear(self):
+        self.length = 0
+
+    def column(self, name):
+        """View of the filled part of a column"""
+        return getattr(self, name)[:self.length]
+
+    def rows(self, start=0):
+        return np.column_stack([getattr(self, name)[start:self.length] for name, _ in self.COLUMNS]).astype(np.int32)
+
+    def extend(self, rows):
+        self.append(rows[:, 0], rows[:, 1], rows[:, 2:6], rows[:, 6], rows[:, 7])
+
+    def __getitem__(self, index):
+        if not -self.length <= index < self.length:
+            raise IndexError("TrackTable index out of range")
+        index %= self.length
+        obj = DetectedObject(object_id=int(self.object_id[index]),
+                             position=(int(self.x[index]), int(self.y[index])),
+                             size=(int(self.w[index]), int(self.h[index])),
+                             most_recent_frame=int(self.frame[index]))
+        obj.frames_tracked = int(self.frames_tracked[index])
+        if self.DEP[index] >= 0:
+            obj.DEP_outlet = bool(self.DEP[index])
+        return obj
+
+    def __iter__(self):
+        for index in range(self.length):
+            yield self[index]
+
+
+class TrajectoryWriter:
+    """
+    Writes the trajectory .csv file while the tracking runs, instead of keeping every detection until the end.
+
+    Rows are final as soon as they are linked (every detection gets its object_id in its own frame), so they are
+    buffered in a TrackTable and written to disk every chunk_rows rows, and at every flush(). Memory is set by the
+    chunk size instead of the length of the file, and the file can be read while the run is still going.
+    The output is the same as export_trajectories_to_csv.
+
+    Methods
+    -------
+    append(frame_number: int, object_ids: np.ndarray, boxes: np.ndarray, frames_tracked: np.ndarray) -> None
+        Same as TrackTable.append.
+
+    flush() -> None
+        Writes the buffered rows to disk.
+
+    position() -> Tuple[int, int]
+        Flushes, then returns (rows written, size of the file in bytes). Passing it back as resume_at continues the
+        file from this point (see checkpoint.py).
+
+    close() -> None
+        Flushes and closes the file.
+    """
+
+    def __init__(self, csv_filename, chunk_rows=100_000, resume_at=None):
+        self.csv_filename = csv_filename
+        self.chunk_rows = chunk_rows
+        self.rows_written = 0
+        self.buffer = TrackTable(capacity=min(chunk_rows, 4096))
+        if resume_at is None:
+            self.csvfile = open(csv_filename, 'w', newline='')
+            self.writer = csv.writer(self.csvfile)
+            self.writer.writerow(TRAJECTORY_FIELDNAMES)
+        else:
+            # Drop the rows written after resume_at was taken, then append
+            self.rows_written, size = resume_at
+            with open(csv_filename, 'r+b') as file:
+                file.truncate(size)
+            self.csvfile = open(csv_filename, 'a', newline='')
+            self.writer = csv.writer(self.csvfile)
+        self.csvfile.flush()
+
+    def append(self, frame_number, object_ids, boxes, frames_tracked):
+        self.buffer.append(frame_number, object_ids, boxes, frames_tracked)
+        if len(self.buffer) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer):
+            write_trajectory_rows(self.writer, self.buffer)
+            self.rows_written += len(self.buffer)
+            self.buffer.clear()
+        self.csvfile.flush()
+
+    def position(self):
+        self.flush()
+        return self.rows_written, self.csvfile.tell()
+
+    def close(self):
+        if not self.csvfile.closed:
+            self.flush()
+            self.csvfile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class DetectionWriter:
+    """
+    Writes the detections of every frame, before linking, to a compact columnar .npz file.
+
+    Detection is the slow part of tracking, and it doesn't depend on max_centroid_distance or timeout. With the
+    detections saved, relink.py rebuilds the tracks and both .csv files with other linking parameters in seconds,
+    without the video.
+
+    The file holds one int32 column per field (frame, x, y, w, h), sorted by frame, plus image_h and roi_y (height and
+    top of the ROI, to assign outlets), total_frames, the path of the video and the parameters it was detected with (as
+    settings.json text). With a motion gate, frame_status holds the gating.py status of every frame.
+
+    Like TrajectoryWriter, rows are written every chunk_rows rows, to a spill.RowFile (<npz_filename>.part). save()
+    then copies its columns into the .npz a chunk at a time and removes it, so memory is set by the chunk size instead
+    of the length of the file.
+
+    Methods
+    -------
+    append(frame_number: int, boxes: np.ndarray) -> None
+        Adds the (N, 4) bounding boxes detected in a frame.
+
+    position() -> Tuple[int, int]
+        Same as RowFile.position, passing it back as resume_at continues from this point (see checkpoint.py).
+
+    save(frame_status: np.ndarray = None) -> None
+        Writes the .npz file.
+    """
+
+    def __init__(self, npz_filename, image_h, total_frames, source="", params: TrackingParameters = None, roi_y=0,
+                 chunk_rows=100_000, resume_at=None):
+        self.npz_filename = npz_filename
+        self.image_h = image_h
+        self.roi_y = roi_y
+        self.total_frames = total_frames
+        self.source = source
+        self.params = params
+        self.rows = RowFile(part_filename(npz_filename), len(DETECTION_FIELDS), chunk_rows=chunk_rows,
+                            resume_at=resume_at)
+
+    def append(self, frame_number, boxes):
+        if len(boxes):
+            rows = np.empty((len(boxes), len(DETECTION_FIELDS)), dtype=np.int32)
+            rows[:, 0] = frame_number
+            rows[:, 1:] = boxes
+            self.rows.append(rows)
+
+    def position(self):
+        return self.rows.position()
+
+    def save(self, frame_status=None):
+        settings = json.dumps(self.params.to_settings()) if self.params is not None else ""
+        fields = {'image_h': self.image_h, 'roi_y': self.roi_y, 'total_frames': self.total_frames,
+                  'source': self.source, 'parameters': settings}
+        if frame_status is not None:
+            fields['frame_status'] = frame_status
+        save_columns(self.npz_filename, self.rows, DETECTION_FIELDS, fields)
+        self.rows.remove()
+
+
+class SpatialGrid:
+    """
+    Uniform spatial hash grid of tracked object centers, used to find match candidates without checking every object.
+
+    The cell size is max_centroid_distance, so every tracked object that could match a center lies in the 3x3 block
+    of cells around it.
+
+    Methods
+    -------
+    insert(object_id: int, center: Tuple[float, float]) -> None
+        Adds an object, or moves it if it is already in the grid.
+
+    remove(object_id: int) -> None
+        Removes an object from the grid.
+
+    neighbours(center: Tuple[float, float]) -> List[int]
+        Returns the ids of all objects in the 3x3 block of cells around center.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = max(1, cell_size)
+        self.cells = {}  # {(column, row): {object_id, ...}}
+        self.object_cells = {}  # {object_id: (column, row)}
+
+    def cell_of(self, center):
+        return int(center[0] // self.cell_size), int(center[1] // self.cell_size)
+
+    def insert(self, object_id, center):
+        cell = self.cell_of(center)
+        previous_cell = self.object_cells.get(object_id)
+        if previous_cell == cell:
+            return
+        if previous_cell is not None:
+            self.remove(object_id)
+        self.cells.setdefault(cell, set()).add(object_id)
+        self.object_cells[object_id] = cell
+
+    def remove(self, object_id):
+        cell = self.object_cells.pop(object_id)
+        members = self.cells[cell]
+        members.discard(object_id)
+        if not members:
+            del self.cells[cell]
+
+    def neighbours(self, center):
+        column, row = self.cell_of(center)
+        object_ids = []
+        for neighbour_column in (column - 1, column, column + 1):
+            for neighbour_row in (row - 1, row, row + 1):
+                object_ids.extend(self.cells.get((neighbour_column, neighbour_row), ()))
+        return object_ids
+
+
+class Tracker:
+    """
+    Links the objects detected in each frame into tracks.
+
+    Attributes:
+    ----------
+    surviving_objects_dict : dict
+        {object_id: DetectedObject} of objects currently being tracked, most recent detection of each.
+    expired_objects_dict : dict
+        {object_id: DetectedObject} of objects that were tracked long enough to be counted and have left. Stays empty
+        if params.count_only, only the counts are kept.
+    DEP_true, DEP_false : int
+        Number of counted objects with each DEP_outlet.
+    next_new_id : int
+        ID number given to the next new object.
+    grid : SpatialGrid
+        Centers of the surviving objects, kept up to date as objects move, expire and get added.
+    deadlines : list
+        Min-heap of (most_recent_frame + timeout, object_id, most_recent_frame), one entry each time an object is
+        seen. An entry is out of date (and skipped) if the object was seen again after it was pushed.
+
+    Methods
+    -------
+    expire(frame_number: int) -> None
+        Removes objects that haven't been seen for more than params.timeout frames.
+
+    link(boxes: np.ndarray, frame_number: int) -> Tuple[np.ndarray, np.ndarray]
+        Matches the boxes in a frame to the surviving objects, and adds the boxes that didn't match.
+
+    finish() -> dict
+        Assigns outlets to the objects still being tracked and returns every counted object.
+
+    counted_rows(start: int) -> np.ndarray
+        (N, 8) int32 rows (object_id, x, y, w, h, most_recent_frame, frames_tracked, DEP_outlet) of the counted
+        objects, from the start-th on, to save them outside of the Tracker (see checkpoint.py).
+
+    restore_counted(rows: np.ndarray) -> None
+        Adds the counted objects back from rows made by counted_rows().
+
+    cells_counted -> int
+        Number of counted objects.
+    """
+
+    def __init__(self, params: TrackingParameters, image_h, roi_y=0):
+        self.params = params
+        self.image_h = image_h  # Height of the ROI
+        self.roi_y = roi_y
+        self.surviving_objects_dict = {}  # {object_id: object}
+        self.expired_objects_dict = {}  # {object_id: object}
+        self.DEP_true = 0
+        self.DEP_false = 0
+        self.next_new_id = 1  # ID number for first object
+        self.grid = SpatialGrid(params.max_centroid_distance)
+        self.deadlines = []
+
+    def expire(self, frame_number):
+        # Only look at objects whose deadline has passed, instead of every surviving object
+        timeout = self.params.timeout
+        expiring_ids = []
+        while self.deadlines and self.deadlines[0][0] < frame_number:
+            _, obj_id, seen_frame = heapq.heappop(self.deadlines)
+            tracked_obj = self.surviving_objects_dict.get(obj_id)
+            # Skip out of date entries: the object already expired, or was seen again later
+            if tracked_obj is not None and tracked_obj.most_recent_frame == seen_frame:
+                expiring_ids.append(obj_id)
+
+        # Same order as surviving_objects_dict (ids are handed out in increasing order)
+        for obj_id in sorted(expiring_ids):
+            tracked_obj = self.surviving_objects_dict.pop(obj_id)
+            # Objects that were being tracked are counted, the rest are forgotten
+            if tracked_obj.frames_tracked >= timeout:
+                self.count(tracked_obj)
+            self.grid.remove(obj_id)
+
+    def count(self, tracked_obj):
+        tracked_obj.outlet_assignment(self.image_h, self.roi_y)
+        if tracked_obj.DEP_outlet is True:
+            self.DEP_true += 1
+        else:
+            self.DEP_false += 1
+        if not self.params.count_only:
+            self.expired_objects_dict[tracked_obj.object_id] = tracked_obj
+
+    @property
+    def cells_counted(self):
+        return self.DEP_true + self.DEP_false
+
+    def counted_rows(self, start=0):
+        rows = [(obj.object_id, *obj.position, *obj.size, obj.most_recent_frame, obj.frames_tracked, obj.DEP_outlet)
+                for obj in itertools.islice(self.expired_objects_dict.values(), start, None)]
+        return np.array(rows, dtype=np.int32).reshape(-1, 8)
+
+    def restore_counted(self, rows):
+        # The counters already include these objects
+        for object_id, x, y, w, h, most_recent_frame, frames_tracked, DEP_outlet in rows.tolist():
+            obj = DetectedObject(object_id=object_id, position=(x, y), size=(w, h), most_recent_frame=most_recent_frame)
+            obj.frames_tracked = frames_tracked
+            obj.DEP_outlet = bool(DEP_outlet)
+            self.expired_objects_dict[object_id] = obj
+
+    def push_deadline(self, tracked_obj):
+        heapq.heappush(self.deadlines, (tracked_obj.most_recent_frame + self.params.timeout, tracked_obj.object_id,
+                                        tracked_obj.most_recent_frame))
+
+    def link(self, boxes, frame_number):
+        """
+        Match the boxes detected in a frame to the surviving objects, and add the boxes that didn't match.
+
+        Matched objects are updated in place, a new DetectedObject is only made for each new object.
+
+        Args:
+            boxes (np.ndarray): (N, 4) array of (x, y, w, h) boxes detected in the frame.
+            frame_number (int): Current frame number.
+
+        Returns:
+            typing.Tuple[np.ndarray, np.ndarray]: The object_id and frames_tracked of each box.
+        """
+        object_ids = np.zeros(len(boxes), dtype=np.int64)
+        frames_tracked = np.zeros(len(boxes), dtype=np.int64)
+        if len(boxes) == 0:
+            return object_ids, frames_tracked
+        boxes = np.asarray(boxes, dtype=np.int64)
+        box_list = boxes.tolist()
+        matched = np.zeros(len(boxes), dtype=bool)
+
+        if self.surviving_objects_dict:
+            # Only surviving objects in neighbouring grid cells can match
+            centers = (boxes[:, :2] + boxes[:, 2:] // 2).tolist()
+            candidate_ids = [self.grid.neighbours(center) for center in centers]
+            # Ids are handed out in increasing order, so sorting keeps the order of surviving_objects_dict
+            tracked_ids = sorted(set().union(*candidate_ids))
+            if tracked_ids:
+                tracked_index = {object_id: index for index, object_id in enumerate(tracked_ids)}
+                tracked_objects = [self.surviving_objects_dict[object_id] for object_id in tracked_ids]
+                tracked_boxes = np.array([(*obj.position, *obj.size) for obj in tracked_objects], dtype=np.int64)
+                pair_frame = np.array([frame_index for frame_index, object_ids_near in enumerate(candidate_ids)
+                                       for _ in object_ids_near], dtype=np.intp)
+                pair_tracked = np.array([tracked_index[object_id] for object_ids_near in candidate_ids
+                                         for object_id in object_ids_near], dtype=np.intp)
+
+                frame_indices, tracked_indices = assign_pairs(boxes, tracked_boxes, pair_frame, pair_tracked,
+                                                              self.params.max_centroid_distance,
+                                                              self.params.assignment)
+                for frame_index, tracked_index in zip(frame_indices.tolist(), tracked_indices.tolist()):
+                    tracked_object = tracked_objects[tracked_index]
+                    x, y, w, h = box_list[frame_index]
+                    tracked_object.position = (x, y)
+                    tracked_object.size = (w, h)
+                    tracked_object.most_recent_frame = frame_number
+                    tracked_object.frames_tracked += 1
+                    self.grid.insert(tracked_object.object_id, tracked_object.center())
+                    self.push_deadline(tracked_object)
+                    object_ids[frame_index] = tracked_object.object_id
+                    frames_tracked[frame_index] = tracked_object.frames_tracked
+                    matched[frame_index] = True
+
+        # Add incoming objects
+        for frame_index in np.flatnonzero(~matched).tolist():
+            x, y, w, h = box_list[frame_index]
+            new_object = DetectedObject(object_id=None, position=(x, y), size=(w, h), most_recent_frame=frame_number)
+            self.surviving_objects_dict, self.next_new_id = add_new_objects(new_object, self.surviving_objects_dict,
+                                                                            self.next_new_id, frame_number)
+            self.grid.insert(new_object.object_id, new_object.center())
+            self.push_deadline(new_object)
+            object_ids[frame_index] = new_object.object_id
+
+        return object_ids, frames_tracked
+
+    def finish(self):
+        # Ensure all surviving objects have their DEP_outlet assigned, and add them to the expired list
+        for obj_id, tracked_obj in self.surviving_objects_dict.items():
+            self.count(tracked_obj)
+        # They are counted now, finishing again doesn't count them twice
+        self.surviving_objects_dict = {}
+        return self.expired_objects_dict
+
+
+def nd2_mog_contours(nd2_file_path: str, params: TrackingParameters,
+                     progress: typing.Optional[typing.Callable[[int, int], None]] = None,
+                     trajectory_csv_filename: typing.Optional[str] = None,
+                     detections_filename: typing.Optional[str] = None,
+                     annotations_filename: typing.Optional[str] = None,
+                     checkpoint_filename: typing.Optional[str] = None) -> typing.Tuple[
+    typing.Dict[int, DetectedObject], typing.Optional[TrackTable]]:
     """
     Process ND2 file to detect and track objects across frames.
 
     Args:
-        nd2_file_path (str): Path to the ND2 file.
-        ui_app: User interface application instance with necessary methods and attributes.
+        nd2_file_path (str): Path to the ND2 file, or any other file sources.open_source can read.
+        params (TrackingParameters): Tracking parameters, e.g. built from the UI with TrackingParameters.from_ui.
+        progress (Callable[[int, int], None], optional): Called after each batch with (frames in batch, total frames).
+            If not given, a tqdm progress bar is shown for each batch instead.
+        trajectory_csv_filename (str, optional): If given, trajectories are written to this file while tracking
+            (see TrajectoryWriter) instead of being kept in memory.
+        detections_filename (str, optional): If given, the detections of every frame are saved to this .npz file
+            (see DetectionWriter), so the tracks can be rebuilt later with relink.py.
+        annotations_filename (str, optional): If given, what the overlays would show is saved to this .npz file
+            (see annotations.AnnotationWriter), to draw overlays of chosen frames later.
+        checkpoint_filename (str, optional): If given and params.checkpoint_every > 0, the state of the run is saved
+            to this file every checkpoint_every frames, and the run continues from it if it was saved by an earlier
+            run that stopped (see checkpoint.py). The file is deleted when the run finishes.
 
     Returns:
-        typing.Tuple[List[DetectedObject], List[DetectedObject]]:
-            - A list of final positions of tracked objects.
-            - A list of all detected objects across frames.
+        typing.Tuple[Dict[int, DetectedObject], Optional[TrackTable]]:
+            - {object_id: DetectedObject} final positions of tracked objects.
+            - A TrackTable of all detected objects across frames, or None if trajectory_csv_filename was given.
     """
-    surviving_objects_dict = {}  # {object_id: object}
-    expired_objects_dict = {}  # {object_id: object}
-    object_history_list = []  # Tracking data for every object identified
-    next_new_id = 1  # ID number for first object
-    backSub = cv.createBackgroundSubtractorMOG2(varThreshold=16, detectShadows=False)
+    # Every object is kept here, params.count_only is for count_objects
+    if params.count_only:
+        params = dataclasses.replace(params, count_only=False)
+    tracker, history = _track_file(nd2_file_path, params, progress, trajectory_csv_filename, detections_filename,
+                                   annotations_filename, checkpoint_filename)
+    # After processing all batches, properly handle the remaining objects
+    expired_objects_dict = tracker.finish()
+    if trajectory_csv_filename:
+        return expired_objects_dict, None
+    return expired_objects_dict, history
+
+
+def count_objects(nd2_file_path: str, params: TrackingParameters,
+                  progress: typing.Optional[typing.Callable[[int, int], None]] = None,
+                  checkpoint_filename: typing.Optional[str] = None) -> typing.Dict[str, int]:
+    """
+    Count-only version of nd2_mog_contours, for screening many files: the same detection and tracking, and the same
+    counts, but only the objects currently being tracked and the counters are kept. Nothing is kept per detection or
+    per counted object (no trajectories, no overlays), so memory doesn't grow with the length of the file.
+
+    Args:
+        nd2_file_path (str): Path to the file, see sources.open_source.
+        params (TrackingParameters): Tracking parameters. save_overlay is ignored.
+        progress (Callable[[int, int], None], optional): See nd2_mog_contours.
+        checkpoint_filename (str, optional): See nd2_mog_contours.
+
+    Returns:
+        dict: 'cells_counted', 'DEP_true' and 'DEP_false', as export_to_csv would count them.
+    """
+    params = dataclasses.replace(params, count_only=True, save_overlay=False)
+    tracker, _ = _track_file(nd2_file_path, params, progress, checkpoint_filename=checkpoint_filename)
+    tracker.finish()
+    return {'cells_counted': tracker.cells_counted, 'DEP_true': tracker.DEP_true, 'DEP_false': tracker.DEP_false}
 
-    with ND2Reader_SDK(nd2_file_path) as nd2_file:
-        # Get information about nd2 file
-        image_h = nd2_file.metadata['height']
 
-        if 'm' in nd2_file.sizes.keys(): # new nikon weirdness
-            nd2_file.iter_axes = 'm'
+def _track_file(nd2_file_path: str, params: TrackingParameters,
+                progress: typing.Optional[typing.Callable[[int, int], None]] = None,
+                trajectory_csv_filename: typing.Optional[str] = None,
+                detections_filename: typing.Optional[str] = None,
+                annotations_filename: typing.Optional[str] = None,
+                checkpoint_filename: typing.Optional[str] = None) -> typing.Tuple[
+    Tracker, typing.Union[TrackTable, TrajectoryWriter, None]]:
+    """
+    The frame loop of nd2_mog_contours and count_objects. Returns the Tracker, before finish(), and the trajectory
+    history (None if params.count_only).
+    """
+    if params.checkpoint_every <= 0:
+        checkpoint_filename = None
+    checkpoint = None
+    if checkpoint_filename:
+        checkpoint = load_checkpoint(checkpoint_filename, nd2_file_path, params, trajectory_csv_filename,
+                                     detections_filename, annotations_filename)
+    next_frame = checkpoint['next_frame'] if checkpoint else 0
+
+    # Tracking data for every object identified
+    if params.count_only:
+        history = None
+    elif trajectory_csv_filename:
+        history = TrajectoryWriter(trajectory_csv_filename, resume_at=checkpoint['trajectory'] if checkpoint else None)
+    else:
+        history = TrackTable()
+    # What grows with the run is saved to side files of the checkpoint, a little at each checkpoint
+    counted_rows, history_rows = None, None
+    if checkpoint_filename:
+        counted_rows = checkpoint_rows(checkpoint_filename, 'counted', checkpoint)
+        if isinstance(history, TrackTable):
+            history_rows = checkpoint_rows(checkpoint_filename, 'history', checkpoint)
+            history.extend(history_rows.read())
+    backSub = create_background(params)
 
+    with contextlib.ExitStack() as exit_stack:
+        if trajectory_csv_filename:
+            # Close the trajectory file even if tracking fails
+            exit_stack.callback(history.close)
+        # When continuing from a checkpoint, MOG2 is warmed up again on the frames just before it
+        warmup_start = max(0, next_frame - params.checkpoint_warmup)
+        # Only a run that starts from the first frame records every frame and mask for the cache
+        frames, masks, cache_writer = open_frames(nd2_file_path, params, exit_stack, start=warmup_start,
+                                                  save_cache=next_frame == 0)
+
+        # Get information about nd2 file
+        frame_shape = frames.shape[1:]
         # Get total frame count for batching
-        total_frames = len(nd2_file)
+        total_frames = warmup_start + len(frames)
+        # Frames are cropped to the ROI, boxes are moved back to full frame coordinates
+        image_h = frame_shape[0]
+        roi_offset = np.array([params.roi_x, params.roi_y, 0, 0], dtype=np.int32) if params.roi_x or params.roi_y \
+            else None
+        if checkpoint:
+            print(f"\ncontinuing {nd2_file_path} from frame {next_frame}")
+            tracker = checkpoint['tracker']
+            tracker.restore_counted(counted_rows.read())
+        else:
+            tracker = Tracker(params, image_h, params.roi_y)
+        annotation_writer = None
+        if annotations_filename:
+            annotation_writer = AnnotationWriter(annotations_filename, image_h, total_frames, nd2_file_path, params,
+                                                 resume_at=checkpoint['annotations'] if checkpoint else None)
+        detection_writer = None
+        if detections_filename:
+            detection_writer = DetectionWriter(detections_filename, image_h, total_frames, nd2_file_path, params,
+                                               roi_y=params.roi_y,
+                                               resume_at=checkpoint['detections'] if checkpoint else None)
         batch_size = 100  # Process 100 frames at a time
 
-        if ui_app.save_overlay.get():
-            print(f"\noverlay saving in {ui_app.overlay_path}")
+        overlay_writer = None
+        if params.save_overlay:
+            overlay_writer = exit_stack.enter_context(
+                OverlayWriter(overlay_filename(params, nd2_file_path, next_frame), frame_shape, params))
+            print(f"\noverlay saving in {overlay_writer.filename}")
 
-        for batch_start in range(0, total_frames, batch_size):
+        # Buffers for every full size image, allocated once and reused for every frame
+        workspace = FrameWorkspace(frame_shape)
+        record = cache_writer.add if cache_writer is not None else None
+        frames, masks = skip_frames(frames, masks, next_frame - warmup_start, backSub, workspace)
+        # Frames without motion skip detection, see gating.py
+        gate, status_rows = None, None
+        if gate_enabled(params):
+            # After a checkpoint, the gate starts at full rate again
+            gate = MotionGate(params, total_frames, next_frame, keep_status=not params.count_only)
+            if checkpoint_filename and gate.status is not None:
+                status_rows = checkpoint_rows(checkpoint_filename, 'status', checkpoint)
+                if checkpoint:
+                    gate.restore(status_rows.read()[:, 0])
+            elif checkpoint:
+                gate.totals = list(checkpoint['gate_totals'])
+        if params.detection_workers > 0:
+            from COUNT.pipeline import detect_frames_parallel  # pipeline.py imports this module
+            detections = detect_frames_parallel(frames, backSub, params, frame_shape, params.detection_workers,
+                                                masks=masks, record=record, gate=gate)
+        else:
+            detections = detect_frames(frames, backSub, params, workspace, masks=masks, record=record, gate=gate)
+        if params.detection_strips > 1 and params.detection_workers == 0:
+            # Detection workers have their own tiler (see pipeline.py)
+            from COUNT.tiling import StripTiler  # tiling.py imports this module
+            workspace.tiler = exit_stack.enter_context(StripTiler(frame_shape, params))
+        # Stop the detection workers even if tracking fails
+        detections = exit_stack.enter_context(contextlib.closing(detections))
+
+        if next_frame and progress is not None:
+            progress(next_frame, total_frames)
+        last_checkpoint = next_frame
+        for batch_start in range(next_frame, total_frames, batch_size):
             batch_end = min(batch_start + batch_size, total_frames)
 
+            batch_frames = range(batch_start, batch_end)
+            if progress is None:
+                batch_frames = tqdm(batch_frames, f"Batch {batch_start//batch_size+1}")
+
             # Perform tracking on each frame
-            for frame_number in tqdm(range(batch_start, batch_end), f"Batch {batch_start//batch_size+1}"):
-                frame_data = nd2_file[frame_number]
-                frame_data = cv.normalize(frame_data, None, 0, 255, cv.NORM_MINMAX, dtype=cv.CV_8U)
-                backSub_mask = backSub.apply(frame_data)
+            for frame_number in batch_frames:
                 # Detect Objects
-                objects_in_frame_list, overlay_frame = detect_objects(frame_data=frame_data, frame_index=frame_number,
-                                                                      backSub_mask=backSub_mask, ui_app=ui_app)
-                object_history_list.extend(objects_in_frame_list)
+                boxes, overlay_frame = next(detections)
+                if roi_offset is not None:
+                    boxes = boxes + roi_offset
+                if detection_writer is not None:
+                    detection_writer.append(frame_number, boxes)
 
                 # Expire outgoing objects
-                if surviving_objects_dict:
-                    surviving_objects_dict, expired_objects_dict = expire_objects(surviving_objects_dict,
-                                                                                  expired_objects_dict,
-                                                                                  frame_number, image_h, ui_app)
-
-                # Match current objects to object history
-                for object_in_frame in objects_in_frame_list:
-                    no_match, surviving_objects_dict = match_tracked_objects(surviving_objects_dict, object_in_frame,
-                                                                             frame_number,
-                                                                             ui_app)
-                    # Add incoming objects
-                    if no_match:
-                        surviving_objects_dict, next_new_id = add_new_objects(object_in_frame, surviving_objects_dict,
-                                                                              next_new_id,
-                                                                              frame_number)
+                tracker.expire(frame_number)
+
+                # Match current objects to object history, and add incoming objects
+                object_ids, frames_tracked = tracker.link(boxes, frame_number)
+                if history is not None:
+                    history.append(frame_number, object_ids, boxes, frames_tracked)
+                if annotation_writer is not None:
+                    annotation_writer.append(frame_number, object_ids, boxes, frames_tracked, tracker.cells_counted)
                 # Add text, object ids to each frame, if chosen
-                if ui_app.save_overlay.get():
-                    save_overlay_frame = overlay_frame.copy()
+                if overlay_writer is not None and overlay_writer.wants(frame_number):
                     # Add text to top of frame
-                    cv.putText(save_overlay_frame,
-                               str(f"In-Frame: {len(objects_in_frame_list)} Total: {len(expired_objects_dict)}"),
+                    cv.putText(overlay_frame,
+                               str(f"Frame: {frame_number} In-Frame: {len(boxes)} "
+                                   f"Total: {tracker.cells_counted}"),
                                (10, 40), cv.FONT_HERSHEY_SIMPLEX, 1,
                                (0, 0, 255), 2, cv.LINE_AA)
 
-                    # Add IDs to each tracked object
-                    for object_id, tracked_object in surviving_objects_dict.items():
-                        if tracked_object.frames_tracked > ui_app.timeout.get()//2:
-                            cv.putText(save_overlay_frame,
+                    # Add IDs to each tracked object (overlays only show the ROI)
+                    for object_id, tracked_object in tracker.surviving_objects_dict.items():
+                        if tracked_object.frames_tracked > params.timeout // 2:
+                            cv.putText(overlay_frame,
                                        str(object_id),
-                                       tracked_object.position, cv.FONT_HERSHEY_SIMPLEX, 1,
+                                       (tracked_object.position[0] - params.roi_x,
+                                        tracked_object.position[1] - params.roi_y), cv.FONT_HERSHEY_SIMPLEX, 1,
                                        (0, 0, 0), 1, cv.LINE_AA)
                         else:
                             pass
 
-                # Save overlay frames to results/overlay folder (default)
-                if ui_app.save_overlay.get():
-                    save_path = ui_app.overlay_path + f"{frame_number:03d}.png"
-                    cv.imwrite(save_path, overlay_frame)
-                    del save_overlay_frame
+                    # Encoded into the file's video in the overlay folder (results/overlay by default)
+                    overlay_writer.write(frame_number, overlay_frame)
 
-            import gc
-            gc.collect()
+            if progress is not None:
+                progress(batch_end - batch_start, total_frames)
+            if trajectory_csv_filename:
+                history.flush()
+            if checkpoint_filename and batch_end < total_frames and \
+                    batch_end - last_checkpoint >= params.checkpoint_every:
+                # Append what is new since the last checkpoint, and only pickle the live state
+                counted_rows.append(tracker.counted_rows(counted_rows.rows_written))
+                live_tracker = copy.copy(tracker)
+                live_tracker.expired_objects_dict = {}
+                if history_rows is not None:
+                    history_rows.append(history.rows(history_rows.rows_written))
+                if status_rows is not None:
+                    # Detection workers can already be past batch_end
+                    status_rows.append(gate.status[status_rows.rows_written:batch_end])
+                save_checkpoint(checkpoint_filename, nd2_file_path, params, {
+                    'next_frame': batch_end,
+                    'tracker': live_tracker,
+                    'trajectory': history.position() if trajectory_csv_filename else None,
+                    'detections': detection_writer.position() if detection_writer is not None else None,
+                    'annotations': annotation_writer.position() if annotation_writer is not None else None,
+                    'counted': counted_rows.position(),
+                    'history': history_rows.position() if history_rows is not None else None,
+                    'status': status_rows.position() if status_rows is not None else None,
+                    'gate_totals': gate.totals if gate is not None and gate.status is None else None})
+                last_checkpoint = batch_end
 
-    # After processing all batches, properly handle the remaining objects
-    # Ensure all surviving objects have their DEP_outlet assigned
-    for obj_id, tracked_obj in surviving_objects_dict.items():
-        tracked_obj.outlet_assignment(image_h)
+        if cache_writer is not None:
+            cache_writer.commit()
+        if detection_writer is not None:
+            detection_writer.save(frame_status=gate.status if gate is not None else None)
+        if annotation_writer is not None:
+            annotation_writer.save()
+        if gate is not None:
+            print(f"\n{nd2_file_path}: {gate.summary()}")
+
+    if checkpoint_filename:
+        remove_checkpoint(checkpoint_filename)
+    return tracker, history
+
+
+def open_frames(nd2_file_path: str, params: TrackingParameters, exit_stack: contextlib.ExitStack, start: int = 0,
+                save_cache: bool = True):
+    """
+    Opens the 8-bit frames of a file: from the frame cache if they were cached by an earlier run, otherwise decoded
+    from the file and converted on a background thread.
+
+    Args:
+        nd2_file_path (str): Path to the file, see sources.open_source.
+        params (TrackingParameters): Uses the intensity window, prefetch and frame cache parameters.
+        exit_stack (contextlib.ExitStack): Closes the file, reader thread and cache writer when it closes.
+        start (int): First frame number. Frames are only saved to the cache when starting from the first frame.
+        save_cache (bool): False if the frames from start on won't all go through subtract_background (e.g. when
+            continuing from a checkpoint, the warm-up frames don't), so they can't be saved to the cache.
+
+    Returns:
+        typing.Tuple:
+            - The 8-bit frames from start on, with a shape of (frames, height, width). Iterating gives each frame in
+              order.
+            - Cached foreground masks, or None if there are none.
+            - A CacheWriter to save the frames and masks with, or None. Call commit() once every frame is added.
+    """
+    frame_cache = FrameCache(params.frame_cache_dir, params.frame_cache_mb) if params.frame_cache_dir else None
+    cached = frame_cache.lookup(nd2_file_path, params) if frame_cache else None
+    if cached is not None:
+        return cached.frames[start:], cached.masks[start:] if cached.masks is not None else None, None
 
-    # Now add all remaining tracked objects to expired list
-    expired_objects_dict.update(surviving_objects_dict)
-    return expired_objects_dict, object_history_list
+    nd2_file = exit_stack.enter_context(open_source(nd2_file_path))
+    # Only the ROI is converted and processed. Its frames are views of the decoded frames
+    nd2_file = crop(nd2_file, params.roi_x, params.roi_y, params.roi_width, params.roi_height)
+    frame_shape = (nd2_file.height, nd2_file.width)
+    # 16-bit to 8-bit conversion, read ahead on a background thread
+    converter = FrameConverter(nd2_file, params)
+    frames = exit_stack.enter_context(
+        FramePrefetcher(nd2_file, converter, frame_shape, prefetch_depth(frame_shape, params.prefetch_memory_mb),
+                        start=start))
+    cache_writer = None
+    if frame_cache and start == 0 and save_cache:
+        cache_writer = frame_cache.writer(nd2_file_path, params, len(nd2_file), frame_shape)
+        if cache_writer is not None:
+            exit_stack.enter_context(cache_writer)
+    return frames, None, cache_writer
 
 
-def detect_objects(frame_data, frame_index, backSub_mask, ui_app):
-    frame_copy = frame_data.view()
+def skip_frames(frames, masks, count, backSub, workspace=None):
+    """
+    Skips the first count frames, returning the rest as (frames, masks). Without masks, the skipped frames are given
+    to backSub, to warm up its model of the background.
+    """
+    if count <= 0:
+        return frames, masks
+    if masks is not None:
+        return frames[count:], masks[count:]
+    frames = iter(frames)
+    for frame_data in itertools.islice(frames, count):
+        backSub.apply(frame_data, workspace.foreground if workspace else None)
+    return frames, None
+
+
+def subtract_background(frames, backSub, workspace=None, masks=None, record=None, gate=None):
+    """
+    Yields (frame, foreground mask) for each frame, in order.
+
+    If masks is given (e.g. cached by an earlier run), masks[frame_number] is used instead of backSub. If record is
+    given, it is called with (frame_number, frame, foreground mask) for each frame.
+
+    If gate is given (a gating.MotionGate), the mask is None for the frames it skips or finds too little motion in.
+    The frames it skips aren't given to backSub, unless record is given.
+    """
+    for frame_number, frame_data in enumerate(frames):
+        skipped = gate is not None and gate.skip()
+        if skipped and record is None:
+            yield frame_data, None
+            continue
+        if masks is not None:
+            backSub_mask = masks[frame_number]
+        else:
+            backSub_mask = backSub.apply(frame_data, workspace.foreground if workspace else None)
+        if record is not None:
+            record(frame_number, frame_data, backSub_mask)
+        if skipped or (gate is not None and not gate.passes(backSub_mask)):
+            backSub_mask = None
+        yield frame_data, backSub_mask
 
-    # If saving overlay frames, a copy of the original frame must be converted from gray to color
-    if ui_app.save_overlay.get():
-        overlay_frame = cv.normalize(frame_copy, None, 0, 255, cv.NORM_MINMAX, dtype=cv.CV_8U)
-        overlay_frame = cv.cvtColor(overlay_frame, cv.COLOR_GRAY2BGR)
+
+def detect_frames(frames, backSub, params: TrackingParameters, workspace=None, masks=None, record=None, gate=None):
+    """Background subtraction (see subtract_background) and detect_boxes for each frame, in order. Yields the
+    detect_boxes result of each frame, or no_objects for the frames the gate leaves out"""
+    for frame_data, backSub_mask in subtract_background(frames, backSub, workspace, masks, record, gate):
+        if backSub_mask is None:
+            yield no_objects(frame_data, params, workspace.overlay if workspace is not None else None)
+        else:
+            yield detect_boxes(frame_data=frame_data, backSub_mask=backSub_mask, params=params, workspace=workspace)
+
+
+def no_objects(frame_data, params: TrackingParameters, overlay=None):
+    """detect_boxes result of a frame without detection (see gating.py): no boxes, and the plain frame as overlay"""
+    boxes = np.empty((0, 4), dtype=np.int32)
+    if params.save_overlay:
+        return boxes, cv.cvtColor(frame_data, cv.COLOR_GRAY2BGR, dst=overlay)
+    return boxes, frame_data
+
+
+def detect_objects(frame_data, frame_index, backSub_mask, params: TrackingParameters):
+    """Same as detect_boxes, but returns a DetectedObject for each box"""
+    boxes, frame_copy = detect_boxes(frame_data, backSub_mask, params)
+    objects = [DetectedObject(object_id=None, position=(x, y), size=(w, h), most_recent_frame=frame_index)
+               for x, y, w, h in boxes.tolist()]
+    return objects, frame_copy
+
+
+def detect_boxes(frame_data, backSub_mask, params: TrackingParameters, workspace=None):
+    """
+    Detect objects in a frame.
+
+    Args:
+        frame_data (np.ndarray): 8-bit grayscale frame.
+        backSub_mask (np.ndarray): Background subtraction foreground mask of the frame.
+        params (TrackingParameters): Uses canny_lower, canny_upper, cell_radius, detection_engine and save_overlay.
+        workspace (FrameWorkspace, optional): Buffers to reuse. If not given, new buffers are allocated.
+
+    Returns:
+        typing.Tuple[np.ndarray, np.ndarray]:
+            - (N, 4) int32 array of (x, y, w, h) bounding boxes of the detected objects.
+            - The frame to save as an overlay: the color frame with the detected objects drawn in red if
+              params.save_overlay, otherwise the normalized foreground mask. This is a workspace buffer, it is
+              overwritten by the next frame.
+    """
+    if workspace is None:
+        workspace = FrameWorkspace(frame_data.shape)
+    cell_radius = params.cell_radius
+
+    # If saving overlay frames, the original frame must be converted from gray to color
+    if params.save_overlay:
+        cv.cvtColor(frame_data, cv.COLOR_GRAY2BGR, dst=workspace.overlay)
 
     if backSub_mask.any():
-        foreground_mask = backSub_mask
+        # Foreground masks only contain 0 and 255, normalizing them changes nothing that canny would see
+        normalized_frame = backSub_mask
+    else:
+        # Process the grayscale copy of the frame for canny edge detection
+        normalized_frame = cv.normalize(frame_data, workspace.normalized, 0, 255, cv.NORM_MINMAX, dtype=cv.CV_8U)
+
+    contours = None
+    if workspace.tiler is not None and workspace.tiler.exact and normalized_frame is backSub_mask:
+        # The same opening, canny and contours, in strips on several threads
+        contours = workspace.tiler.detect(normalized_frame, workspace.edges)
+        canny_img = workspace.edges
     else:
-        foreground_mask = frame_copy
+        # Morphological operation to reduce noise
+        cleaned_frame = cv.morphologyEx(normalized_frame, cv.MORPH_OPEN, OPEN_KERNEL, dst=workspace.cleaned)
+        # Canny edge detection
+        canny_img = cv.Canny(cleaned_frame, params.canny_lower, params.canny_upper, workspace.edges)
+
+    if params.detection_engine == "components":
+        boxes = merge_components(canny_img, cell_radius, workspace)
+        # Draw the boxes in red onto the color frame
+        if params.save_overlay:
+            for x, y, w, h in boxes.tolist():
+                cv.rectangle(workspace.overlay, (x, y), (x + w - 1, y + h - 1), (0, 0, 255), 2)
+            return boxes, workspace.overlay
+        return boxes, normalized_frame
+    elif params.detection_engine != "contours":
+        raise ValueError(f"Unknown detection engine: {params.detection_engine}")
 
-    # Process the grayscale copy of the frame for canny edge detection
-    normalized_frame = cv.normalize(foreground_mask, None, 0, 255, cv.NORM_MINMAX, dtype=cv.CV_8U)
-    # Morphological operation to reduce noise
-    kernel = cv.getStructuringElement(cv.MORPH_ELLIPSE, (3, 3))
-    cleaned_frame = cv.morphologyEx(normalized_frame, cv.MORPH_OPEN, kernel)
-    # Canny edge detection
-    canny_img = cv.Canny(cleaned_frame, ui_app.canny_lower.get(), ui_app.canny_upper.get(), 5)
-    contours, hierarchy = cv.findContours(canny_img, mode=cv.RETR_EXTERNAL, method=cv.CHAIN_APPROX_SIMPLE)
+    if contours is None:
+        contours, hierarchy = cv.findContours(canny_img, mode=cv.RETR_EXTERNAL, method=cv.CHAIN_APPROX_SIMPLE)
 
-    frame_copy, contours = remove_overlapped_objects(normalized_frame, contours, ui_app.cell_radius.get())
+    _, contours = remove_overlapped_objects(normalized_frame, contours, cell_radius, mask=workspace.mask)
 
-    objects = []
-    # Create a DetectedObject instance for each contour
+    boxes = []
+    # Keep the bounding box of each contour that isn't too large
     for cnt in contours:
         x, y, w, h = cv.boundingRect(cnt)
-        if (w > ui_app.cell_radius.get() * 10) or (h > ui_app.cell_radius.get() * 10):
+        if (w > cell_radius * 10) or (h > cell_radius * 10):
             pass
         else:
-            objects.append(
-                    DetectedObject(object_id=None, position=(x, y), size=(w, h), most_recent_frame=frame_index))
+            boxes.append((x, y, w, h))
 
             # Draw the contour in red onto the color frame
-            if ui_app.save_overlay.get():
-                cv.drawContours(overlay_frame, [cnt], 0, (0, 0, 255), 2)
-                frame_copy = overlay_frame
-    return objects, frame_copy
+            if params.save_overlay:
+                cv.drawContours(workspace.overlay, [cnt], 0, (0, 0, 255), 2)
+    boxes = np.array(boxes, dtype=np.int32).reshape(-1, 4)
+    if params.save_overlay:
+        return boxes, workspace.overlay
+    return boxes, normalized_frame
+
+
+class FrameWorkspace:
+    """
+    Every full size image needed to process a frame, allocated once per file and reused for every frame. The 8-bit
+    frames themselves are held by the FramePrefetcher.
+
+    The OpenCV calls in the frame loop write into these buffers (as their dst argument) instead of allocating new
+    images for every frame.
+
+    Attributes:
+    ----------
+    foreground : np.ndarray
+        Background subtraction foreground mask.
+    normalized, cleaned, edges : np.ndarray
+        Normalized foreground, after the morphological opening, and its canny edges.
+    mask : np.ndarray
+        Merged objects (circles drawn by remove_overlapped_objects, or the dilated edges of merge_components).
+    labels : np.ndarray
+        int32 labels of connectedComponentsWithStats.
+    overlay : np.ndarray
+        Color frame for overlays.
+    tiler : StripTiler or None
+        If set, the edges and contours are found in strips on several threads, see tiling.py.
+    """
+
+    def __init__(self, shape):
+        shape = tuple(shape[:2])
+        self.shape = shape
+        self.foreground = np.empty(shape, dtype=np.uint8)
+        self.normalized = np.empty(shape, dtype=np.uint8)
+        self.cleaned = np.empty(shape, dtype=np.uint8)
+        self.edges = np.empty(shape, dtype=np.uint8)
+        self.mask = np.empty(shape, dtype=np.uint8)
+        self.labels = np.empty(shape, dtype=np.int32)
+        self.overlay = np.empty(shape + (3,), dtype=np.uint8)
+        self.tiler = None
 
-def remove_overlapped_objects(frame_copy, contours, cell_radius):
-    mask = np.zeros(frame_copy.shape[:2], dtype=np.uint8)
+
+def merge_components(edges, cell_radius, workspace=None):
+    """
+    Alternative to remove_overlapped_objects + boundingRect, for the 'components' detection engine.
+
+    Every edge pixel is grown by cell_radius in one dilation (instead of drawing a circle around each contour), so
+    objects closer than about 2 * cell_radius merge into one. The bounding boxes of all merged objects come from one
+    connectedComponentsWithStats call, and objects larger than cell_radius * 10 are removed with a mask.
+
+    For cell sized objects this gives the same objects as the 'contours' engine. Next to objects much larger than a
+    cell the two can differ: the circle drawn around a large contour also covers any cells beside it.
+
+    Args:
+        edges (np.ndarray): Canny edges of the frame.
+        cell_radius (int): Expected cell radius (px).
+
+        workspace (FrameWorkspace, optional): Buffers to reuse.
+
+    Returns:
+        np.ndarray: (N, 4) int32 array of (x, y, w, h) bounding boxes.
+    """
+    if workspace is None:
+        merged = cv.dilate(edges, disk_kernel(cell_radius))
+        _, _, stats, _ = cv.connectedComponentsWithStats(merged, connectivity=8)
+    else:
+        merged = cv.dilate(edges, disk_kernel(cell_radius), dst=workspace.mask)
+        _, _, stats, _ = cv.connectedComponentsWithStats(merged, labels=workspace.labels, connectivity=8)
+    stats = stats[1:]  # Label 0 is the background
+    small = (stats[:, cv.CC_STAT_WIDTH] <= cell_radius * 10) & (stats[:, cv.CC_STAT_HEIGHT] <= cell_radius * 10)
+    return stats[small, :4].astype(np.int32)
+
+
+@functools.lru_cache(maxsize=None)
+def disk_kernel(radius):
+    """Filled disk structuring element with the given radius"""
+    return cv.getStructuringElement(cv.MORPH_ELLIPSE, (2 * radius + 1, 2 * radius + 1))
+
+
+def remove_overlapped_objects(frame_copy, contours, cell_radius, mask=None):
+    # The mask can be a reused buffer, it only needs to be cleared
+    if mask is None:
+        mask = np.zeros(frame_copy.shape[:2], dtype=np.uint8)
+    else:
+        mask.fill(0)
 
     # Draw filled contours on a mask using bounding circles
     for cnt in contours:
@@ -251,11 +1105,12 @@ def remove_overlapped_objects(frame_copy, contours, cell_radius):
     contours, hierarchy = cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
     return frame_copy, contours
 
-def expire_objects(surviving_objects_dict, expired_objects_dict, frame_number, image_h, ui_app):
+def expire_objects(surviving_objects_dict, expired_objects_dict, frame_number, image_h, params: TrackingParameters):
+    timeout = params.timeout
     for obj_id, tracked_obj in list(surviving_objects_dict.items()):
-        if (frame_number - tracked_obj.most_recent_frame) > ui_app.timeout.get():
+        if (frame_number - tracked_obj.most_recent_frame) > timeout:
             # Removed expired objects that are not tracked
-            if tracked_obj.frames_tracked < ui_app.timeout.get():
+            if tracked_obj.frames_tracked < timeout:
                 del surviving_objects_dict[tracked_obj.object_id]
             # Add expired objects that were being tracked
             else:
@@ -266,17 +1121,18 @@ def expire_objects(surviving_objects_dict, expired_objects_dict, frame_number, i
     return surviving_objects_dict, expired_objects_dict
 
 
-def match_tracked_objects(surviving_objects_dict, object_in_frame, frame_number, ui_app):
+def match_tracked_objects(surviving_objects_dict, object_in_frame, frame_number, params: TrackingParameters):
     if not surviving_objects_dict:
         no_match = True
         return no_match, surviving_objects_dict
 
+    max_centroid_distance = params.max_centroid_distance
     candidates = {}
     # Go through each item in the tracking queue
     for obj_id, previous_object_instance in surviving_objects_dict.items():
         distance = calculate_distance(object_in_frame, previous_object_instance)
         if (object_in_frame.position[0] > previous_object_instance.position[0]) and (
-                distance < ui_app.max_centroid_distance.get()):
+                distance < max_centroid_distance):
             candidates[previous_object_instance] = distance
     if candidates:
         matched_object = min(candidates, key=candidates.get)
@@ -291,6 +1147,120 @@ def match_tracked_objects(surviving_objects_dict, object_in_frame, frame_number,
         return no_match, surviving_objects_dict
 
 
+def match_frame_objects(surviving_objects_dict, objects_in_frame_list, frame_number, params: TrackingParameters):
+    """
+    Match every object in a frame to the tracked objects at once.
+
+    Unlike match_tracked_objects, each tracked object can be claimed by at most one object in the frame.
+
+    Args:
+        surviving_objects_dict (dict): {object_id: DetectedObject} of objects currently being tracked.
+        objects_in_frame_list (List[DetectedObject]): Objects detected in the current frame.
+        frame_number (int): Current frame number.
+        params (TrackingParameters): Uses max_centroid_distance, and assignment ('greedy' or 'hungarian').
+
+    Returns:
+        typing.Tuple[List[DetectedObject], dict]:
+            - Objects in the frame that did not match a tracked object, in their original order.
+            - surviving_objects_dict, with matched objects replacing the objects they matched.
+    """
+    if not surviving_objects_dict or not objects_in_frame_list:
+        return list(objects_in_frame_list), surviving_objects_dict
+
+    tracked_objects = list(surviving_objects_dict.values())
+    frame_boxes = np.array([(*obj.position, *obj.size) for obj in objects_in_frame_list], dtype=np.int64)
+    tracked_boxes = np.array([(*obj.position, *obj.size) for obj in tracked_objects], dtype=np.int64)
+    frame_indices, tracked_indices = assign_boxes(frame_boxes, tracked_boxes, params.max_centroid_distance,
+                                                  params.assignment)
+
+    matched = np.zeros(len(objects_in_frame_list), dtype=bool)
+    for frame_index, tracked_index in zip(frame_indices, tracked_indices):
+        object_in_frame = objects_in_frame_list[frame_index]
+        matched_object = tracked_objects[tracked_index]
+        object_in_frame.object_id = matched_object.object_id
+        object_in_frame.most_recent_frame = frame_number
+        object_in_frame.frames_tracked = matched_object.frames_tracked + 1
+        surviving_objects_dict[object_in_frame.object_id] = object_in_frame
+        matched[frame_index] = True
+
+    unmatched_objects = [obj for obj, is_matched in zip(objects_in_frame_list, matched) if not is_matched]
+    return unmatched_objects, surviving_objects_dict
+
+
+def assign_boxes(frame_boxes, tracked_boxes, max_centroid_distance, assignment="greedy"):
+    """
+    One-to-one assignment of boxes in the current frame to tracked boxes.
+
+    A pair can only be matched if the box in the frame is to the right of the tracked box (objects flow to the right),
+    and their centers are closer than max_centroid_distance. These are the same rules as match_tracked_objects.
+
+    Args:
+        frame_boxes (np.ndarray): (N, 4) array of (x, y, w, h) boxes in the current frame.
+        tracked_boxes (np.ndarray): (M, 4) array of (x, y, w, h) tracked boxes.
+        max_centroid_distance (int): Max distance (px) between matched centers.
+        assignment (str): 'greedy' matches the closest remaining pair first.
+            'hungarian' minimizes the total distance of the largest possible set of matches.
+
+    Returns:
+        typing.Tuple[np.ndarray, np.ndarray]: Indices into frame_boxes, and the indices into tracked_boxes they matched.
+    """
+    # Every pair is a candidate
+    pair_frame, pair_tracked = np.indices((len(frame_boxes), len(tracked_boxes))).reshape(2, -1)
+    return assign_pairs(frame_boxes, tracked_boxes, pair_frame, pair_tracked, max_centroid_distance, assignment)
+
+
+def assign_pairs(frame_boxes, tracked_boxes, pair_frame, pair_tracked, max_centroid_distance, assignment="greedy"):
+    """
+    Same as assign_boxes, but only the candidate pairs (pair_frame[i], pair_tracked[i]) are considered.
+
+    Ties are broken by frame index, then tracked index, so the result doesn't depend on the order of the pairs.
+    """
+    empty = np.empty(0, dtype=np.intp)
+    if len(pair_frame) == 0:
+        return empty, empty
+    frame_boxes = np.asarray(frame_boxes)
+    tracked_boxes = np.asarray(tracked_boxes)
+
+    # Distance between the centers of every candidate pair
+    frame_centers = frame_boxes[:, :2] + frame_boxes[:, 2:] // 2
+    tracked_centers = tracked_boxes[:, :2] + tracked_boxes[:, 2:] // 2
+    offsets = frame_centers[pair_frame] - tracked_centers[pair_tracked]
+    distances = np.sqrt((offsets ** 2).sum(axis=1))
+
+    # Objects can only move forward, and not too far
+    valid = (frame_boxes[pair_frame, 0] > tracked_boxes[pair_tracked, 0]) & (distances < max_centroid_distance)
+    if not valid.any():
+        return empty, empty
+    pair_frame, pair_tracked, distances = pair_frame[valid], pair_tracked[valid], distances[valid]
+
+    if assignment == "hungarian":
+        # Cost matrix of only the rows and columns that have a valid pair.
+        # Invalid pairs cost more than every valid pair combined, so they are only used when nothing else fits
+        frame_rows, frame_inverse = np.unique(pair_frame, return_inverse=True)
+        tracked_columns, tracked_inverse = np.unique(pair_tracked, return_inverse=True)
+        invalid_cost = distances.sum() + 1
+        cost = np.full((len(frame_rows), len(tracked_columns)), invalid_cost)
+        cost[frame_inverse, tracked_inverse] = distances
+        rows, columns = linear_sum_assignment(cost)
+        keep = cost[rows, columns] < invalid_cost
+        return frame_rows[rows[keep]], tracked_columns[columns[keep]]
+    elif assignment == "greedy":
+        order = np.lexsort((pair_tracked, pair_frame, distances))
+        frame_used = set()
+        tracked_used = set()
+        frame_indices, tracked_indices = [], []
+        for frame_index, tracked_index in zip(pair_frame[order], pair_tracked[order]):
+            if frame_index in frame_used or tracked_index in tracked_used:
+                continue
+            frame_used.add(frame_index)
+            tracked_used.add(tracked_index)
+            frame_indices.append(frame_index)
+            tracked_indices.append(tracked_index)
+        return np.array(frame_indices, dtype=np.intp), np.array(tracked_indices, dtype=np.intp)
+    else:
+        raise ValueError(f"Unknown assignment method: {assignment}")
+
+
 def add_new_objects(new_object, objects_in_previous_frame_dict, next_new_id, frame_number):
     new_object.object_id = next_new_id
     new_object.most_recent_frame = frame_number
@@ -307,7 +1277,7 @@ def calculate_distance(detected_object1: DetectedObject, detected_object2: Detec
         (((possible_center[0] - tracked_center[0]) ** 2) + ((possible_center[1] - tracked_center[1]) ** 2)) ** 0.5)
     return distance
 
-def export_to_csv(expired_objects_dict, csv_filename: str) -> None:
+def export_to_csv(expired_objects_dict, csv_filename: str, verbose: bool = True) -> typing.Tuple[int, int]:
     with open(csv_filename, 'w', newline='') as csvfile:
         fieldnames = ['object_id', 'x_pos', 'y_pos', 'x_size', 'y_size', 'most_recent_frame', 'frames_tracked',
                       'DEP_response']
@@ -332,27 +1302,57 @@ def export_to_csv(expired_objects_dict, csv_filename: str) -> None:
                 'frames_tracked': obj.frames_tracked,
                 'DEP_response': obj.DEP_outlet
             })
-        print("\nObject Detection Results:")
-        print(f"\tCells counted: {len(expired_objects_dict)}")
-        print(f"\tDEP True: {DEP_true}")
-        print(f"\tDEP False: {DEP_false}")
-        print(f"{csv_filename} saved")
+        if verbose:
+            print("\nObject Detection Results:")
+            print(f"\tCells counted: {len(expired_objects_dict)}")
+            print(f"\tDEP True: {DEP_true}")
+            print(f"\tDEP False: {DEP_false}")
+            print(f"{csv_filename} saved")
+    return DEP_true, DEP_false
 
 
-def export_trajectories_to_csv(objects_list, csv_filename: str) -> None:
+def export_counts_to_csv(nd2_file_path: str, counts: typing.Mapping[str, int], csv_filename: str,
+                         verbose: bool = True) -> None:
+    """Saves the counts of count_objects as one row"""
     with open(csv_filename, 'w', newline='') as csvfile:
-        fieldnames = ['frame', 'object_id', 'x_pos', 'y_pos', 'x_size', 'y_size']
+        fieldnames = ['file', 'cells_counted', 'DEP_true', 'DEP_false']
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
         writer.writeheader()
-        for obj in objects_list:
-            for frame, position in obj.position_history.items():
-                writer.writerow({
-                    'frame': frame,
-                    'object_id': obj.object_id,
-                    'x_pos': position[0],
-                    'y_pos': position[1],
-                    'x_size': obj.size[0],
-                    'y_size': obj.size[1]
-                })
-    print(f"\n{csv_filename} saved")
+        writer.writerow({'file': nd2_file_path, **{key: counts[key] for key in fieldnames[1:]}})
+    if verbose:
+        print("\nObject Detection Results:")
+        print(f"\tCells counted: {counts['cells_counted']}")
+        print(f"\tDEP True: {counts['DEP_true']}")
+        print(f"\tDEP False: {counts['DEP_false']}")
+        print(f"{csv_filename} saved")
+
+
+def export_trajectories_to_csv(objects_list, csv_filename: str, verbose: bool = True) -> None:
+    """objects_list can be a TrackTable, or a list of DetectedObject"""
+    with open(csv_filename, 'w', newline='') as csvfile:
+        fieldnames = TRAJECTORY_FIELDNAMES
+        if isinstance(objects_list, TrackTable):
+            # Write the columns directly, no DetectedObject needed
+            writer = csv.writer(csvfile)
+            writer.writerow(fieldnames)
+            write_trajectory_rows(writer, objects_list)
+        else:
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer.writeheader()
+            for obj in objects_list:
+                for frame, position in obj.position_history.items():
+                    writer.writerow({
+                        'frame': frame,
+                        'object_id': obj.object_id,
+                        'x_pos': position[0],
+                        'y_pos': position[1],
+                        'x_size': obj.size[0],
+                        'y_size': obj.size[1]
+                    })
+    if verbose:
+        print(f"\n{csv_filename} saved")
+
 
+def write_trajectory_rows(writer, table: TrackTable) -> None:
+    """Writes the rows of a TrackTable with a csv.writer, in the trajectory .csv format"""
+    writer.writerows(zip(*(table.column(name).tolist() for name in ('frame', 'object_id', 'x', 'y', 'w', 'h'))))
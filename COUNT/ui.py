@@ -5,8 +5,8 @@ from tkinter import filedialog
 
 import cv2
 import numpy as np
-from pims import ND2Reader_SDK
-from COUNT import tracking
+from COUNT import background, sources, tracking
+from COUNT.parameters import TrackingParameters
 """
 This code handles the creation of the user interface (UI).
 
@@ -28,8 +28,10 @@ class ROISelectionApp:
         self.folder_path = tk.StringVar()  # Variable to store the selected folder path
         self.csv_folder_path = tk.StringVar(value=self.settings.get("csv_save_path"))  # Default csv save path
         self.overlay_path = ""
-        self.roi_height = tk.IntVar(value=2048)  # Default value for ROI Height
-        self.roi_width = tk.IntVar(value=2048)  # Default value for ROI Width
+        self.roi_x = tk.IntVar(value=self.settings.get("roi_x", 0))  # Left edge of the ROI (px)
+        self.roi_y = tk.IntVar(value=self.settings.get("roi_y", 0))  # Top edge of the ROI (px)
+        self.roi_height = tk.IntVar(value=self.settings.get("roi_height", 0))  # ROI Height, 0: to the edge of the frame
+        self.roi_width = tk.IntVar(value=self.settings.get("roi_width", 0))  # ROI Width, 0: to the edge of the frame
         self.canny_upper = tk.IntVar(
             value=self.settings.get("canny_upper"))  # Default value for upper canny threshold (3:1 ratio)
         self.canny_lower = tk.IntVar(value=self.settings.get("canny_lower"))  # Default value for lower canny threshold
@@ -123,6 +125,13 @@ class ROISelectionApp:
         self.cell_radius_entry = tk.Entry(self.master, textvariable=self.cell_radius)
         self.cell_radius_entry.grid(row=6, column=1, padx=5, pady=5)
 
+        # Region of interest input fields, only this part of the frames is tracked
+        for row, (text, variable) in enumerate([("ROI X (px):", self.roi_x), ("ROI Y (px):", self.roi_y),
+                                                ("ROI Width (px):", self.roi_width),
+                                                ("ROI Height (px):", self.roi_height)], start=2):
+            tk.Label(self.master, text=text, anchor=justification).grid(sticky="w", row=row, column=2, padx=5, pady=5)
+            tk.Entry(self.master, textvariable=variable).grid(row=row, column=3, padx=5, pady=5)
+
         # Save overlay checkbox
         self.save_overlay_checkbox = tk.Checkbutton(self.master, text="Save Overlay?", variable=self.save_overlay,
                                                     onvalue=True, offvalue=False, command=self.on_checkbox_click)
@@ -147,23 +156,11 @@ class ROISelectionApp:
                 self.settings = json.load(file)
         except FileNotFoundError:
             print("no settings.json found... using defaults")
-            self.settings = {"canny_upper": 255,
-                             "canny_lower": 85,
-                             "max_centroid_distance": 70,
-                             "timeout": 5,
-                             "cell_radius": 6,
-                             "save_overlay": False,
-                             "csv_save_path": "results/"}
+            self.settings = TrackingParameters().to_settings()
 
     def save_settings(self):
-        settings = {"canny_upper": self.canny_upper.get(),
-                    "canny_lower": self.canny_lower.get(),
-                    "max_centroid_distance": self.max_centroid_distance.get(),
-                    "timeout": self.timeout.get(),
-                    "cell_radius": self.cell_radius.get(),
-                    "save_overlay": self.save_overlay.get(),
-                    "csv_save_path": self.csv_folder_path.get()
-                    }
+        # Keys of the settings file that aren't tracking parameters are kept too
+        settings = {**self.settings, **TrackingParameters.from_ui(self).to_settings()}
         with open(self.SETTINGS_PATH, "w") as file:
             json.dump(settings, file, indent=4)
         tk.messagebox.showinfo("Settings", f"Settings saved to\n{self.SETTINGS_PATH}")
@@ -172,10 +169,11 @@ class ROISelectionApp:
         tk.messagebox.showinfo("Help", "no help here")
 
     def choose_file(self):
-        self.file_path = filedialog.askopenfilename(filetypes=[("ND2 files", "*.nd2")])
-        with ND2Reader_SDK(self.file_path) as nd2_file:
-            self.roi_width.set(nd2_file.metadata['width'])
-            self.roi_height.set(nd2_file.metadata['height'])
+        extensions = " ".join(f"*{extension}" for extension in sources.SOURCES)
+        self.file_path = filedialog.askopenfilename(filetypes=[("Video files", extensions), ("ND2 files", "*.nd2")])
+        with sources.open_source(self.file_path) as nd2_file:
+            self.roi_width.set(nd2_file.width)
+            self.roi_height.set(nd2_file.height)
         print("Selection:", self.file_path)
 
     def choose_folder(self):
@@ -193,7 +191,8 @@ class ROISelectionApp:
     def input_handling(self):
         # Handles if the selection was for a folder or a file.
         if self.folder_path.get():
-            self.files = [os.path.join(self.folder_path.get(), f) for f in os.listdir(self.folder_path.get())]
+            self.files = [os.path.join(self.folder_path.get(), f) for f in os.listdir(self.folder_path.get())
+                          if sources.is_supported(f)]
         if self.file_path:
             self.files = [self.file_path]
 
@@ -254,12 +253,12 @@ class ROISelectionApp:
 
     def edge_detection_handling(self, frame_index):
         """Edge detection for UI preview"""
-        backSub = cv2.createBackgroundSubtractorMOG2(varThreshold=16, detectShadows=False)
-        with ND2Reader_SDK(self.files[0]) as nd2_file:
-            if 'm' in nd2_file.sizes.keys():  # new nikon weirdness
-                nd2_file.iter_axes = 'm'
-            # MOG2 Background Method:
-            for frame in nd2_file[:frame_index + 1]:  # First five frames to calculate background
+        params = TrackingParameters.from_ui(self)
+        backSub = background.create_background(params)
+        with sources.open_source(self.files[0]) as full_frames:
+            nd2_file = sources.crop(full_frames, params.roi_x, params.roi_y, params.roi_width, params.roi_height)
+            # Background model, see background.py:
+            for frame in (nd2_file[i] for i in range(frame_index + 1)):  # First five frames to calculate background
                 frame = cv2.normalize(frame, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
                 foreground_mask = backSub.apply(frame)
 
@@ -274,14 +273,14 @@ class ROISelectionApp:
             # Morphological operation to reduce noise
             kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
             normalized_frame = cv2.morphologyEx(normalized_frame, cv2.MORPH_OPEN, kernel)
-            canny_img = cv2.Canny(normalized_frame, self.canny_lower.get(), self.canny_upper.get(), 3)
+            canny_img = cv2.Canny(normalized_frame, params.canny_lower, params.canny_upper, 3)
             contours, hierarchy = cv2.findContours(canny_img, mode=cv2.RETR_EXTERNAL, method=cv2.CHAIN_APPROX_SIMPLE)
 
-            _, contours = tracking.remove_overlapped_objects(normalized_frame, contours, self.cell_radius.get())
+            _, contours = tracking.remove_overlapped_objects(normalized_frame, contours, params.cell_radius)
             total_contours = len(contours)
             for index, cnt in enumerate(contours):
                 x, y, w, h = cv2.boundingRect(cnt)
-                if (w > self.cell_radius.get() * 10) or (h > self.cell_radius.get() * 10):
+                if (w > params.cell_radius * 10) or (h > params.cell_radius * 10):
                     total_contours -= 1
                 else:
                     cv2.drawContours(frame_copy, [cnt], 0, (0, 0, 255), 2)